@@ -9,6 +9,11 @@ Le programme utilise le module "requests" pour réaliser la communication HTTP.
 C'est la façon moderne et simple d'accéder au services WEB sous Python. Ainsi,
 l'accès à une plateforme IoT via leur API REST est devenu très simple.
 
+Seuls les champs dont la valeur s'écarte de plus de BANDE_MORTE de la dernière
+valeur envoyée (ou qui n'ont pas été envoyés depuis SILENCE_MAX secondes) sont
+transmis. Une requête sans aucun champ n'est pas faite (voir
+Lab8/i2c_Coordonnateur/bande_morte.py).
+
 (voir les notes de cours "Style REST (I)")
 
 Convention PEP 8 (Python Enhencement Proposal 8):
@@ -26,7 +31,11 @@ Novembre 2021
 # -------------------------------------------------------------------
 # Les modules utiles
 # -------------------------------------------------------------------
-import requests, time
+import os, sys, requests, time
+# Politique de bande morte partagée avec le coordonnateur (Lab8)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'Lab8', 'i2c_Coordonnateur'))
+from bande_morte import PolitiqueBandeMorte
 
 # -------------------------------------------------------------------
 # ThingSpeak
@@ -48,28 +57,48 @@ DELAY = 20              # interval de transmission
 # -------------------------------------------------------------------
 DATA = ((32, 27), (34, 30), (28, 25), (30, 31), (33, 26))
 
+# Écart minimal (par champ) pour envoyer une valeur et durée max (sec) sans envoi
+BANDE_MORTE = {'field1' : 2, 'field2' : 2}
+SILENCE_MAX = {'field1' : 300, 'field2' : 300}
+
 # -------------------------------------------------------------------
 # Fonction principale
 # -------------------------------------------------------------------
 def main():
   # Note: f-string disponible depuis Python 3.6
   print(f'Envoyer {len(DATA)} données dans les {len(DATA[0])} champs du canal (interval de {DELAY} sec)')
+  politique = PolitiqueBandeMorte(BANDE_MORTE, SILENCE_MAX)
   for d in DATA:
     try:
-      print(f'Écrire {d[0]} et {d[1]} dans les champs...', end=' ')         
+      # Garder uniquement les champs qui ont assez changé
+      t_ns = time.time_ns()
+      champs = {f'field{k + 1}' : v for k, v in enumerate(d)
+                if politique.a_transmettre(THINGSPK_API_KEY, f'field{k + 1}', v, t_ns)}
+      if not champs:
+        print(f'{d[0]} et {d[1]}: aucun changement, rien à envoyer')
+        time.sleep(DELAY)
+        continue
+
+      print(f'Écrire {champs} dans les champs...', end=' ')
       resp = requests.get(THINGSPK_URL,
                           # 10 secondes pour connection et read timeout
                           timeout = (10, 10),
                           # Parmaètres de cette requête
-                          params = { "api_key" : THINGSPK_API_KEY,
-                                      "field1"  : d[0],
-                                      "field2"  : d[1]}
+                          params = { "api_key" : THINGSPK_API_KEY, **champs}
                           )
 
       print(f"ThingSpeak GET response: {resp.status_code}")
-      # Vérifier la réponse de ThingSpeak
+      # Vérifier la réponse de ThingSpeak. Les champs ne deviennent les
+      # dernières valeurs envoyées que si ThingSpeak les a reçus: il répond
+      # 200 avec le corps '0' quand il refuse la mise à jour (délai entre
+      # deux envois non respecté, ...).
       if resp.status_code != 200:
         print("Erreur de communication détectée!")
+      elif resp.text.strip() == '0':
+        print("Mise à jour refusée par ThingSpeak!")
+      else:
+        for champ, v in champs.items():
+          politique.confirmer(THINGSPK_API_KEY, champ, v, t_ns)
 
       # Attendre 20 secondes (licence gratuite a un délai de 15 secondes)
       time.sleep(DELAY)
@@ -41,13 +41,14 @@ from matplotlib import pyplot
 from pandas import read_csv
 from pandas import DataFrame
 from pandas import concat
-from sklearn.preprocessing import MinMaxScaler
 from sklearn.preprocessing import LabelEncoder
 from sklearn.metrics import mean_absolute_error
 from tensorflow.python.keras.models import Sequential
 from tensorflow.python.keras.layers import Dense
 from tensorflow.python.keras.layers import LSTM
 from tensorflow.python.keras.callbacks import EarlyStopping
+from points_controle import PointDeControle, charger_reprise
+from normalisation import NormalisateurIncremental
 # Pour mesurer la durée d'exécution de ce programme
 import time
 
@@ -59,12 +60,22 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 entree=20
 sortie=4
 couche=3
+# Fichiers produits par l'apprentissage et utilisés par le prédicteur en ligne
+# (voir predicteur_en_ligne.py)
+FICHIER_RESEAU = 'reseau_lstm.h5'
+FICHIER_NORMALISATION = 'normalisation.npz'
+# Points de contrôle de l'apprentissage (voir points_controle.py)
+REPERTOIRE_POINTS = 'points_controle'
+PERIODE_POINTS = 10
+# Nombre de fenêtres (lignes décalées) dans l'ensemble d'apprentissage
+NB_APPRENTISSAGE = 1500
 
 
 # --------------------------------------------------------------------
-# traitement_donnees
+# lire_donnees
 # --------------------------------------------------------------------
-def traitement_donnees(): 
+def lire_donnees():
+  '''Lire les signaux de da.csv (float32, non normalisés).'''
   # --------------------------------------------------------------------
   # Lire le fichier de données et extraire le nom des colonnes
   # --------------------------------------------------------------------
@@ -76,13 +87,23 @@ def traitement_donnees():
   # On utilise un encodeur de scikit-learn
   encoder = LabelEncoder()
   # Forcer toutes les données en type float à 32 bits
-  vals = vals.astype('float32')
+  return vals.astype('float32')
+
+
+# --------------------------------------------------------------------
+# traitement_donnees
+# --------------------------------------------------------------------
+def traitement_donnees(): 
+  vals = lire_donnees()
   # En bonus, on effectuera la normalisation des donneées entre [0, 1]
-  # On utilise une fonction de normalisation de scikit-learn
-  scaler = MinMaxScaler(feature_range = (0, 1))
-  vals_normalisees = scaler.fit_transform(vals)
+  # Le min/max est appris uniquement sur les lignes utilisées par les fenêtres
+  # d'apprentissage: la validation ne doit pas influencer la normalisation.
+  # Le normalisateur est ensuite figé pour être sauvegardé avec le réseau.
+  scaler = NormalisateurIncremental(vals.shape[1])
+  scaler.partial_fit(vals[:NB_APPRENTISSAGE + entree + sortie - 1]).figer()
+  vals_normalisees = scaler.transformer(vals, out = vals)
 
-  return vals_normalisees
+  return vals_normalisees, scaler
 
 # --------------------------------------------------------------------
 # conversion_format
@@ -102,12 +123,28 @@ def conversion_format(donnees):
   return vals_converties
 
 
-def main():
+# --------------------------------------------------------------------
+# construire_reseau
+# --------------------------------------------------------------------
+def construire_reseau(forme_entree):
+  '''Construire et compiler le réseau: couche+1 LSTM à 50 cellules et une
+  couche Dense pour les sortie x 3 valeurs à prédire.'''
+  reseau = Sequential()
+  reseau.add(LSTM(50, return_sequences = True, input_shape=forme_entree))
+  for i in range(couche-1):
+    reseau.add(LSTM(50,return_sequences = True))
+  reseau.add(LSTM(50))
+  reseau.add(Dense(sortie*3))
+  reseau.compile(loss='mae', optimizer='adam')
+  return reseau
+
+
+def main(reprise = False):
   # -----------------------------------------------------------------------------
   # 0) Lire et normaliser les données
   # -----------------------------------------------------------------------------
   print("Lire les données du ficher 'da.csv' et les normaliser...")
-  donnees_normalisees = traitement_donnees()
+  donnees_normalisees, scaler = traitement_donnees()
 
   # -----------------------------------------------------------------------------
   # 1) Convertir les données normalisées en format de décalage
@@ -133,8 +170,8 @@ def main():
   #       keras
   # ------------------------------------------------------------------------- 
   print("Diviser les données en ensemble d'apprentissage et ensemble de validation")
-  apprentissage = donnees_converties.values[:1500, :]
-  validation = donnees_converties.values[1500:, :]
+  apprentissage = donnees_converties.values[:NB_APPRENTISSAGE, :]
+  validation = donnees_converties.values[NB_APPRENTISSAGE:, :]
   # Pour chaque ensemble, séparer en X (entrée) et Y (sortie)
   apprentissage_X, apprentissage_Y = apprentissage[:, :entree*3], apprentissage[:, entree*3:(entree+sortie)*3]
   validation_X, validation_Y = validation[:, :entree*3], validation[:, entree*3:(entree+sortie)*3]
@@ -159,14 +196,16 @@ def main():
   # --------------------------------------------------------------------
   # Pour cet exemple on utilisera 1 couche LSTM à 50 cellules de némoire.
   # --------------------------------------------------------------------
-  print('Construire le modèle prédictif...')
-  reseau = Sequential()
-  reseau.add(LSTM(50, return_sequences = True, input_shape=(apprentissage_X.shape[1], apprentissage_X.shape[2])))
-  for i in range(couche-1):
-    reseau.add(LSTM(50,return_sequences = True))
-  reseau.add(LSTM(50))
-  reseau.add(Dense(sortie*3))
-  reseau.compile(loss='mae', optimizer='adam')
+  # En mode reprise, le réseau (et l'état de l'optimiseur) vient du dernier
+  # point de contrôle et l'apprentissage continue à l'epoch atteinte.
+  reprise_chargee = charger_reprise(REPERTOIRE_POINTS) if reprise else None
+  if reprise_chargee is not None:
+    reseau, epoque_initiale, meilleur = reprise_chargee
+    print(F"Reprendre l'apprentissage à l'epoch {epoque_initiale}...")
+  else:
+    print('Construire le modèle prédictif...')
+    reseau = construire_reseau((apprentissage_X.shape[1], apprentissage_X.shape[2]))
+    epoque_initiale, meilleur = 0, float('inf')
 
   # --------------------------------------------------------------------
   # 4) Entraîner le réseau
@@ -175,11 +214,18 @@ def main():
   # Utiliser un ensemble de validation pour évaluer avec la performance
   # de l'apprentissage.
   # --------------------------------------------------------------------
-  fonction_es=EarlyStopping(monitor='val_loss',mode='min', verbose=1, patience=30)
+  # Les meilleurs poids (et non les derniers) sont conservés à l'arrêt et un
+  # point de contrôle est sauvegardé à toutes les PERIODE_POINTS epochs.
+  # --------------------------------------------------------------------
+  fonction_es=EarlyStopping(monitor='val_loss',mode='min', verbose=1, patience=30,
+                            restore_best_weights=True)
+  points = PointDeControle(REPERTOIRE_POINTS, PERIODE_POINTS, meilleur = meilleur,
+                           epoque = epoque_initiale)
   print("Entraîner le modèle prédictif avec des lots de 72, 50 epochs et afficher l'historique...")
   history = reseau.fit(apprentissage_X, apprentissage_Y, epochs = 500, batch_size = 72,\
                       validation_data = (validation_X, validation_Y), verbose = True,\
-                      shuffle = False, callbacks=[fonction_es])
+                      shuffle = False, callbacks=[fonction_es, points],\
+                      initial_epoch = epoque_initiale)
 
   # --------------------------------------------------------------------
   # 5) Valider le réseau
@@ -190,6 +236,16 @@ def main():
   mae += mean_absolute_error(validation_Y, Y_predit)
   print(F'Validation du réseau: MAE = {mean(mae):.3f}')
 
+  # --------------------------------------------------------------------
+  # 6) Sauvegarder le réseau et les bornes de la normalisation
+  # --------------------------------------------------------------------
+  # Le prédicteur en ligne a besoin des deux pour normaliser les
+  # échantillons reçus du coordonnateur et dénormaliser ses prédictions.
+  # --------------------------------------------------------------------
+  print(F"Sauvegarder le réseau dans '{FICHIER_RESEAU}'...")
+  reseau.save(FICHIER_RESEAU)
+  scaler.sauvegarder(FICHIER_NORMALISATION, entree = entree, sortie = sortie)
+
   return history
 
 
@@ -197,11 +253,17 @@ def main():
 # Fonction principale
 # *****************************************************************************
 if __name__ == "__main__":
+  # --reprendre: continuer à partir du dernier point de contrôle
+  import argparse
+  parser = argparse.ArgumentParser(description = "Apprentissage du réseau LSTM")
+  parser.add_argument('--reprendre', action = 'store_true',
+                      help = "reprendre à partir du dernier point de contrôle")
+  args = parser.parse_args()
   # -----------------------------------------------------------------------------
   # Démarrer la mesure de la durée d'exécution
   # -----------------------------------------------------------------------------
   start = time.perf_counter()
-  hist = main()
+  hist = main(reprise = args.reprendre)
   # -----------------------------------------------------------------------------
   # Calculer et afficher la durée d'exécution
   # -----------------------------------------------------------------------------
@@ -14,6 +14,9 @@ l'apprentissage supervisé par une fenêtre glissante (lag method).
 from pandas import read_csv
 from pandas import DataFrame
 from pandas import concat
+# Pour les fenêtres glissantes sans copie
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 # Pour utiliser sklearn pour transformer les données
 from sklearn.preprocessing import LabelEncoder
 from sklearn.preprocessing import MinMaxScaler
@@ -81,7 +84,32 @@ def signaux_apprentissage_supervise(data, largeur_fen_entree = 1, largeur_fen_so
   if enlever_nan:
     donnees.dropna(inplace = True)
   return donnees
- 
+
+# -----------------------------------------------------------------------------
+# fenetres_glissantes
+# -----------------------------------------------------------------------------
+def fenetres_glissantes(data, largeur_fen_entree = 1, largeur_fen_sortie = 1):
+  '''Même résultat que signaux_apprentissage_supervise(..., enlever_nan = True)
+  mais sous forme d'une vue numpy, sans copier les données.
+
+  Entrées:
+    - data: un tableau numpy 2D (temps, signaux) contigu en mémoire
+    - largeur_fen_entree, largeur_fen_sortie: comme ci-dessus
+
+  Sortie:
+    - une vue en lecture seule (nb. fenêtres, (entree + sortie) x nb. signaux)
+      dont les colonnes sont dans le même ordre que le dataframe décalé.
+
+  Une ligne des données décalées est simplement une tranche contiguë de
+  (entree + sortie) x nb. signaux valeurs du tableau aplati; la ligne suivante
+  commence nb. signaux valeurs plus loin. On obtient donc toutes les lignes
+  avec sliding_window_view() sur le tableau aplati et un pas de nb. signaux.
+  '''
+  data = np.ascontiguousarray(data)
+  n_vars = data.shape[1]
+  largeur = (largeur_fen_entree + largeur_fen_sortie) * n_vars
+  return sliding_window_view(data.reshape(-1), largeur)[::n_vars]
+
 # *****************************************************************************
 # Tester la fonction de conversion
 # Exécuter ce module pour voir un exemple de la fonction de conversion à
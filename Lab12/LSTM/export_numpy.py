@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''export_numpy Exporter le réseau LSTM pour l'inférence légère sur CPU.
+
+-------------------------------------------------------------------------------
+Le réseau construit par apprentissage_signaux_multiple.main() est une pile de
+couches LSTM (50 cellules) suivie d'une couche Dense. Pour l'évaluer sur un
+objet connecté, il n'est pas nécessaire de charger TensorFlow au complet:
+
+  - exporter_numpy() extrait les poids du modèle Sequential dans un fichier
+    .npz (float32 ou int8 avec un facteur d'échelle par colonne);
+  - ReseauNumpy refait la propagation avant avec NumPy seulement;
+  - exporter_tflite() produit un fichier TFLite pour ceux qui préfèrent
+    l'interpréteur tflite_runtime.
+
+ReseauNumpy offre predict() et predict_on_batch() avec le même shape d'entrée
+que keras: (taille de l'échantillon, pas de temps, nombre de valeurs dans le
+pas). Il peut donc remplacer le réseau keras dans PredicteurEnLigne.
+
+Note: L'ordre des portes des poids keras est (i, f, c, o) et les fonctions
+d'activation sont lues dans la configuration de chaque couche (la version
+keras 2.1.6-tf du cours utilise 'hard_sigmoid' pour les portes).
+-------------------------------------------------------------------------------
+
+Convention PEP 8 (Python Enhencement Proposal 8):
+  Variables -> snake_case
+  Class -> PascalCase
+  Constante -> SNAKE_CASE
+
+'''
+
+import numpy as np
+
+# Fonctions d'activation supportées (définitions de keras 2)
+ACTIVATIONS = {
+  'linear': lambda x: x,
+  'tanh': np.tanh,
+  'sigmoid': lambda x: 1.0 / (1.0 + np.exp(-x)),
+  'hard_sigmoid': lambda x: np.clip(0.2 * x + 0.5, 0.0, 1.0),
+  'relu': lambda x: np.maximum(x, 0.0),
+}
+
+
+# -----------------------------------------------------------------------------
+# Quantification int8 (symétrique, une échelle par colonne)
+# -----------------------------------------------------------------------------
+def quantifier_int8(w):
+  '''Retourner (q, echelle) tels que w ~ q * echelle.'''
+  echelle = np.abs(w).max(axis = 0) / 127.0
+  echelle[echelle == 0.0] = 1.0
+  q = np.round(w / echelle).astype(np.int8)
+  return q, echelle.astype(np.float32)
+
+
+# -----------------------------------------------------------------------------
+# exporter_numpy
+# -----------------------------------------------------------------------------
+def exporter_numpy(reseau, fichier, int8 = False):
+  '''Sauvegarder les poids d'un modèle Sequential (LSTM/Dense) dans un .npz.
+
+  Entrées:
+    - reseau: modèle keras Sequential entraîné
+    - fichier: nom du fichier .npz
+    - int8: quantifier les matrices de poids en int8 (les biais restent float32)
+  '''
+  tableaux = {}
+  types = []
+  for n, couche in enumerate(reseau.layers):
+    config = couche.get_config()
+    nom = type(couche).__name__
+    poids = [np.asarray(w, dtype = np.float32) for w in couche.get_weights()]
+    if nom == 'LSTM':
+      types.append('LSTM')
+      tableaux[F'c{n}_activation'] = np.array(config['activation'])
+      tableaux[F'c{n}_activation_porte'] = np.array(config['recurrent_activation'])
+      tableaux[F'c{n}_sequences'] = np.array(config['return_sequences'])
+      matrices = {'noyau': poids[0], 'recurrent': poids[1]}
+      biais = poids[2] if config['use_bias'] else np.zeros(poids[0].shape[1], np.float32)
+    elif nom == 'Dense':
+      types.append('Dense')
+      tableaux[F'c{n}_activation'] = np.array(config['activation'])
+      matrices = {'noyau': poids[0]}
+      biais = poids[1] if config['use_bias'] else np.zeros(poids[0].shape[1], np.float32)
+    else:
+      raise ValueError(F"Couche '{nom}' non supportée par l'export NumPy.")
+
+    for cle, w in matrices.items():
+      if int8:
+        tableaux[F'c{n}_{cle}'], tableaux[F'c{n}_{cle}_echelle'] = quantifier_int8(w)
+      else:
+        tableaux[F'c{n}_{cle}'] = w
+    tableaux[F'c{n}_biais'] = biais
+
+  np.savez_compressed(fichier, types = np.array(types), **tableaux)
+
+
+# -----------------------------------------------------------------------------
+# exporter_tflite
+# -----------------------------------------------------------------------------
+def exporter_tflite(reseau, fichier, int8 = False):
+  '''Convertir le modèle en TFLite (quantification dynamique int8 en option).'''
+  import tensorflow as tf
+  convertisseur = tf.lite.TFLiteConverter.from_keras_model(reseau)
+  # Les LSTM keras peuvent nécessiter des opérations TF non natives à TFLite
+  convertisseur.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS,
+                                             tf.lite.OpsSet.SELECT_TF_OPS]
+  if int8:
+    convertisseur.optimizations = [tf.lite.Optimize.DEFAULT]
+  with open(fichier, 'wb') as f:
+    f.write(convertisseur.convert())
+
+
+# -----------------------------------------------------------------------------
+# ReseauNumpy
+# -----------------------------------------------------------------------------
+class ReseauNumpy:
+  '''Propagation avant d'une pile LSTM/Dense exportée par exporter_numpy().'''
+  def __init__(self, fichier):
+    donnees = np.load(fichier)
+    self.couches = []
+    for n, nom in enumerate(donnees['types']):
+      def matrice(cle):
+        w = donnees[F'c{n}_{cle}']
+        if w.dtype == np.int8:
+          # Déquantifier une seule fois au chargement
+          w = w.astype(np.float32) * donnees[F'c{n}_{cle}_echelle']
+        return np.ascontiguousarray(w, dtype = np.float32)
+      couche = {'type': str(nom), 'noyau': matrice('noyau'),
+                'biais': donnees[F'c{n}_biais'].astype(np.float32),
+                'activation': ACTIVATIONS[str(donnees[F'c{n}_activation'])]}
+      if nom == 'LSTM':
+        couche['recurrent'] = matrice('recurrent')
+        couche['activation_porte'] = ACTIVATIONS[str(donnees[F'c{n}_activation_porte'])]
+        couche['sequences'] = bool(donnees[F'c{n}_sequences'])
+      self.couches.append(couche)
+
+  @staticmethod
+  def _lstm(couche, x):
+    '''x: (lot, pas, entrées) -> (lot, pas, unités) ou (lot, unités)'''
+    lot, pas, _ = x.shape
+    U = couche['recurrent']
+    u = U.shape[0]
+    act, porte = couche['activation'], couche['activation_porte']
+    # La contribution de l'entrée est calculée pour tous les pas d'un coup
+    z_x = x @ couche['noyau'] + couche['biais']
+    h = np.zeros((lot, u), dtype = np.float32)
+    c = np.zeros((lot, u), dtype = np.float32)
+    sorties = np.empty((lot, pas, u), dtype = np.float32) if couche['sequences'] else None
+    for t in range(pas):
+      z = z_x[:, t] + h @ U
+      i = porte(z[:, :u])
+      f = porte(z[:, u:2*u])
+      g = act(z[:, 2*u:3*u])
+      o = porte(z[:, 3*u:])
+      c = f * c + i * g
+      h = o * act(c)
+      if sorties is not None:
+        sorties[:, t] = h
+    return sorties if sorties is not None else h
+
+  def predict(self, X, verbose = 0):
+    '''Même interface que keras: retourne un tableau (lot, sorties).'''
+    x = np.asarray(X, dtype = np.float32)
+    for couche in self.couches:
+      if couche['type'] == 'LSTM':
+        x = self._lstm(couche, x)
+      else:
+        x = couche['activation'](x @ couche['noyau'] + couche['biais'])
+    return x
+
+  predict_on_batch = predict
+
+
+# *****************************************************************************
+# Test de parité avec keras
+# Exécuter ce module (après apprentissage_signaux_multiple.py) pour exporter
+# le réseau sauvegardé et comparer les prédictions NumPy à celles de keras.
+# *****************************************************************************
+if __name__ == '__main__':
+  import os
+  from tensorflow.python.keras.models import load_model
+  from apprentissage_signaux_multiple import (FICHIER_RESEAU, traitement_donnees,
+                                              conversion_format, entree)
+
+  reseau = load_model(FICHIER_RESEAU)
+  donnees_normalisees, _ = traitement_donnees()
+  X = conversion_format(donnees_normalisees).values[:, :entree*3]
+  X = X.reshape((X.shape[0], 1, X.shape[1])).astype(np.float32)
+  Y_keras = reseau.predict(X, verbose = 0)
+
+  for int8, fichier, tolerance in ((False, 'reseau_lstm.npz', 1e-4),
+                                   (True, 'reseau_lstm_int8.npz', 5e-2)):
+    exporter_numpy(reseau, fichier, int8 = int8)
+    Y_numpy = ReseauNumpy(fichier).predict(X)
+    ecart = np.abs(Y_numpy - Y_keras).max()
+    print(F"{fichier}: {os.path.getsize(fichier) / 1024:.1f} ko, "
+          F"écart max avec keras = {ecart:.2e}")
+    assert ecart < tolerance, F"Écart trop grand pour {fichier}"
+  print('Parité NumPy/keras vérifiée.')
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''normalisation Normalisation min-max incrémentale des signaux.
+
+-------------------------------------------------------------------------------
+MinMaxScaler de scikit-learn doit voir toutes les données d'un coup. Sur le
+flux continu du coordonnateur, c'est impossible et, pendant l'apprentissage,
+cela fait "voir" les valeurs futures (ensemble de validation) au réseau.
+
+NormalisateurIncremental met à jour le min et le max de chaque signal lot par
+lot (le coût ne dépend que de la taille du lot), peut être figé une fois le
+réseau entraîné et se sauvegarde avec le réseau. La normalisation et la
+dénormalisation travaillent sur place lorsque le tampon est déjà float32.
+
+L'état est sauvegardé dans un nouveau fichier .npz qui contient 'data_min',
+'data_max' (un élément par signal), 'fige' et les extras passés à
+sauvegarder() (p. ex. les indices d'entrée et de sortie du réseau).
+-------------------------------------------------------------------------------
+
+Convention PEP 8 (Python Enhencement Proposal 8):
+  Variables -> snake_case
+  Class -> PascalCase
+  Constante -> SNAKE_CASE
+
+'''
+
+import numpy as np
+
+
+# -----------------------------------------------------------------------------
+# NormalisateurIncremental
+# -----------------------------------------------------------------------------
+class NormalisateurIncremental:
+  '''Normalisation vers [0, 1] avec min/max mis à jour par lots.'''
+  def __init__(self, nb_signaux):
+    self.data_min = np.full(nb_signaux, np.inf, dtype = np.float32)
+    self.data_max = np.full(nb_signaux, -np.inf, dtype = np.float32)
+    self.fige = False
+    self._etendue = np.ones(nb_signaux, dtype = np.float32)
+    self._echelle = np.ones(nb_signaux, dtype = np.float32)
+
+  def _mettre_a_jour_echelle(self):
+    etendue = self.data_max - self.data_min
+    # Signal constant (ou jamais vu): même convention que MinMaxScaler
+    etendue[~np.isfinite(etendue) | (etendue == 0.0)] = 1.0
+    self._etendue = etendue
+    self._echelle = (1.0 / etendue).astype(np.float32)
+
+  def partial_fit(self, lot):
+    '''Mettre à jour min/max avec un lot (n, nb_signaux) ou un échantillon
+    (nb_signaux,). Les NaN sont ignorés. Sans effet si le normalisateur est
+    figé.'''
+    if self.fige:
+      return self
+    lot = np.asarray(lot, dtype = np.float32).reshape((-1, self.data_min.shape[0]))
+    if lot.shape[0] == 0:
+      return self
+    np.fmin(self.data_min, np.fmin.reduce(lot, axis = 0), out = self.data_min)
+    np.fmax(self.data_max, np.fmax.reduce(lot, axis = 0), out = self.data_max)
+    self._mettre_a_jour_echelle()
+    return self
+
+  def figer(self):
+    '''Ne plus modifier min/max (réseau entraîné, inférence en direct).'''
+    self.fige = True
+    return self
+
+  def _verifier_ajuste(self):
+    # Sans min/max (aucun partial_fit ou signal sans valeur autre que NaN),
+    # le résultat serait -inf ou NaN
+    manquants = np.flatnonzero(~np.isfinite(self.data_min))
+    if len(manquants):
+      raise ValueError(F"Normalisateur non ajusté pour les signaux {manquants.tolist()}: "
+                       F"appeler partial_fit() avant de (dé)normaliser.")
+
+  def transformer(self, x, out = None):
+    '''Normaliser x. Si out est x (tableau float32), le calcul est fait sur
+    place. Retour: le tableau normalisé.'''
+    self._verifier_ajuste()
+    if out is None:
+      out = np.array(x, dtype = np.float32)
+    elif out is not x:
+      out[...] = x
+    out -= self.data_min
+    out *= self._echelle
+    return out
+
+  def inverse_transformer(self, y, out = None):
+    '''Dénormaliser y (même convention que transformer()).'''
+    self._verifier_ajuste()
+    if out is None:
+      out = np.array(y, dtype = np.float32)
+    elif out is not y:
+      out[...] = y
+    out *= self._etendue
+    out += self.data_min
+    return out
+
+  def sauvegarder(self, fichier, **extras):
+    '''Sauvegarder l'état dans un .npz (extras: p. ex. entree, sortie).'''
+    np.savez(fichier, data_min = self.data_min, data_max = self.data_max,
+             fige = self.fige, **extras)
+
+  @classmethod
+  def charger(cls, fichier):
+    etat = np.load(fichier)
+    normaliseur = cls(etat['data_min'].shape[0])
+    normaliseur.data_min[:] = etat['data_min']
+    normaliseur.data_max[:] = etat['data_max']
+    normaliseur.fige = bool(etat['fige']) if 'fige' in etat else True
+    normaliseur._mettre_a_jour_echelle()
+    return normaliseur
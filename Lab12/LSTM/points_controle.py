@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''points_controle Points de contrôle et reprise de l'apprentissage.
+
+-------------------------------------------------------------------------------
+L'apprentissage du réseau LSTM peut durer des heures (500 epochs). Ce module
+offre un callback keras qui:
+
+  - sauvegarde le modèle complet (poids + état de l'optimiseur) à toutes les
+    'periode' epochs dans <repertoire>/dernier.h5 avec l'epoch atteinte et la
+    meilleure valeur surveillée dans <repertoire>/etat.json;
+  - sauvegarde les meilleurs poids dans <repertoire>/meilleur.h5 dès que la
+    valeur surveillée s'améliore (etat.json est alors réécrit avec la
+    nouvelle meilleure valeur);
+  - recharge les meilleurs poids à la fin de l'apprentissage (même si celui-ci
+    a été interrompu puis repris).
+
+charger_reprise() recharge le dernier point de contrôle pour continuer
+l'apprentissage avec fit(..., initial_epoch = epoque).
+-------------------------------------------------------------------------------
+
+Convention PEP 8 (Python Enhencement Proposal 8):
+  Variables -> snake_case
+  Class -> PascalCase
+  Constante -> SNAKE_CASE
+
+'''
+
+import os
+import json
+from tensorflow.python.keras.callbacks import Callback
+from tensorflow.python.keras.models import load_model
+
+FICHIER_DERNIER = 'dernier.h5'
+FICHIER_MEILLEUR = 'meilleur.h5'
+FICHIER_ETAT = 'etat.json'
+
+
+# -----------------------------------------------------------------------------
+# PointDeControle
+# -----------------------------------------------------------------------------
+class PointDeControle(Callback):
+  '''Callback keras de sauvegarde périodique et des meilleurs poids.'''
+  def __init__(self, repertoire, periode = 10, moniteur = 'val_loss',
+               meilleur = float('inf'), epoque = 0):
+    super().__init__()
+    self.repertoire = repertoire
+    self.periode = periode
+    self.moniteur = moniteur
+    self.meilleur = meilleur
+    self.epoque = epoque        # epoch sauvegardée dans dernier.h5
+    os.makedirs(repertoire, exist_ok = True)
+
+  def _chemin(self, nom):
+    return os.path.join(self.repertoire, nom)
+
+  def _ecrire_etat(self):
+    # Écrire dans un fichier temporaire puis le renommer: un arrêt brutal
+    # pendant l'écriture ne corrompt jamais le dernier point de contrôle.
+    with open(self._chemin('etat.tmp.json'), 'w') as f:
+      json.dump({'epoque': self.epoque, 'meilleur': self.meilleur}, f)
+    os.replace(self._chemin('etat.tmp.json'), self._chemin(FICHIER_ETAT))
+
+  def _sauvegarder_etat(self, epoque):
+    self.model.save(self._chemin('dernier.tmp.h5'))
+    os.replace(self._chemin('dernier.tmp.h5'), self._chemin(FICHIER_DERNIER))
+    self.epoque = epoque
+    self._ecrire_etat()
+
+  def on_epoch_end(self, epoch, logs = None):
+    valeur = (logs or {}).get(self.moniteur)
+    if valeur is not None and valeur < self.meilleur:
+      self.meilleur = valeur
+      self.model.save_weights(self._chemin('meilleur.tmp.h5'))
+      os.replace(self._chemin('meilleur.tmp.h5'), self._chemin(FICHIER_MEILLEUR))
+      # 'meilleur' doit toujours être celui de meilleur.h5 (reprise)
+      self._ecrire_etat()
+    # epoch commence à 0: epoch + 1 epochs sont terminées
+    if (epoch + 1) % self.periode == 0:
+      self._sauvegarder_etat(epoch + 1)
+
+  def on_train_end(self, logs = None):
+    if os.path.exists(self._chemin(FICHIER_MEILLEUR)):
+      print(F"Restaurer les meilleurs poids ({self.moniteur} = {self.meilleur:.4f})")
+      self.model.load_weights(self._chemin(FICHIER_MEILLEUR))
+
+
+# -----------------------------------------------------------------------------
+# charger_reprise
+# -----------------------------------------------------------------------------
+def charger_reprise(repertoire):
+  '''Recharger le dernier point de contrôle.
+
+  Retour: (reseau, epoque, meilleur) ou None s'il n'y a pas de point de
+          contrôle dans le répertoire. Le réseau est déjà compilé et son
+          optimiseur a retrouvé son état.
+  '''
+  chemin_etat = os.path.join(repertoire, FICHIER_ETAT)
+  if not os.path.exists(chemin_etat):
+    return None
+  with open(chemin_etat) as f:
+    etat = json.load(f)
+  # etat.json peut être écrit (meilleurs poids) avant le premier dernier.h5
+  if etat['epoque'] == 0:
+    return None
+  reseau = load_model(os.path.join(repertoire, FICHIER_DERNIER))
+  return reseau, etat['epoque'], etat['meilleur']
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''predicteur_en_ligne Prédiction en temps réel avec le réseau LSTM entraîné.
+
+-------------------------------------------------------------------------------
+Ce module sert le réseau sauvegardé par apprentissage_signaux_multiple.py
+(FICHIER_RESEAU et FICHIER_NORMALISATION) à un processus de longue durée.
+
+Pour chaque source (clé quelconque, p. ex. l'adresse I2C d'un noeud ou le nom
+d'un site), le prédicteur garde une fenêtre glissante des 'entree' derniers
+échantillons normalisés (température, humidité, Leq). Chaque nouvel échantillon
+du coordonnateur met la fenêtre à jour en O(1) et produit une prédiction des
+'sortie' prochains pas de temps.
+
+La fenêtre est un tampon circulaire "miroir" de longueur 2 x entree: chaque
+échantillon est écrit à la position p et à la position p + entree. Ainsi, les
+'entree' derniers échantillons sont toujours contigus en ordre chronologique
+dans tampon[p+1 : p+1+entree] et aucun décalage (np.roll) n'est nécessaire.
+
+Lorsque plusieurs sources reçoivent un échantillon au même cycle, on utilise
+mettre_a_jour_lot() qui regroupe les fenêtres complètes dans un seul tenseur
+et appelle le réseau une seule fois.
+-------------------------------------------------------------------------------
+
+Convention PEP 8 (Python Enhencement Proposal 8):
+  Variables -> snake_case
+  Class -> PascalCase
+  Constante -> SNAKE_CASE
+
+'''
+
+import numpy as np
+from normalisation import NormalisateurIncremental
+
+# Ordre des signaux dans da.csv (et donc dans l'entrée du réseau)
+SIGNAUX = ('Temperature', 'Humidity', 'Leq')
+
+
+# -----------------------------------------------------------------------------
+# PredicteurEnLigne
+# -----------------------------------------------------------------------------
+class PredicteurEnLigne:
+  '''Fenêtres glissantes par source et prédiction par lots.
+
+  Le réseau doit offrir la méthode predict_on_batch(X) où X a le shape
+  (nb. sources, 1, entree x nb. signaux), comme lors de l'apprentissage.
+  Le normalisateur doit être figé: les fenêtres déjà normalisées ne seraient
+  plus cohérentes si son min/max changeait.
+  '''
+  def __init__(self, reseau, normaliseur, entree = 20, sortie = 4):
+    self.reseau = reseau
+    self.entree = entree
+    self.sortie = sortie
+    self.normaliseur = normaliseur.figer()
+    self.nb_signaux = normaliseur.data_min.shape[0]
+    # Tampons miroirs: une ligne par source, agrandis au besoin
+    self._tampons = np.zeros((4, 2 * entree, self.nb_signaux), dtype = np.float32)
+    self._position = np.zeros(4, dtype = np.int64)
+    self._compte = np.zeros(4, dtype = np.int64)
+    self._index = {}          # clé -> ligne dans les tampons
+
+  @classmethod
+  def charger(cls, fichier_reseau, fichier_normalisation):
+    '''Créer un prédicteur à partir des fichiers produits par l'apprentissage.
+
+    Un fichier_reseau .npz (voir export_numpy.py) évite de charger TensorFlow.
+    '''
+    if fichier_reseau.endswith('.npz'):
+      from export_numpy import ReseauNumpy
+      reseau = ReseauNumpy(fichier_reseau)
+    else:
+      # Importer keras seulement ici: le reste du module n'en dépend pas
+      from tensorflow.python.keras.models import load_model
+      reseau = load_model(fichier_reseau)
+    norm = np.load(fichier_normalisation)
+    return cls(reseau, NormalisateurIncremental.charger(fichier_normalisation),
+               int(norm['entree']), int(norm['sortie']))
+
+  def _ligne(self, cle):
+    '''Retourner la ligne des tampons associée à la clé (la créer au besoin).'''
+    ligne = self._index.get(cle)
+    if ligne is None:
+      ligne = len(self._index)
+      if ligne == self._tampons.shape[0]:
+        # Doubler la capacité: coût amorti O(1) par nouvelle source
+        n = 2 * ligne
+        self._tampons = np.resize(self._tampons, (n,) + self._tampons.shape[1:])
+        self._position = np.resize(self._position, n)
+        self._compte = np.resize(self._compte, n)
+      self._tampons[ligne] = 0.0
+      self._position[ligne] = self._compte[ligne] = 0
+      self._index[cle] = ligne
+    return ligne
+
+  def _ajouter(self, cle, echantillon):
+    '''Normaliser et insérer un échantillon. Retour: la ligne si la fenêtre est
+    complète, None sinon.'''
+    ligne = self._ligne(cle)
+    x = self.normaliseur.transformer(echantillon)
+    p = self._position[ligne]
+    self._tampons[ligne, p] = x
+    self._tampons[ligne, p + self.entree] = x
+    self._position[ligne] = (p + 1) % self.entree
+    self._compte[ligne] += 1
+    return ligne if self._compte[ligne] >= self.entree else None
+
+  def fenetre(self, cle):
+    '''Retourner une vue (entree, nb. signaux) des derniers échantillons
+    normalisés de la source en ordre chronologique.'''
+    ligne = self._index[cle]
+    p = self._position[ligne]
+    return self._tampons[ligne, p : p + self.entree]
+
+  def mettre_a_jour_lot(self, echantillons):
+    '''Ajouter un échantillon par source et prédire en un seul appel au réseau.
+
+    Arguments:
+    echantillons (dict) -- clé -> séquence (température, humidité, Leq)
+
+    Retour (dict): clé -> tableau (sortie, nb. signaux) des valeurs prédites
+                   (dénormalisées) pour les sources dont la fenêtre est complète.
+    '''
+    cles, lignes = [], []
+    for cle, echantillon in echantillons.items():
+      ligne = self._ajouter(cle, echantillon)
+      if ligne is not None:
+        cles.append(cle)
+        lignes.append(ligne)
+    if not cles:
+      return {}
+
+    # Rassembler les fenêtres complètes dans un seul tenseur
+    X = np.empty((len(lignes), self.entree, self.nb_signaux), dtype = np.float32)
+    for i, ligne in enumerate(lignes):
+      p = self._position[ligne]
+      X[i] = self._tampons[ligne, p : p + self.entree]
+    X = X.reshape((len(lignes), 1, self.entree * self.nb_signaux))
+
+    Y = np.asarray(self.reseau.predict_on_batch(X), dtype = np.float32)
+    Y = Y.reshape((len(lignes), self.sortie, self.nb_signaux))
+    self.normaliseur.inverse_transformer(Y, out = Y)
+    return dict(zip(cles, Y))
+
+  def mettre_a_jour(self, cle, echantillon):
+    '''Ajouter un échantillon d'une seule source.
+
+    Retour: tableau (sortie, nb. signaux) des valeurs prédites ou None si la
+            fenêtre de la source n'est pas encore complète.
+    '''
+    return self.mettre_a_jour_lot({cle: echantillon}).get(cle)
+
+
+# *****************************************************************************
+# Exemple d'utilisation
+# Exécuter ce module (après apprentissage_signaux_multiple.py) pour rejouer
+# da.csv comme s'il s'agissait du flux d'échantillons du coordonnateur et
+# mesurer la latence de chaque mise à jour.
+# *****************************************************************************
+if __name__ == '__main__':
+  import time
+  from pandas import read_csv
+  from apprentissage_signaux_multiple import FICHIER_RESEAU, FICHIER_NORMALISATION
+
+  predicteur = PredicteurEnLigne.charger(FICHIER_RESEAU, FICHIER_NORMALISATION)
+  vals = read_csv('da.csv', header = 0, index_col = 0, encoding = 'ISO-8859-1').values
+  durees = []
+  for echantillon in vals[:200]:
+    debut = time.perf_counter()
+    # Deux sources fictives pour montrer la prédiction par lots
+    Y = predicteur.mettre_a_jour_lot({'A': echantillon, 'B': echantillon})
+    durees.append(time.perf_counter() - debut)
+  print(F"Dernière prédiction (source A, {predicteur.sortie} pas):")
+  print(Y['A'])
+  print(F"Latence médiane par mise à jour: {1000 * np.median(durees):.2f} ms")
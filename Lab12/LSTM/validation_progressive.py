@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''validation_progressive Validation "walk-forward" du réseau LSTM.
+
+-------------------------------------------------------------------------------
+apprentissage_signaux_multiple.py évalue le réseau avec une seule séparation
+à la ligne 1500. Ce programme utilise plutôt une origine glissante:
+
+  pli 0: apprentissage [0, a0)        test [a0, a0 + t)
+  pli 1: apprentissage [0, a0 + t)    test [a0 + t, a0 + 2t)
+  ...
+
+Entre l'apprentissage et le test, on retire (sortie - 1) fenêtres: leurs
+valeurs à prédire chevauchent celles de la première fenêtre de test.
+
+Chaque pli a son propre normalisateur, ajusté sur les seules lignes de ses
+fenêtres d'apprentissage: les valeurs de test ne fixent pas le min/max.
+
+Les données brutes sont placées une seule fois dans une mémoire partagée.
+Chaque processus de travail s'y attache, normalise les lignes du pli et en
+construit les fenêtres comme des vues (fenetres_glissantes puis tranches).
+Les plis sont entraînés en parallèle et on rapporte le MAE (en unités des
+signaux) par pli et global pour chaque pas de l'horizon (sortie pas x 3
+signaux).
+-------------------------------------------------------------------------------
+
+Convention PEP 8 (Python Enhencement Proposal 8):
+  Variables -> snake_case
+  Class -> PascalCase
+  Constante -> SNAKE_CASE
+
+'''
+
+import os
+import time
+import numpy as np
+from multiprocessing import get_context, shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+from conversion_signaux import fenetres_glissantes
+from normalisation import NormalisateurIncremental
+
+NB_PLIS = 5         # Nombre de plis
+EPOCHS = 100        # Nombre max d'epochs par pli
+PATIENCE = 10       # Patience de l'arrêt précoce
+NB_SIGNAUX = 3
+
+# Données partagées d'un processus de travail (voir _initialiser)
+_partage = {}
+
+
+# -----------------------------------------------------------------------------
+# Construction des plis
+# -----------------------------------------------------------------------------
+def plis_progressifs(nb_fenetres, nb_plis, sortie):
+  '''Retourner la liste des plis (fin_apprentissage, debut_test, fin_test)
+  en indices de fenêtres.'''
+  taille_test = nb_fenetres // (nb_plis + 1)
+  plis = []
+  for k in range(nb_plis):
+    debut_test = taille_test * (k + 1)
+    fin_test = nb_fenetres if k == nb_plis - 1 else debut_test + taille_test
+    plis.append((debut_test - (sortie - 1), debut_test, fin_test))
+  return plis
+
+
+# -----------------------------------------------------------------------------
+# Processus de travail
+# -----------------------------------------------------------------------------
+def _initialiser(nom, forme, entree, sortie, nb_fils):
+  '''Attacher le processus à la mémoire partagée et limiter TensorFlow à
+  nb_fils fils d'exécution (les plis se partagent les coeurs).'''
+  os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+  import tensorflow as tf
+  tf.config.threading.set_intra_op_parallelism_threads(nb_fils)
+  tf.config.threading.set_inter_op_parallelism_threads(1)
+  memoire = shared_memory.SharedMemory(name = nom)
+  donnees = np.ndarray(forme, dtype = np.float32, buffer = memoire.buf)
+  _partage['memoire'] = memoire     # garder la mémoire ouverte
+  _partage['donnees'] = donnees
+  _partage['entree'] = entree
+  _partage['sortie'] = sortie
+
+
+def _evaluer_pli(pli):
+  '''Entraîner et évaluer un pli. Retour: MAE (nb. colonnes de sortie,).'''
+  from apprentissage_signaux_multiple import construire_reseau
+  from tensorflow.python.keras.callbacks import EarlyStopping
+  fin_app, debut_test, fin_test = pli
+  donnees, entree, sortie = _partage['donnees'], _partage['entree'], _partage['sortie']
+  n_x = entree * NB_SIGNAUX
+  # Normalisateur du pli: min/max des lignes des fenêtres d'apprentissage
+  # seulement, puis normalisation des lignes jusqu'à la fin du test
+  normalisateur = NormalisateurIncremental(NB_SIGNAUX)
+  normalisateur.partial_fit(donnees[:fin_app + entree + sortie - 1]).figer()
+  fenetres = fenetres_glissantes(
+    normalisateur.transformer(donnees[:fin_test + entree + sortie - 1]), entree, sortie)
+  app_X, app_Y = fenetres[:fin_app, :n_x], fenetres[:fin_app, n_x:]
+  test_X, test_Y = fenetres[debut_test:fin_test, :n_x], fenetres[debut_test:fin_test, n_x:]
+  app_X = app_X.reshape((app_X.shape[0], 1, n_x))
+  test_X = test_X.reshape((test_X.shape[0], 1, n_x))
+
+  reseau = construire_reseau((1, n_x))
+  # L'arrêt précoce utilise les 10 % les plus récents de l'apprentissage:
+  # l'ensemble de test du pli n'est jamais vu pendant l'apprentissage.
+  fonction_es = EarlyStopping(monitor = 'val_loss', mode = 'min', patience = PATIENCE,
+                              restore_best_weights = True)
+  reseau.fit(app_X, app_Y, epochs = EPOCHS, batch_size = 72, validation_split = 0.1,
+             verbose = 0, shuffle = False, callbacks = [fonction_es])
+  # MAE en unités des signaux: les plis n'ont pas la même normalisation
+  Y_predit = normalisateur.inverse_transformer(
+    reseau.predict(test_X, verbose = 0).reshape((-1, NB_SIGNAUX)))
+  test_Y = normalisateur.inverse_transformer(test_Y.reshape((-1, NB_SIGNAUX)))
+  return np.abs(Y_predit - test_Y).reshape((-1, sortie * NB_SIGNAUX)).mean(axis = 0)
+
+
+# -----------------------------------------------------------------------------
+# validation_progressive
+# -----------------------------------------------------------------------------
+def validation_progressive(donnees, entree, sortie, nb_plis = NB_PLIS, nb_processus = None):
+  '''Évaluer le réseau par validation walk-forward.
+
+  Entrées:
+    - donnees: tableau (temps, 3 signaux) non normalisé (chaque pli a son
+      normalisateur)
+    - entree, sortie: largeurs des fenêtres (comme conversion_format)
+    - nb_plis: nombre de plis
+    - nb_processus: nombre de processus de travail (défaut: min(plis, coeurs))
+
+  Sortie:
+    - (mae_plis, mae_global, plis) où mae_plis a le shape (nb_plis, sortie, 3)
+      et mae_global (sortie, 3) est pondéré par la taille des tests.
+  '''
+  donnees = np.ascontiguousarray(donnees, dtype = np.float32)
+  nb_fenetres = donnees.shape[0] - (entree + sortie) + 1
+  plis = plis_progressifs(nb_fenetres, nb_plis, sortie)
+  nb_coeurs = os.cpu_count() or 1
+  nb_processus = nb_processus or min(nb_plis, nb_coeurs)
+  nb_fils = max(1, nb_coeurs // nb_processus)
+
+  memoire = shared_memory.SharedMemory(create = True, size = donnees.nbytes)
+  try:
+    np.ndarray(donnees.shape, dtype = np.float32, buffer = memoire.buf)[:] = donnees
+    # 'spawn': ne jamais dupliquer par fork un processus où TensorFlow est chargé
+    with ProcessPoolExecutor(nb_processus, mp_context = get_context('spawn'),
+                             initializer = _initialiser,
+                             initargs = (memoire.name, donnees.shape, entree, sortie, nb_fils)) as executeur:
+      mae = np.array(list(executeur.map(_evaluer_pli, plis)))
+  finally:
+    memoire.close()
+    memoire.unlink()
+
+  mae_plis = mae.reshape((len(plis), sortie, NB_SIGNAUX))
+  tailles = np.array([fin - debut for _, debut, fin in plis], dtype = np.float64)
+  mae_global = np.tensordot(tailles / tailles.sum(), mae_plis, axes = 1)
+  return mae_plis, mae_global, plis
+
+
+# *****************************************************************************
+# Fonction principale
+# *****************************************************************************
+if __name__ == '__main__':
+  from apprentissage_signaux_multiple import lire_donnees, entree, sortie
+
+  start = time.perf_counter()
+  mae_plis, mae_global, plis = validation_progressive(lire_donnees(), entree, sortie)
+
+  for (fin_app, debut, fin), mae in zip(plis, mae_plis):
+    print(F"Pli apprentissage [0, {fin_app}) test [{debut}, {fin}): "
+          F"MAE = {mae.mean():.3f}")
+    for pas, m in enumerate(mae):
+      print(F"  t+{pas}: " + '  '.join(F'{v:.3f}' for v in m))
+  print(F"MAE global = {mae_global.mean():.3f}")
+  for pas, m in enumerate(mae_global):
+    print(F"  t+{pas}: " + '  '.join(F'{v:.3f}' for v in m))
+  print(F"<Durée d'exécution : {time.perf_counter() - start:.1f} secondes>")
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+agregation_leq.py
+Leq sur fenêtres glissantes (1 min, 15 min, 1 h, 8 h, 24 h) et Lden à partir
+des valeurs Li/Leq reçues par le coordonnateur.
+
+Chaque niveau reçu L couvre une durée d (p. ex. tp du noeud Leq). Son énergie
+est e = d x 10^((L - L_REF) / 10). On garde les sommes cumulées (préfixes) de
+e et de d pour chaque niveau reçu; le Leq d'une fenêtre est alors
+
+  Leq = L_REF + 10 log10((E[fin] - E[debut]) / (D[fin] - D[debut]))
+
+ce qui coûte O(1) par ajout (et une recherche binaire par requête). Le niveau
+dont l'intervalle chevauche le début de la fenêtre est compté au prorata.
+
+Précautions numériques:
+  - L_REF ramène les énergies près de 1 (10^(L/10) atteint 1e10 à 100 dB);
+  - les préfixes sont accumulés avec la sommation compensée de Kahan;
+  - les valeurs plus vieilles que la rétention sont retirées et les préfixes
+    sont "rebasés" pour qu'ils ne croissent pas indéfiniment.
+
+Les préfixes sont aussi séparés par période (jour 7-19 h, soirée 19-23 h,
+nuit 23-7 h, heure locale du milieu de l'intervalle) pour le calcul du Lden.
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+import time
+from bisect import bisect_right
+import numpy as np
+
+L_REF = 100.0                # Niveau de référence des énergies (dB)
+NS_PAR_SEC = 1_000_000_000
+
+# Fenêtres glissantes par défaut (nom -> durée en secondes)
+FENETRES_LEQ = {'1 min': 60, '15 min': 900, '1 h': 3600,
+                '8 h': 8 * 3600, '24 h': 24 * 3600}
+
+# Périodes du Lden: (heure début, heure fin, pénalité dB, durée en heures)
+PERIODES_LDEN = ((7, 19, 0.0, 12), (19, 23, 5.0, 4), (23, 7, 10.0, 8))
+
+
+def periode_lden(heure):
+  '''Retourner l'indice de la période Lden (0 jour, 1 soirée, 2 nuit).'''
+  if 7 <= heure < 19:
+    return 0
+  if 19 <= heure < 23:
+    return 1
+  return 2
+
+
+class AgregateurLeq:
+  '''Sommes cumulées de l'énergie sonore pour les Leq glissants et le Lden.'''
+  def __init__(self, retention_sec = 25 * 3600, capacite = 1024):
+    self.retention_ns = int(retention_sec * NS_PAR_SEC)
+    self._debut = 0                   # indice de la plus vieille valeur gardée
+    self._fin = 0                     # indice après la dernière valeur
+    self._t = [0] * capacite          # fin de l'intervalle (ns), croissant
+    self._d = np.zeros(capacite)      # durée de chaque valeur (s)
+    # Colonnes des préfixes: énergie totale, durée, énergie et durée par
+    # période Lden. La ligne i contient les sommes des valeurs 0..i-1.
+    self._cumul = np.zeros((capacite + 1, 8))
+    self._compensation = np.zeros(8)  # termes de Kahan
+
+  def __len__(self):
+    return self._fin - self._debut
+
+  def _compacter(self):
+    '''Retirer les valeurs expirées, rebaser les préfixes et agrandir au besoin.'''
+    n = self._fin - self._debut
+    base = self._cumul[self._debut].copy()
+    if n + 1 > len(self._t) // 2:
+      capacite = 2 * len(self._t)
+      cumul = np.zeros((capacite + 1, 8))
+      d = np.zeros(capacite)
+    else:
+      capacite, cumul, d = len(self._t), self._cumul, self._d
+    cumul[:n + 1] = self._cumul[self._debut : self._fin + 1] - base
+    d[:n] = self._d[self._debut : self._fin]
+    self._t = self._t[self._debut : self._fin] + [0] * (capacite - n)
+    self._cumul, self._d = cumul, d
+    self._debut, self._fin = 0, n
+
+  def ajouter(self, t_ns, niveau, duree_sec):
+    '''Ajouter un niveau (dB) couvrant l'intervalle (t - duree, t].
+
+    Arguments:
+    t_ns (int) -- fin de l'intervalle en ns (horodatage de la valeur)
+    niveau (float) -- Li ou Leq en dB
+    duree_sec (float) -- durée couverte par la valeur en secondes
+
+    Retour: n/a
+    '''
+    # Retirer les valeurs hors de la rétention (coût amorti O(1))
+    limite = t_ns - self.retention_ns
+    while self._debut < self._fin and self._t[self._debut] < limite:
+      self._debut += 1
+    if self._fin == len(self._t):
+      self._compacter()
+
+    e = duree_sec * 10.0 ** ((niveau - L_REF) / 10.0)
+    milieu = (t_ns - duree_sec * NS_PAR_SEC / 2) / NS_PAR_SEC
+    p = periode_lden(time.localtime(milieu).tm_hour)
+    increment = np.zeros(8)
+    increment[0], increment[1] = e, duree_sec
+    increment[2 + 2 * p], increment[3 + 2 * p] = e, duree_sec
+    # Sommation compensée (Kahan) des préfixes
+    y = increment - self._compensation
+    total = self._cumul[self._fin] + y
+    self._compensation = (total - self._cumul[self._fin]) - y
+    self._cumul[self._fin + 1] = total
+    self._t[self._fin] = t_ns
+    self._d[self._fin] = duree_sec
+    self._fin += 1
+
+  def _sommes(self, duree_sec, maintenant_ns = None):
+    '''Retourner la ligne de sommes (8 colonnes) de la fenêtre qui se termine
+    à maintenant_ns (défaut: dernière valeur reçue).'''
+    if self._fin == self._debut:
+      return None
+    if maintenant_ns is None:
+      maintenant_ns = self._t[self._fin - 1]
+    debut_ns = maintenant_ns - int(duree_sec * NS_PAR_SEC)
+    # Première valeur dont la fin est dans la fenêtre et dernière valeur
+    i = bisect_right(self._t, debut_ns, self._debut, self._fin)
+    j = bisect_right(self._t, maintenant_ns, self._debut, self._fin)
+    if i >= j:
+      return None
+    sommes = self._cumul[j] - self._cumul[i]
+    # Retirer la partie de la valeur i qui précède le début de la fenêtre
+    exces = (debut_ns - (self._t[i] - self._d[i] * NS_PAR_SEC)) / NS_PAR_SEC
+    if exces > 0.0:
+      ligne = self._cumul[i + 1] - self._cumul[i]
+      sommes = sommes - ligne * (exces / self._d[i])
+    return sommes
+
+  def leq(self, duree_sec, maintenant_ns = None):
+    '''Leq (dB) sur la fenêtre glissante de duree_sec secondes ou None.'''
+    sommes = self._sommes(duree_sec, maintenant_ns)
+    if sommes is None or sommes[1] <= 0.0:
+      return None
+    return L_REF + 10.0 * np.log10(sommes[0] / sommes[1])
+
+  def leq_fenetres(self, fenetres = FENETRES_LEQ, maintenant_ns = None):
+    '''Retourner {nom: Leq} pour toutes les fenêtres glissantes.'''
+    return {nom: self.leq(duree, maintenant_ns) for nom, duree in fenetres.items()}
+
+  def lden(self, maintenant_ns = None):
+    '''Lden (dB) sur les dernières 24 h ou None s'il manque une période.'''
+    sommes = self._sommes(24 * 3600, maintenant_ns)
+    if sommes is None:
+      return None
+    energie = 0.0
+    for p, (_, _, penalite, heures) in enumerate(PERIODES_LDEN):
+      e, d = sommes[2 + 2 * p], sommes[3 + 2 * p]
+      if d <= 0.0:
+        return None
+      # heures x 10^((Lp + pénalité) / 10), relatif à L_REF
+      energie += heures * (e / d) * 10.0 ** (penalite / 10.0)
+    return L_REF + 10.0 * np.log10(energie / 24.0)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+anomalies.py
+Détecter en ligne les valeurs anormales de tous les signaux (noeud, champ).
+
+Pour chaque signal on garde une moyenne et une variance exponentielles
+(EWMA, facteur 'alpha'):
+
+  ecart = x - moyenne
+  moyenne  += alpha x ecart
+  variance  = (1 - alpha) x (variance + alpha x ecart^2)
+
+et trois drapeaux sont levés:
+
+  DEFAUT    valeur hors des bornes physiques du capteur ou NaN (p. ex. -1
+            retourné par un DHT11 qui ne répond pas); la valeur est ignorée
+  ABERRANT  |x - moyenne| > seuil x écart type (après nb_min valeurs); l'écart
+            type est borné par 'ecart_min' (résolution du capteur) et la
+            valeur est écrêtée à seuil x écart type avant la mise à jour,
+            pour qu'une valeur aberrante isolée ne fausse pas les
+            statistiques mais qu'un changement de niveau soit suivi
+  FIGE      la valeur n'a pas changé de plus de 'ecart_min' / 2 depuis
+            'duree_fige' secondes (capteur bloqué)
+
+L'état de tous les signaux est un seul tableau NumPy (DTYPE_ETAT, une ligne
+par signal) et mettre_a_jour() traite toutes les valeurs d'un cycle en une
+seule opération vectorielle, sans boucle Python par signal: le coût reste
+faible pour des centaines de signaux.
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+import numpy as np
+
+NS_PAR_SEC = 1_000_000_000
+
+# Drapeaux (bits) retournés par mettre_a_jour()
+ABERRANT = 0x01
+FIGE = 0x02
+DEFAUT = 0x04
+NOMS_DRAPEAUX = {ABERRANT : 'aberrant', FIGE : 'figé', DEFAUT : 'défaut'}
+
+DTYPE_ETAT = np.dtype([('moyenne', '<f8'), ('variance', '<f8'),
+                       ('nb', '<i8'),               # valeurs valides reçues
+                       ('reference', '<f8'),        # valeur au dernier changement
+                       ('changement_ns', '<i8'),    # temps du dernier changement
+                       # Paramètres du signal
+                       ('bas', '<f8'), ('haut', '<f8'),
+                       ('ecart_min', '<f8'), ('duree_fige_ns', '<i8')])
+
+
+def drapeaux_texte(drapeaux):
+  '''Noms des drapeaux levés (ex. 'aberrant, figé').'''
+  return ", ".join(nom for bit, nom in NOMS_DRAPEAUX.items() if drapeaux & bit)
+
+
+class DetecteurAnomalies:
+  '''Statistiques EWMA et drapeaux de tous les signaux.'''
+  def __init__(self, alpha = 0.02, seuil = 5.0, nb_min = 30, capacite = 64):
+    '''Arguments:
+    alpha (float) -- facteur des moyennes exponentielles
+    seuil (float) -- nombre d'écarts types d'une valeur aberrante
+    nb_min (int) -- nombre de valeurs avant de chercher les valeurs aberrantes
+    capacite (int) -- nombre initial de lignes du tableau d'état
+    '''
+    self.alpha = alpha
+    self.seuil = seuil
+    self.nb_min = nb_min
+    self.etat = np.zeros(capacite, dtype = DTYPE_ETAT)
+    self.signaux = []             # indice -> (noeud, champ)
+    self._indices = {}            # (noeud, champ) -> indice
+
+  def __len__(self):
+    return len(self.signaux)
+
+  def signal(self, noeud, champ, bas = -np.inf, haut = np.inf, ecart_min = 0.0,
+             duree_fige = np.inf):
+    '''Indice d'un signal (ajouté avec ces paramètres s'il est nouveau).
+
+    Arguments:
+    noeud, champ -- signal
+    bas, haut (float) -- bornes physiques du capteur
+    ecart_min (float) -- écart type min. (résolution du capteur)
+    duree_fige (float) -- durée (s) sans changement d'un capteur bloqué
+    '''
+    indice = self._indices.get((noeud, champ))
+    if indice is not None:
+      return indice
+    indice = len(self.signaux)
+    if indice == len(self.etat):
+      self.etat = np.concatenate((self.etat, np.zeros(len(self.etat), dtype = DTYPE_ETAT)))
+    duree_fige_ns = np.iinfo(np.int64).max if np.isinf(duree_fige) else int(duree_fige * NS_PAR_SEC)
+    self.etat[indice] = (0.0, 0.0, 0, np.nan, 0, bas, haut, ecart_min, duree_fige_ns)
+    self.signaux.append((noeud, champ))
+    self._indices[(noeud, champ)] = indice
+    return indice
+
+  def mettre_a_jour(self, indices, temps_ns, valeurs):
+    '''Ajouter une valeur à chacun des signaux indices (indices distincts).
+
+    Arguments:
+    indices (array d'int) -- signaux (voir signal())
+    temps_ns (array d'int) -- horodatages des valeurs
+    valeurs (array de float) -- valeurs reçues
+
+    Retour (np.ndarray de uint8): drapeaux de chaque valeur
+    '''
+    indices = np.asarray(indices, dtype = np.intp)
+    t = np.asarray(temps_ns, dtype = np.int64)
+    x = np.asarray(valeurs, dtype = np.float64)
+    e = self.etat[indices]            # copie des lignes concernées
+    drapeaux = np.zeros(len(indices), dtype = np.uint8)
+
+    valides = (x >= e['bas']) & (x <= e['haut'])      # faux aussi pour NaN
+    drapeaux[~valides] |= DEFAUT
+
+    # Valeurs aberrantes (signaux qui ont assez de valeurs)
+    # Variance corrigée du biais de son départ à zéro: divisée par
+    # 1 - (1 - alpha)^(nb - 1)
+    ecart = x - e['moyenne']
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+      variance = e['variance'] / (1.0 - (1.0 - self.alpha) ** (e['nb'] - 1))
+    ecart_type = np.maximum(np.sqrt(np.nan_to_num(variance)), e['ecart_min'])
+    limite = self.seuil * ecart_type
+    pret = valides & (e['nb'] >= self.nb_min)
+    drapeaux[pret & (np.abs(ecart) > limite)] |= ABERRANT
+
+    # Mise à jour EWMA (première valeur: moyenne = x, variance nulle)
+    ecart = np.where(pret, np.clip(ecart, -limite, limite), ecart)
+    premiere = e['nb'] == 0
+    moyenne = np.where(premiere, x, e['moyenne'] + self.alpha * ecart)
+    variance = np.where(premiere, 0.0, (1.0 - self.alpha) * (e['variance'] + self.alpha * ecart ** 2))
+    e['moyenne'] = np.where(valides, moyenne, e['moyenne'])
+    e['variance'] = np.where(valides, variance, e['variance'])
+    e['nb'] += valides
+
+    # Capteur figé: temps écoulé depuis le dernier changement de la valeur
+    change = valides & ~(np.abs(x - e['reference']) <= e['ecart_min'] / 2)   # vrai si reference NaN
+    e['reference'] = np.where(change, x, e['reference'])
+    e['changement_ns'] = np.where(change, t, e['changement_ns'])
+    drapeaux[valides & (t - e['changement_ns'] >= e['duree_fige_ns'])] |= FIGE
+
+    self.etat[indices] = e
+    return drapeaux
+
+  def statistiques(self, noeud, champ):
+    '''Retour (tuple): (moyenne, écart type, nb) du signal ou None.'''
+    indice = self._indices.get((noeud, champ))
+    if indice is None:
+      return None
+    e = self.etat[indice]
+    return float(e['moyenne']), float(np.sqrt(e['variance'])), int(e['nb'])
+
+
+# ------------------------------------------------------
+# Démonstration: 300 signaux avec défauts injectés
+# ------------------------------------------------------
+if __name__ == '__main__':
+  import time
+  rng = np.random.default_rng(788)
+  n, cycles = 300, 2000
+  detecteur = DetecteurAnomalies()
+  indices = np.array([detecteur.signal(k // 3, ('Temperature', 'Humidity', 'Leq')[k % 3],
+                                       bas = 0.0, haut = 130.0, ecart_min = 0.5,
+                                       duree_fige = 600) for k in range(n)])
+  base = rng.uniform(20, 70, n)
+  drapeaux_vus = {}
+  debut = time.perf_counter()
+  for c in range(cycles):
+    t = np.full(n, c * 6 * NS_PAR_SEC, dtype = np.int64)
+    x = base + rng.normal(0, 1.0, n)
+    if c == 1000:
+      x[7] += 25.0                 # valeur aberrante
+    if c >= 1200:
+      x[42] = 55.0                 # capteur bloqué
+    if c == 1500:
+      x[99] = -1.0                 # DHT11 qui ne répond pas
+    drapeaux = detecteur.mettre_a_jour(indices, t, x)
+    for k in np.flatnonzero(drapeaux):
+      drapeaux_vus.setdefault((int(k), drapeaux_texte(drapeaux[k])), c)
+  duree = time.perf_counter() - debut
+  print(F"{n} signaux x {cycles} cycles en {duree:.2f} s ({1e6 * duree / cycles:.0f} us par cycle)")
+  for (k, texte), c in sorted(drapeaux_vus.items()):
+    print(F"signal {k} {detecteur.signaux[k]}: {texte} (premier au cycle {c})")
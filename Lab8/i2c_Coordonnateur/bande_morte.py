@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+bande_morte.py
+Politique de transmission par bande morte et battement de coeur (heartbeat).
+
+Une valeur n'est transmise (lue sur le bus I2C ou envoyée à ThingSpeak) que si:
+  - c'est la première valeur de ce champ;
+  - elle s'écarte de plus de 'seuil' de la dernière valeur transmise;
+  - ou aucune valeur n'a été transmise depuis 'silence_max' secondes.
+
+Les seuils et silences sont configurés par champ ('Temperature', 'Leq', ...).
+La clé d'une valeur est (source, champ) pour pouvoir gérer plusieurs noeuds.
+
+Ce module fait partie des programmes i2c_coord.py et
+Lab10/test_send_data2.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+NS_PAR_SEC = 1_000_000_000
+
+
+class PolitiqueBandeMorte:
+  '''Décider si une valeur doit être transmise.'''
+  def __init__(self, seuils = None, silences_max = None, seuil_defaut = 0.0,
+               silence_max_defaut = 600):
+    '''Arguments:
+    seuils (dict) -- champ -> écart minimal pour transmettre
+    silences_max (dict) -- champ -> durée max (s) sans transmission
+    seuil_defaut, silence_max_defaut -- valeurs pour les autres champs
+    '''
+    self.seuils = seuils or {}
+    self.silences_max = silences_max or {}
+    self.seuil_defaut = seuil_defaut
+    self.silence_max_defaut = silence_max_defaut
+    self._dernieres = {}        # (source, champ) -> (valeur, temps ns)
+
+  def expire(self, source, champ, t_ns):
+    '''True si le silence max du champ est dépassé (ou jamais transmis).'''
+    derniere = self._dernieres.get((source, champ))
+    if derniere is None:
+      return True
+    silence = self.silences_max.get(champ, self.silence_max_defaut)
+    return t_ns - derniere[1] >= silence * NS_PAR_SEC
+
+  def a_transmettre(self, source, champ, valeur, t_ns):
+    '''True si la valeur doit être transmise (sans rien enregistrer: appeler
+    confirmer() une fois la transmission réussie).'''
+    derniere = self._dernieres.get((source, champ))
+    seuil = self.seuils.get(champ, self.seuil_defaut)
+    return (derniere is None or abs(valeur - derniere[0]) > seuil
+            or self.expire(source, champ, t_ns))
+
+  def filtrer(self, source, champ, valeur, t_ns):
+    '''True si la valeur doit être transmise. Dans ce cas, elle devient la
+    dernière valeur transmise du champ.'''
+    if self.a_transmettre(source, champ, valeur, t_ns):
+      self.confirmer(source, champ, valeur, t_ns)
+      return True
+    return False
+
+  def confirmer(self, source, champ, valeur, t_ns):
+    '''Enregistrer une transmission réussie (voir a_transmettre()).'''
+    self._dernieres[(source, champ)] = (valeur, t_ns)
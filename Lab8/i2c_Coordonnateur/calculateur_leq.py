@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+calculateur_leq.py
+Calcul vectoriel (NumPy) de Vrms, dBV, Li et Leq à partir des échantillons
+bruts de l'ADC du noeud Leq.
+
+Ce module reproduit les classes Calculateur_VRMS, Calculateur_Li et
+Calculateur_Leq du noeud (calculateur_vrms.h, calculateur_li.h et
+calculateur_leq.h) pour que le coordonnateur puisse recalculer ou valider
+les Leq reçus:
+
+  v    = adc x Vmax / ADCmax - Vmax / 2          (volts, niveau CC retiré)
+  dBV  = 20 log10(sqrt(moyenne(v^2)))            (par bloc de nbSample)
+  Li   = dBV + P - M - G                         (P = 94, M = -44, G = 52)
+  Leq  = 10 log10(moyenne(10^(Li / 10)))         (par bloc de nbLi valeurs Li)
+
+Au lieu d'une boucle par échantillon, les blocs sont obtenus par reshape et
+les moyennes par réductions NumPy. La moyenne énergétique du Leq est faite
+dans le domaine logarithmique (on retire le maximum du bloc avant 10^(x/10))
+pour éviter les débordements et la perte de précision.
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+import numpy as np
+
+# Paramètres par défaut du noeud (voir i2c_Leq.ino et calculateur_li.h)
+V_MAX = 3.3          # Tension max à la sortie du capteur sonore
+ADC_MAX = 1024       # Valeur max de l'ADC à 10 bits
+P_SPL = 94.0         # Sensibilité Electret en dB SPL
+M_DBV = -44.0        # Sensibilité Electret en dBV/Pa
+G_DBV = 52.0         # Gain du MAX4466 en dBV
+NB_SAMPLE = 32       # Nb. d'échantillons par valeur Li
+NB_LI = 150          # Nb. de valeurs Li par valeur Leq
+BLOCS_PAR_TRANCHE = 1 << 16   # Taille des tranches de calcul (en blocs)
+
+
+def vrms_dbv(adc, nb_sample = NB_SAMPLE, v_max = V_MAX, adc_max = ADC_MAX):
+  '''Calculer Vrms et dBV de chaque bloc de nb_sample échantillons.
+
+  Arguments:
+  adc (array) -- échantillons bruts de l'ADC (les échantillons d'un dernier
+                 bloc incomplet sont ignorés, comme sur le noeud)
+  nb_sample (int) -- nombre d'échantillons par bloc
+
+  Retour (tuple): (vrms, dbv), deux tableaux d'une valeur par bloc
+  '''
+  adc = np.asarray(adc)
+  nb_blocs = adc.shape[0] // nb_sample
+  blocs = adc[:nb_blocs * nb_sample].reshape((nb_blocs, nb_sample))
+  carre_moyen = np.empty(nb_blocs, dtype = np.float64)
+  # Traiter par tranches de BLOCS_PAR_TRANCHE blocs: la mémoire temporaire
+  # reste bornée même pour des heures d'échantillons (ou un np.memmap).
+  for debut in range(0, nb_blocs, BLOCS_PAR_TRANCHE):
+    v = blocs[debut : debut + BLOCS_PAR_TRANCHE].astype(np.float64)
+    v *= v_max / adc_max
+    v -= v_max / 2.0
+    # Moyenne de v^2 par bloc (einsum évite le tableau temporaire v * v)
+    carre_moyen[debut : debut + v.shape[0]] = np.einsum('ij,ij->i', v, v) / nb_sample
+  with np.errstate(divide = 'ignore'):
+    dbv = 10.0 * np.log10(carre_moyen)
+  return np.sqrt(carre_moyen), dbv
+
+
+def niveaux_li(adc, nb_sample = NB_SAMPLE, p = P_SPL, m = M_DBV, g = G_DBV, **kwargs):
+  '''Calculer les niveaux Li (dB SPL) de chaque bloc de nb_sample échantillons.
+
+  Retour (array): une valeur Li par bloc
+  '''
+  _, dbv = vrms_dbv(adc, nb_sample, **kwargs)
+  return dbv + (p - m - g)
+
+
+def moyenne_energetique(niveaux, axis = -1):
+  '''Moyenne énergétique 10 log10(moyenne(10^(L/10))) le long d'un axe,
+  calculée dans le domaine logarithmique.'''
+  niveaux = np.asarray(niveaux, dtype = np.float64)
+  maximum = np.max(niveaux, axis = axis, keepdims = True)
+  # Un bloc entièrement à -inf (silence parfait) reste à -inf
+  maximum = np.where(np.isfinite(maximum), maximum, 0.0)
+  energie = np.mean(np.power(10.0, (niveaux - maximum) / 10.0), axis = axis, keepdims = True)
+  with np.errstate(divide = 'ignore'):
+    return np.squeeze(maximum + 10.0 * np.log10(energie), axis = axis)
+
+
+def niveaux_leq(li, nb_li = NB_LI):
+  '''Calculer le Leq de chaque bloc de nb_li valeurs Li.
+
+  Note: Sur le noeud, Leq = 10 log10(somme(ti x 10^(Li/10)) / tp) avec
+        tp = ti x nbLi, ce qui est la moyenne énergétique des Li du bloc.
+
+  Retour (array): une valeur Leq par bloc
+  '''
+  li = np.asarray(li)
+  nb_blocs = li.shape[0] // nb_li
+  return moyenne_energetique(li[:nb_blocs * nb_li].reshape((nb_blocs, nb_li)))
+
+
+def calculer_leq(adc, nb_sample = NB_SAMPLE, nb_li = NB_LI, **kwargs):
+  '''Chaîne complète ADC -> Li -> Leq.
+
+  Retour (tuple): (li, leq)
+  '''
+  li = niveaux_li(adc, nb_sample, **kwargs)
+  return li, niveaux_leq(li, nb_li)
+
+
+# ------------------------------------------------------
+# Référence: même calcul que le noeud, échantillon par échantillon
+# ------------------------------------------------------
+def _leq_noeud(adc, nb_sample = NB_SAMPLE, nb_li = NB_LI, ts = 62):
+  '''Rejouer Calculateur_VRMS/Li/Leq comme sur l'Arduino (somme float).'''
+  c1, offset = V_MAX / ADC_MAX, V_MAX / 2.0
+  li, leq = [], []
+  tmp_vrms, nb = 0.0, 0
+  somme, nb_li_count = np.float32(0.0), 0
+  for a in adc:
+    v = (int(a) * c1) - offset
+    tmp_vrms += v * v
+    nb += 1
+    if nb == nb_sample:
+      vrms = np.sqrt(tmp_vrms / nb)
+      li.append(20.0 * np.log10(vrms) + P_SPL - M_DBV - G_DBV)
+      tmp_vrms, nb = 0.0, 0
+      ti = np.float32(ts * nb_sample)
+      somme += ti * np.float32(10.0 ** (0.1 * li[-1]))
+      nb_li_count += 1
+    if nb_li_count == nb_li:
+      tp = np.float32(ts * nb_sample * nb_li)
+      leq.append(10.0 * np.log10(1.0 / tp * somme))
+      somme, nb_li_count = np.float32(0.0), 0
+  return np.array(li), np.array(leq)
+
+
+# ------------------------------------------------------
+# Test de parité avec les formules du noeud
+# ------------------------------------------------------
+if __name__ == '__main__':
+  import time
+  rng = np.random.default_rng(788)
+  # Signal synthétique: bruit dont l'amplitude varie lentement autour de 512
+  n = NB_SAMPLE * NB_LI * 20
+  amplitude = 5 + 150 * rng.random(n // (NB_SAMPLE * 10)).repeat(NB_SAMPLE * 10)
+  adc = np.clip(512 + amplitude * rng.standard_normal(n), 0, 1023).astype(np.int16)
+
+  li, leq = calculer_leq(adc)
+  li_ref, leq_ref = _leq_noeud(adc)
+  print(F"Écart max Li: {np.abs(li - li_ref).max():.2e} dB, "
+        F"écart max Leq: {np.abs(leq - leq_ref).max():.2e} dB")
+  assert np.allclose(li, li_ref, atol = 1e-9) and np.allclose(leq, leq_ref, atol = 1e-3)
+
+  # 50 journées d'échantillons à Ts = 62 ms
+  adc = np.tile(adc, 1 + (50 * 86400 * 1000 // 62) // n)
+  debut = time.perf_counter()
+  calculer_leq(adc)
+  print(F"{adc.shape[0]} échantillons traités en {time.perf_counter() - debut:.2f} s")
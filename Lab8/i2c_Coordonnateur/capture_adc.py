@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+capture_adc.py
+Capturer les échantillons bruts de l'ADC envoyés par le noeud Leq sur son
+port série (commande Flux, voir send_flux() et i2c_Leq.ino).
+
+Trame (little Endian):
+  0xA5 0x5A | seq (1) | n (1) | tick (4) | n x adc (2) | Fletcher-16 (2)
+
+La somme de contrôle couvre seq, n, tick et les échantillons. Le port est lu
+par gros blocs (TAILLE_LECTURE octets); les trames sont retrouvées par leur
+synchronisation et vérifiées par leur somme: les octets parasites (messages
+texte, trame tronquée) sont ignorés. Les trames perdues sont détectées par
+le numéro seq.
+
+Les échantillons sont écrits dans un fichier projeté en mémoire (np.memmap,
+entiers non signés de 16 bits). Le fichier peut ensuite être relu avec
+charger() et passé directement à calculateur_leq.py pour recalculer les Li
+et les Leq (par exemple avec d'autres paramètres) sans reprogrammer le noeud.
+
+Le module n'utilise que la bibliothèque standard pour le port série
+(termios). Pour les essais sans noeud, simulateur() écrit des trames dans un
+pseudo-terminal (os.openpty()).
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+import os
+import select
+import struct
+import termios
+import time
+import tty
+import numpy as np
+
+SYNC = b'\xa5\x5a'
+ENTETE = struct.Struct('<BBI')       # seq, n, tick
+SOMME = struct.Struct('<H')
+NB_ECH_MAX = 128                     # n plus grand: trame invalide
+TAILLE_LECTURE = 1 << 16             # octets par lecture du port
+DEBITS = {9600 : termios.B9600, 19200 : termios.B19200, 38400 : termios.B38400,
+          57600 : termios.B57600, 115200 : termios.B115200}
+
+
+def fletcher16(octets):
+  '''Somme de contrôle Fletcher-16 (celle du noeud).
+
+  s1 = somme des octets, s2 = somme des s1 successifs (modulo 255). Le calcul
+  est vectoriel: s2 = somme de (n - i) x octet[i].
+  '''
+  b = np.frombuffer(octets, dtype = np.uint8).astype(np.int64)
+  s1 = int(b.sum()) % 255
+  s2 = int(np.dot(np.arange(len(b), 0, -1), b)) % 255
+  return (s2 << 8) | s1
+
+
+def trame(seq, adc, tick = 0):
+  '''Construire une trame (comme le noeud). Sert au simulateur.'''
+  corps = ENTETE.pack(seq & 0xFF, len(adc), tick & 0xFFFFFFFF) + np.asarray(adc, dtype = '<u2').tobytes()
+  return SYNC + corps + SOMME.pack(fletcher16(corps))
+
+
+class DecodeurTrames:
+  '''Retrouver les trames valides dans un flux d'octets.'''
+  def __init__(self):
+    self._tampon = bytearray()
+    self._seq = None
+    self.trames = 0          # trames valides
+    self.perdues = 0         # trames manquantes (saut de seq)
+    self.rejetees = 0        # synchronisations sans trame valide
+
+  def ajouter(self, octets):
+    '''Ajouter des octets lus du port.
+
+    Retour (list): trames complètes [(trames perdues avant, tick, adc)]
+    '''
+    self._tampon += octets
+    tampon = self._tampon
+    trames = []
+    debut = 0
+    while True:
+      i = tampon.find(SYNC, debut)
+      if i < 0:
+        # Garder le dernier octet: il peut être le début de SYNC
+        debut = max(debut, len(tampon) - 1)
+        break
+      if len(tampon) - i < len(SYNC) + ENTETE.size:
+        debut = i
+        break
+      seq, n, tick = ENTETE.unpack_from(tampon, i + len(SYNC))
+      taille = len(SYNC) + ENTETE.size + 2 * n + SOMME.size
+      if n == 0 or n > NB_ECH_MAX:
+        self.rejetees += 1
+        debut = i + 1
+        continue
+      if len(tampon) - i < taille:
+        debut = i
+        break
+      corps = bytes(tampon[i + len(SYNC) : i + taille - SOMME.size])
+      if SOMME.unpack_from(tampon, i + taille - SOMME.size)[0] != fletcher16(corps):
+        self.rejetees += 1
+        debut = i + 1
+        continue
+      perdues = 0 if self._seq is None else (seq - self._seq - 1) % 256
+      self._seq = seq
+      self.trames += 1
+      self.perdues += perdues
+      adc = np.frombuffer(corps, dtype = '<u2', offset = ENTETE.size)
+      trames.append((perdues, tick, adc))
+      debut = i + taille
+    del tampon[:debut]
+    return trames
+
+
+class FichierADC:
+  '''Échantillons de l'ADC dans un fichier projeté en mémoire.'''
+  def __init__(self, fichier, capacite):
+    '''Arguments:
+    fichier (str) -- fichier des échantillons (uint16 little Endian)
+    capacite (int) -- nombre maximal d'échantillons
+    '''
+    self.fichier = fichier
+    self._donnees = np.memmap(fichier, dtype = '<u2', mode = 'w+', shape = (capacite,))
+    self.nb = 0
+
+  @property
+  def plein(self):
+    return self.nb >= self._donnees.shape[0]
+
+  def ajouter(self, adc):
+    '''Ajouter des échantillons (les surplus sont ignorés).'''
+    n = min(len(adc), self._donnees.shape[0] - self.nb)
+    self._donnees[self.nb : self.nb + n] = adc[:n]
+    self.nb += n
+
+  def fermer(self):
+    '''Écrire les données et ramener le fichier aux échantillons reçus.'''
+    self._donnees.flush()
+    del self._donnees
+    os.truncate(self.fichier, self.nb * 2)
+
+
+def ouvrir_port(chemin, debit = 115200):
+  '''Ouvrir un port série (ou un pseudo-terminal) en lecture brute.
+
+  Exceptions possibles: OSError, KeyError (débit non supporté)
+  '''
+  fd = os.open(chemin, os.O_RDONLY | os.O_NOCTTY)
+  tty.setraw(fd)
+  attributs = termios.tcgetattr(fd)
+  attributs[4] = attributs[5] = DEBITS[debit]       # vitesses entrée/sortie
+  termios.tcsetattr(fd, termios.TCSANOW, attributs)
+  return fd
+
+
+def capturer(fd, fichier, nb_echantillons, duree = None, delai = 2.0):
+  '''Capturer des échantillons du port jusqu'à nb_echantillons ou duree.
+
+  Arguments:
+  fd (int) -- descripteur du port (voir ouvrir_port())
+  fichier (str) -- fichier des échantillons
+  nb_echantillons (int) -- nombre d'échantillons voulus
+  duree (float) -- durée maximale (sec) de la capture ou None
+  delai (float) -- fin de la capture si rien n'est reçu pendant delai sec
+
+  Retour (dict): nombre d'échantillons, trames valides, perdues et rejetées
+                 et trous [(indice du premier échantillon après le trou,
+                 nombre de trames perdues)]
+  '''
+  decodeur = DecodeurTrames()
+  sortie = FichierADC(fichier, nb_echantillons)
+  trous = []
+  fin = None if duree is None else time.monotonic() + duree
+  try:
+    while not sortie.plein and (fin is None or time.monotonic() < fin):
+      pret, _, _ = select.select([fd], [], [], delai)
+      if not pret:
+        break
+      octets = os.read(fd, TAILLE_LECTURE)
+      if not octets:
+        break
+      for perdues, _, adc in decodeur.ajouter(octets):
+        if perdues:
+          trous.append((sortie.nb, perdues))
+        sortie.ajouter(adc)
+  finally:
+    sortie.fermer()
+  return {'echantillons' : sortie.nb, 'trames' : decodeur.trames,
+          'perdues' : decodeur.perdues, 'rejetees' : decodeur.rejetees,
+          'trous' : trous}
+
+
+def charger(fichier):
+  '''Relire une capture (tableau en lecture seule, projeté en mémoire).'''
+  return np.memmap(fichier, dtype = '<u2', mode = 'r')
+
+
+def simulateur(fd, adc, nb_ech_trame = 32, perdre = (), parasites = True):
+  '''Écrire les échantillons adc en trames dans fd (côté maître d'un
+  pseudo-terminal), comme le noeud. Les trames d'indices 'perdre' ne sont
+  pas écrites et, avec 'parasites', un message texte précède la première.'''
+  if parasites:
+    os.write(fd, "Commande 'Flux' reçue\r\n".encode())
+  for k in range(len(adc) // nb_ech_trame):
+    if k not in perdre:
+      donnees = trame(k, adc[k * nb_ech_trame : (k + 1) * nb_ech_trame], tick = 62 * 32 * k)
+      # Écrire en petits morceaux: les lectures reçoivent des trames coupées
+      for i in range(0, len(donnees), 25):
+        os.write(fd, donnees[i : i + 25])
+
+
+# ------------------------------------------------------
+# Capture d'un noeud simulé par un pseudo-terminal
+# ------------------------------------------------------
+if __name__ == '__main__':
+  import argparse
+  import tempfile
+  import threading
+  import calculateur_leq as cl
+  parser = argparse.ArgumentParser(description = "Capture des échantillons de l'ADC du noeud Leq")
+  parser.add_argument('--port', help = "port série du noeud (simulé si absent)")
+  parser.add_argument('--debit', type = int, default = 115200)
+  parser.add_argument('--fichier', help = "fichier de la capture")
+  parser.add_argument('--nb', type = int, default = cl.NB_SAMPLE * cl.NB_LI * 4,
+                      help = "nombre d'échantillons")
+  args = parser.parse_args()
+  fichier = args.fichier or os.path.join(tempfile.mkdtemp(), 'adc.u16')
+
+  if args.port:
+    fd = ouvrir_port(args.port, args.debit)
+    attendus = None
+  else:
+    rng = np.random.default_rng(788)
+    t = np.arange(args.nb)
+    amplitude = 40 + 30 * np.sin(2 * np.pi * t / args.nb)
+    attendus = np.clip(512 + amplitude * rng.standard_normal(args.nb), 0, 1023).astype(np.uint16)
+    maitre, esclave = os.openpty()
+    fd = ouvrir_port(os.ttyname(esclave))
+    perdre = {10, 11, 500}
+    fil = threading.Thread(target = simulateur, args = (maitre, attendus), kwargs = {'perdre' : perdre})
+    fil.start()
+
+  debut = time.perf_counter()
+  bilan = capturer(fd, fichier, args.nb, delai = 1.0)
+  print(F"Capture: {bilan['echantillons']} échantillons en {time.perf_counter() - debut:.2f} s, "
+        F"{bilan['trames']} trames, {bilan['perdues']} perdues, {bilan['rejetees']} rejetées")
+  print(F"Trous: {bilan['trous']}")
+
+  adc = charger(fichier)
+  li = cl.niveaux_li(adc)
+  print(F"{len(li)} Li: min {li.min():.1f}, max {li.max():.1f} dB SPL")
+  if attendus is not None:
+    fil.join()
+    gardes = np.delete(attendus.reshape(-1, 32), sorted(perdre), axis = 0).ravel()
+    print(F"Échantillons identiques à ceux du noeud simulé: {np.array_equal(adc, gardes[:len(adc)])}")
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+compression.py
+Compression des blocs de l'historique (temps int64 en ns, valeurs float32)
+inspirée de Gorilla (Facebook, 2015): sans perte pour les valeurs, temps
+arrondis au pas choisi.
+
+Temps: différence de différences (dod)
+  Les temps sont d'abord arrondis au pas 'pas_ns' (en-tête du bloc; 1 ms
+  dans l'historique). Les horodatages time_ns() du coordonnateur ont une
+  gigue de l'ordre de la ms (réveil GPIO, bus I2C, ordonnanceur): en ns,
+  chaque dod coûterait 20 à 30 bits de bruit. Le pas de 1 ms est la
+  résolution des ticks des noeuds (millis()); pas_ns = 1 garde les ns (sans
+  perte).
+
+  Les échantillons arrivent à période presque fixe: la différence entre deux
+  écarts successifs (en pas) est le plus souvent nulle ou petite. Chaque dod
+  est écrit avec un préfixe qui donne sa taille:
+
+    0                        dod = 0
+    10    + 3 bits           -4 <= dod < 4 pas (arrondi, gigue d'une ms)
+    110   + 8 bits           |dod| < 2^7 pas   (128 ms au pas de 1 ms)
+    1110  + 16 bits          |dod| < 2^15 pas  (~33 s)
+    11110 + 32 bits          |dod| < 2^31 pas  (~25 jours)
+    11111 + 64 bits          autres
+
+  Le premier temps est dans l'en-tête du bloc; le premier écart est écrit
+  comme un dod (écart précédent nul).
+
+Valeurs: XOR avec la valeur précédente (bits du float32), sans perte
+    0                        même valeur (DHT11 stable, capteur figé)
+    10 + bits significatifs  XOR dans la fenêtre (zéros de tête et de queue)
+                             de la dernière fenêtre écrite
+    11 + 5 bits (zéros de tête) + 5 bits (longueur - 1) + bits significatifs
+  La première valeur est écrite sur 32 bits.
+
+Chaque bloc a un en-tête (DTYPE_BLOC: premier et dernier temps, nombre,
+min, max, pas des temps, position et taille dans le fichier des blocs): une
+requête sur un intervalle de temps ou de valeurs saute les blocs qui ne la
+touchent pas sans les décompresser.
+
+L'encodage est vectoriel (NumPy) sauf le choix de la fenêtre des valeurs,
+qui dépend de la fenêtre précédente. Le décodage lit le flux de bits valeur
+par valeur.
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+import numpy as np
+
+DTYPE_BLOC = np.dtype([('debut', '<i8'), ('fin', '<i8'),      # premier et dernier temps (ns)
+                       ('nb', '<i8'),                         # nombre d'échantillons
+                       ('min', '<f4'), ('max', '<f4'),        # valeurs extrêmes (sans NaN)
+                       ('pas_ns', '<i8'),                     # pas des temps (ns)
+                       ('position', '<i8'), ('taille', '<i8')])   # octets dans le fichier
+
+# Classes des dod: (préfixe, longueur du préfixe, bits de la valeur)
+CLASSES_DOD = ((0b10, 2, 3), (0b110, 3, 8), (0b1110, 4, 16), (0b11110, 5, 32), (0b11111, 5, 64))
+
+
+def _longueur_bits(x):
+  '''Nombre de bits de chaque entier x >= 0 (0 pour 0), x < 2^53.'''
+  return np.frexp(x.astype(np.float64))[1].astype(np.int64)
+
+
+def _empaqueter(codes, longueurs):
+  '''Concaténer les champs de bits (codes, longueurs <= 64) en octets.'''
+  garder = longueurs > 0
+  codes, longueurs = codes[garder], longueurs[garder]
+  total = int(longueurs.sum())
+  champ = np.repeat(np.arange(len(codes)), longueurs)
+  rang = np.arange(total) - np.repeat(np.cumsum(longueurs) - longueurs, longueurs)
+  decalage = (longueurs[champ] - 1 - rang).astype(np.uint64)
+  bits = ((codes[champ] >> decalage) & np.uint64(1)).astype(np.uint8)
+  return np.packbits(bits).tobytes()
+
+
+def compresser(temps_ns, valeurs, pas_ns = 1):
+  '''Compresser un bloc d'échantillons.
+
+  Arguments:
+  temps_ns (array d'int64) -- horodatages croissants (au moins un)
+  valeurs (array de float32) -- valeurs correspondantes
+  pas_ns (int) -- les temps sont arrondis à un multiple de pas_ns (1: sans
+                  perte)
+
+  Retour (tuple): (en-tête DTYPE_BLOC sans position, octets du bloc)
+  '''
+  t = (np.asarray(temps_ns, dtype = np.int64) + pas_ns // 2) // pas_ns
+  v = np.ascontiguousarray(valeurs, dtype = np.float32)
+  n = len(t)
+  entete = np.zeros(1, dtype = DTYPE_BLOC)[0]
+  entete['debut'], entete['fin'], entete['nb'] = t[0] * pas_ns, t[-1] * pas_ns, n
+  entete['pas_ns'] = pas_ns
+  if np.all(np.isnan(v)):
+    entete['min'] = entete['max'] = np.nan
+  else:
+    entete['min'], entete['max'] = np.nanmin(v), np.nanmax(v)
+
+  # Temps: préfixe et valeur du dod de chaque échantillon après le premier
+  dod = np.diff(np.diff(t), prepend = 0)
+  prefixes = np.zeros(n - 1, dtype = np.uint64)
+  longueurs_prefixes = np.ones(n - 1, dtype = np.int64)
+  bits_dod = np.zeros(n - 1, dtype = np.int64)
+  reste = dod != 0
+  for prefixe, longueur, bits in CLASSES_DOD:
+    classe = reste & ((bits == 64) | ((dod >= -(1 << (bits - 1))) & (dod < (1 << (bits - 1)))))
+    prefixes[classe], longueurs_prefixes[classe], bits_dod[classe] = prefixe, longueur, bits
+    reste &= ~classe
+  masques = np.where(bits_dod == 64, np.uint64(0xFFFFFFFFFFFFFFFF),
+                     (np.uint64(1) << bits_dod.astype(np.uint64)) - np.uint64(1))
+  valeurs_dod = dod.view(np.uint64) & masques
+
+  # Valeurs: XOR avec la précédente, zéros de tête et de queue
+  u = v.view(np.uint32).astype(np.int64)
+  xor = u[1:] ^ u[:-1]
+  tete = 32 - _longueur_bits(xor)
+  queue = _longueur_bits(xor & -xor) - 1
+  # Réutiliser la dernière fenêtre écrite si le XOR y tient (séquentiel)
+  reutiliser = np.zeros(n - 1, dtype = bool)
+  fenetre_tete = np.zeros(n - 1, dtype = np.int64)
+  fenetre_queue = np.zeros(n - 1, dtype = np.int64)
+  ft, fq = -1, -1
+  for i in np.flatnonzero(xor).tolist():
+    if ft >= 0 and tete[i] >= ft and queue[i] >= fq:
+      reutiliser[i] = True
+    else:
+      ft, fq = int(tete[i]), int(queue[i])
+    fenetre_tete[i], fenetre_queue[i] = ft, fq
+  significatifs = 32 - fenetre_tete - fenetre_queue
+  bits_xor = (xor >> np.where(xor != 0, fenetre_queue, 0)).astype(np.uint64)
+  s = significatifs.astype(np.uint64)
+  codes_valeurs = np.where(xor == 0, np.uint64(0),
+                  np.where(reutiliser, (np.uint64(0b10) << s) | bits_xor,
+                           (((np.uint64(0b11) << np.uint64(10))
+                             | (fenetre_tete.astype(np.uint64) << np.uint64(5))
+                             | (s - np.uint64(1))) << s) | bits_xor))
+  longueurs_valeurs = np.where(xor == 0, 1, np.where(reutiliser, 2, 12) + significatifs)
+
+  # Champs dans l'ordre du flux: première valeur, puis (préfixe, dod, valeur)
+  codes = np.empty(1 + 3 * (n - 1), dtype = np.uint64)
+  longueurs = np.empty(1 + 3 * (n - 1), dtype = np.int64)
+  codes[0], longueurs[0] = u[0], 32
+  codes[1::3], codes[2::3], codes[3::3] = prefixes, valeurs_dod, codes_valeurs
+  longueurs[1::3], longueurs[2::3], longueurs[3::3] = longueurs_prefixes, bits_dod, longueurs_valeurs
+  return entete, _empaqueter(codes, longueurs)
+
+
+class _LecteurBits:
+  '''Lire des champs de bits (<= 64) dans des octets.'''
+  def __init__(self, octets):
+    self.octets = bytes(octets) + bytes(9)
+    self.position = 0
+
+  def lire(self, n):
+    p = self.position
+    fenetre = int.from_bytes(self.octets[p >> 3 : (p >> 3) + 9], 'big')
+    self.position = p + n
+    return (fenetre >> (72 - (p & 7) - n)) & ((1 << n) - 1)
+
+  def prefixe(self, maximum):
+    '''Nombre de 1 avant le premier 0 (au plus 'maximum').'''
+    n = 0
+    while n < maximum and self.lire(1):
+      n += 1
+    return n
+
+
+def decompresser(entete, octets):
+  '''Décompresser un bloc.
+
+  Retour (tuple): (temps int64, valeurs float32)
+  '''
+  n = int(entete['nb'])
+  pas_ns = int(entete['pas_ns'])
+  temps = np.empty(n, dtype = np.int64)
+  bits = np.empty(n, dtype = np.uint32)
+  lecteur = _LecteurBits(octets)
+  t = int(entete['debut']) // pas_ns
+  temps[0] = t
+  u = lecteur.lire(32)
+  bits[0] = u
+  ecart = 0
+  ft, fs = 0, 0                   # fenêtre: zéros de tête, bits significatifs
+  for i in range(1, n):
+    classe = lecteur.prefixe(len(CLASSES_DOD))
+    if classe:
+      nb_bits = CLASSES_DOD[classe - 1][2]
+      dod = lecteur.lire(nb_bits)
+      if dod >> (nb_bits - 1):
+        dod -= 1 << nb_bits
+      ecart += dod
+    t += ecart
+    temps[i] = t
+    if lecteur.lire(1):
+      if lecteur.lire(1):
+        ft = lecteur.lire(5)
+        fs = lecteur.lire(5) + 1
+      u ^= lecteur.lire(fs) << (32 - ft - fs)
+    bits[i] = u
+  return temps * pas_ns, bits.view(np.float32)
+
+
+# ------------------------------------------------------
+# Taux de compression des journaux du laboratoire et d'horodatages
+# réalistes du coordonnateur
+# ------------------------------------------------------
+if __name__ == '__main__':
+  import os
+  import time
+  import tempfile
+  from historique import Historique
+  from ingestion_journaux import ingerer
+  racine = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+  historique = Historique(tempfile.mkdtemp(), taille_bloc = None)
+  ingerer(historique, os.path.join(racine, 'measurementDHT.txt'), noeud = 'dht')
+  ingerer(historique, os.path.join(racine, 'measurementELECTRET.txt'), noeud = 'electret')
+  rng = np.random.default_rng(788)
+  n = 100_000
+  series = {}
+  for noeud, champ in (('dht', 'Temperature'), ('dht', 'Humidity'), ('electret', 'Leq')):
+    t, v = historique.lire(noeud, champ)
+    # Prolonger les journaux (répétés) pour avoir des blocs pleins
+    k = -(-n // len(t))
+    periode = int(np.median(np.diff(t))) if len(t) > 1 else 6 * 10**9
+    series[F"{noeud} {champ}"] = (t[0] + periode * np.arange(k * len(t), dtype = np.int64),
+                                  np.tile(np.asarray(v), k))
+  # Coordonnateur: horodatages time_ns() à la lecture des noeuds. Horloge
+  # du noeud décalée de 300 ppm, latence du réveil GPIO et de la lecture I2C
+  # (1 à 3 ms) et, une fois sur cent, un retard de l'ordre de 20 ms de
+  # l'ordonnanceur.
+  latence = 1_000_000 + rng.gamma(2.0, 500_000, n) + (rng.random(n) < 0.01) * rng.exponential(20e6, n)
+  t = (6.0018e9 * np.arange(n)).astype(np.int64) + latence.astype(np.int64)
+  series['coordonnateur Temperature'] = (t, np.round(22 + np.cumsum(rng.normal(0, 0.02, n))).astype(np.float32))
+  series['coordonnateur Leq'] = (t, (55 + 5 * np.sin(np.arange(n) / 500) + rng.normal(0, 0.5, n)).round(2).astype(np.float32))
+
+  # Pas des temps: 1 ns (sans perte) et 1 ms (historique)
+  for nom, (t, v) in series.items():
+    for pas_ns in (1, 1_000_000):
+      taille, debut = 0, time.perf_counter()
+      blocs = []
+      for i in range(0, len(t), 1024):
+        entete, octets = compresser(t[i : i + 1024], v[i : i + 1024], pas_ns)
+        taille += len(octets) + DTYPE_BLOC.itemsize
+        blocs.append((entete, octets))
+      duree_c, debut = time.perf_counter() - debut, time.perf_counter()
+      arrondis = (t + pas_ns // 2) // pas_ns * pas_ns
+      identiques = all(np.array_equal(decompresser(e, o)[0], arrondis[k * 1024 : (k + 1) * 1024]) and
+                       np.array_equal(decompresser(e, o)[1].view(np.uint32),
+                                      v[k * 1024 : (k + 1) * 1024].view(np.uint32))
+                       for k, (e, o) in enumerate(blocs))
+      duree_d = (time.perf_counter() - debut) / 2
+      print(F"{nom:26s} pas {pas_ns:>7d} ns: {12 * len(t) / taille:5.1f} x "
+            F"({12 * len(t)} -> {taille} octets), compression {duree_c:.2f} s, "
+            F"décompression {duree_d:.2f} s, identiques: {identiques}")
@@ -20,6 +20,98 @@ Juillet 2020
 SAMPLING_TIME = 15      # Ts du coordonnateur
 NEW_TS = 6              # nouvelle Ts pour le noeud
 
+# Durée couverte par un Leq du noeud (tp = ts x nbSample x nbLi). Note: le
+# noeud Leq interprète NEW_TS en ms (leq.SetTs), voir i2c_Leq.ino.
+# Ts change en marche (controle_ts.py, règles): le coordonnateur calcule tp
+# avec le Ts_Large lu dans l'instantané et l'écrit avec chaque Leq dans
+# l'anneau (champ 'duree'). LEQ_TP_SEC n'est que le tp au démarrage.
+LEQ_NB_SAMPLE = 32
+LEQ_NB_LI = 150
+LEQ_TP_PAR_TS = LEQ_NB_SAMPLE * LEQ_NB_LI / 1000   # secondes de tp par ms de Ts
+LEQ_TP_SEC = NEW_TS * LEQ_TP_PAR_TS
+
+# Battement de coeur (voir bande_morte.py). Un champ n'est lu que si le noeud
+# l'a marqué comme changé ou si aucune lecture n'a été faite depuis
+# SILENCE_MAX secondes.
+SILENCE_MAX = {'Temperature' : 600, 'Humidity' : 600, 'Leq' : 300}
+
+# Contrôle de Ts selon la variabilité des signaux (voir controle_ts.py):
+# résolution voulue par champ, bornes de Ts (unités du noeud) et durée d'un
+# échantillon par unité de Ts. Ts est envoyé sur 2 octets (send_Ts_large).
+CONTROLE_TS = {
+  0x44 : {'resolutions' : {'Temperature' : 0.5, 'Humidity' : 1.0},
+          'ts_min' : 5, 'ts_max' : 3600, 'echelle' : 1.0},
+  0x45 : {'resolutions' : {'Leq' : 1.0},
+          'ts_min' : 5, 'ts_max' : 1000, 'echelle' : LEQ_TP_PAR_TS},
+}
+
+# Règles des commandes envoyées aux noeuds (voir regles.py). Elles sont
+# évaluées à chaque nouvel échantillon.
+REGLES = (
+  {'nom' : 'pause', 'si' : ('Sample_Num', 'entre', 10, 12), 'action' : ('pause', 10)},
+  {'nom' : 'reset', 'si' : ('Sample_Num', '>=', 15), 'action' : ('reset',)},
+  # Bruit soudain: échantillonner le noeud Leq plus souvent
+  {'nom' : 'bruit', 'noeud' : 0x45, 'front' : True, 'delai' : 600,
+   'si' : ('Leq', 'max', 300, '>', 75.0), 'action' : ('ts', 5)},
+  {'nom' : 'chaleur', 'noeud' : 0x44, 'front' : True,
+   'si' : ('Temperature', 'moyenne', 600, '>', 30.0),
+   'action' : ('alerte', 'Température moyenne > 30 C sur 10 min')},
+)
+
+# Lignes "données prêtes" (voir gpio_evenements.py): le coordonnateur attend
+# l'impulsion d'un noeud puis ne lit que ce noeud. Tous les noeuds sont lus
+# si aucune impulsion n'arrive pendant GPIO_DELAI_MAX secondes.
+# GPIO_SOURCE: 'rpi' (GPIO BCM de I2C_NODE_GPIO) ou 'simule' (impulsions à
+# la période des noeuds, pour les essais sans câblage).
+GPIO_SOURCE = 'rpi'
+I2C_NODE_GPIO = {0x44 : 17, 0x45 : 27}
+GPIO_DELAI_MAX = 4 * SAMPLING_TIME
+GPIO_PERIODES_SIMULEES = {0x44 : NEW_TS, 0x45 : LEQ_TP_SEC}
+
+# Répertoire de l'historique des échantillons (voir historique.py)
+REPERTOIRE_HISTORIQUE = 'historique'
+
+# Événements bruyants (voir evenements_bruit.py): début au seuil (dB), fin
+# sous seuil - hystérésis, durée min. (s) d'un événement gardé (fixe: elle
+# ne dépend pas du tp courant du noeud Leq). Les événements sont écrits dans
+# l'historique par le consommateur 'stockage'.
+EVENEMENTS_SEUIL = 65.0
+EVENEMENTS_HYSTERESIS = 3.0
+EVENEMENTS_DUREE_MIN = 60.0
+
+# Pipeline (voir pipeline.py): taille de l'anneau en mémoire partagée et
+# consommateurs lancés chacun dans leur processus par le coordonnateur
+# ('console', 'stockage', 'envoi', 'inference', 'anomalies')
+PIPELINE_CAPACITE = 4096
+PIPELINE_CONSOMMATEURS = ('console', 'stockage', 'anomalies')
+
+# Consommateur 'envoi': canal ThingSpeak (rien n'est envoyé sans clé)
+THINGSPEAK_URL = 'https://api.thingspeak.com/update'
+THINGSPEAK_CLE = ''
+THINGSPEAK_CHAMPS = {'Temperature' : 'field1', 'Humidity' : 'field2', 'Leq' : 'field3'}
+THINGSPEAK_BANDE_MORTE = {'Temperature' : 0.5, 'Humidity' : 1.0, 'Leq' : 0.5}
+THINGSPEAK_DELAI = 20   # délai min. entre deux envois (licence gratuite: 15 s)
+# Envoyer les événements bruyants au lieu des échantillons (un envoi par
+# événement): champs de l'événement et texte (voir evenements_bruit.texte())
+# dans 'status'.
+THINGSPEAK_EVENEMENTS = False
+THINGSPEAK_CHAMPS_EVENEMENTS = {'lmax' : 'field4', 'sel' : 'field5', 'duree' : 'field6'}
+
+# Consommateur 'anomalies' (voir anomalies.py): pour chaque champ surveillé,
+# bornes physiques du capteur, écart type min. (résolution) et durée (s) sans
+# changement d'un capteur bloqué. Les agrégats (_Min, _Max, _Moy) utilisent
+# les paramètres de leur champ.
+ANOMALIES_CHAMPS = {'Temperature' : (0.0, 50.0, 1.0, 6 * 3600),      # DHT11
+                    'Humidity' : (5.0, 95.0, 1.0, 6 * 3600),
+                    'Leq' : (20.0, 130.0, 0.1, 3600)}
+ANOMALIES_ALPHA = 0.02  # facteur des moyennes exponentielles
+ANOMALIES_SEUIL = 5.0   # écarts types d'une valeur aberrante
+
+# Consommateur 'inference': réseau LSTM entraîné (voir Lab12/LSTM)
+REPERTOIRE_LSTM = '../../Lab12/LSTM'
+FICHIER_RESEAU_LSTM = 'reseau_lstm.h5'
+FICHIER_NORMALISATION_LSTM = 'normalisation.npz'
+
 # Adresses IC2 du noeud - tuple
 I2C_ADDRESS = (0x44, 0x45)
 
@@ -33,6 +125,18 @@ I2C_CMD_SET_STOP = 0xA1 # Arrêter l'échantillonnage
 I2C_CMD_SET_GO = 0xA2   # Démarrer l'échantillonnage
 I2C_CMD_SET_RESET = 0xA3 # Mise a zero de l'échantillonnage
 I2C_CMD_SET_PAUSE = 0xA4  # Mettre sur pause l'écantillonage
+I2C_CMD_GROUP = 0xA6    # Commande de groupe (voir ci-dessous)
+I2C_CMD_SET_FLUX = 0xA7 # Flux des échantillons de l'ADC sur le port série
+                        # du noeud Leq (voir capture_adc.py)
+
+# Commande de groupe: une seule transaction à l'adresse de l'appel général
+#   [I2C_CMD_GROUP, masque des groupes, numéro, commande, argument optionnel]
+# Chaque noeud visé exécute la commande et copie le numéro dans son registre
+# d'accusé de réception, relu ensuite par le coordonnateur.
+I2C_GENERAL_CALL = 0x00
+I2C_GROUPES = {'tous' : 0xFF, 'climat' : 0x01, 'acoustique' : 0x02}
+I2C_NODE_GROUPES = {0x44 : 0x01, 0x45 : 0x02}   # GROUPES de chaque noeud
+I2C_ACK_DELAY = 0.01    # attente (sec) avant de relire les accusés
 
 # Adresse des registres sur le noeud. Elle correspond
 # à la carte des registres du noeud.
@@ -51,4 +155,54 @@ I2C_NODE_HUM_MSB1 = 10
 I2C_NODE_LEQ_LSB0 = 3        # Leq
 I2C_NODE_LEQ_LSB1 = 4        # (float sur 4 octets)
 I2C_NODE_LEQ_MSB0 = 5
-I2C_NODE_LEQ_MSB1 = 6
\ No newline at end of file
+I2C_NODE_LEQ_MSB1 = 6
+
+I2C_NODE_DHT_STATUS = 11     # Registre des changements du DHT11 (1 octet)
+I2C_NODE_LEQ_STATUS = 7      # Registre des changements du Leq (1 octet)
+
+# Bits des registres des changements (remis à zéro par le noeud à la lecture)
+I2C_STATUS_TEMP = 0x01
+I2C_STATUS_HUM = 0x02
+I2C_STATUS_LEQ = 0x01
+
+I2C_NODE_DHT_ACK = 12        # Accusé de réception du DHT11 (1 octet)
+I2C_NODE_LEQ_ACK = 8         # Accusé de réception du Leq (1 octet)
+I2C_NODE_ACK = {0x44 : I2C_NODE_DHT_ACK, 0x45 : I2C_NODE_LEQ_ACK}
+
+# Temps du noeud (millis, uint32 sur 4 octets, voir synchro_horloge.py)
+I2C_NODE_DHT_TICK_ECHAN = 13 # Tick du dernier échantillon du DHT11
+I2C_NODE_DHT_TICK = 17       # Tick mémorisé au choix de ce registre
+I2C_NODE_LEQ_TICK_ECHAN = 9  # Tick du dernier Leq
+I2C_NODE_LEQ_TICK = 13       # Tick mémorisé au choix de ce registre
+I2C_NODE_TICK_ECHAN = {0x44 : I2C_NODE_DHT_TICK_ECHAN, 0x45 : I2C_NODE_LEQ_TICK_ECHAN}
+I2C_NODE_TICK = {0x44 : I2C_NODE_DHT_TICK, 0x45 : I2C_NODE_LEQ_TICK}
+
+I2C_NODE_DHT_TS_LARGE = 21   # Ts du DHT11 sur 2 octets
+I2C_NODE_LEQ_TS_LARGE = 17   # Ts du Leq sur 2 octets
+
+I2C_NODE_DHT_GENERATION = 23 # Numéro de la copie publiée par le DHT11
+I2C_NODE_LEQ_GENERATION = 19 # Numéro de la copie publiée par le Leq
+
+# Lecture de tous les registres en une transaction à partir de l'adresse
+# I2C_NODE_SNAPSHOT. Le noeud publie ses échantillons dans une copie de sa
+# carte des registres: la lecture est toujours cohérente.
+# Format struct (little Endian, sans remplissage) et nom de chaque champ.
+I2C_NODE_SNAPSHOT = 0
+I2C_NODE_CARTE = {
+  0x44 : ('<BHffBBIIHB', ('Ts', 'Sample_Num', 'Temperature', 'Humidity',
+                          'Changements', 'Ack', 'Tick_Echan', 'Tick',
+                          'Ts_Large', 'Generation')),
+  0x45 : ('<BHfBBIIHB', ('Ts', 'Sample_Num', 'Leq', 'Changements', 'Ack',
+                         'Tick_Echan', 'Tick', 'Ts_Large', 'Generation'))
+}
+
+# Agrégats des échantillons publiés depuis la dernière lecture (min, max et
+# moyenne; moyenne énergétique pour le Leq). Le noeud les remet à zéro quand
+# ils sont lus. Ils suivent la carte ci-dessus et sont lus par un second bloc
+# (une lecture est limitée à 32 octets). Format: (registre, struct, champs).
+I2C_NODE_DHT_AGREGATS = 24
+I2C_NODE_LEQ_AGREGATS = 20
+I2C_NODE_AGREGATS = {
+  0x44 : (I2C_NODE_DHT_AGREGATS, '<Hffffff', ('Temperature', 'Humidity')),
+  0x45 : (I2C_NODE_LEQ_AGREGATS, '<Hfff', ('Leq',))
+}
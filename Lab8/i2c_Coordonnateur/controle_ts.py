@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+controle_ts.py
+Adapter la période d'échantillonnage (Ts) de chaque noeud à la variabilité
+de ses signaux.
+
+Pour chaque champ, on estime en ligne le taux de variation quadratique
+  taux = E[(v[k] - v[k-1])^2 / dt]           (unités^2 par seconde)
+avec une moyenne mobile exponentielle de constante de temps 'tau'. Pour un
+signal qui varie comme une marche aléatoire, l'écart attendu entre deux
+échantillons pris à T secondes d'intervalle est sqrt(taux x T). On choisit
+donc la période pour que cet écart soit égal à la résolution voulue:
+
+  T = resolution^2 / taux
+
+Un noeud à plusieurs champs prend la plus petite période. La période est
+bornée par [ts_min, ts_max] et une nouvelle valeur n'est envoyée que si elle
+s'écarte de plus de 'hysteresis' (relatif) de la valeur courante et après
+'delai' secondes depuis le dernier changement.
+
+'echelle' est la durée (s) d'un échantillon du noeud par unité de Ts:
+1 pour le DHT11 (Ts en secondes), nbSample x nbLi / 1000 pour le noeud Leq
+(Ts en ms par échantillon de l'ADC, un Leq par nbSample x nbLi échantillons).
+
+L'estimation peut être initialisée à partir de l'historique (voir
+historique.py) pour que le contrôleur soit juste dès le démarrage.
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+import math
+import numpy as np
+
+NS_PAR_SEC = 1_000_000_000
+
+
+class ControleurTs:
+  '''Contrôleur de la période d'échantillonnage d'un noeud.'''
+  def __init__(self, resolutions, ts_min, ts_max, ts_initial, echelle = 1.0,
+               tau = 1800.0, hysteresis = 0.25, delai = 300.0):
+    '''Arguments:
+    resolutions (dict) -- champ -> écart voulu entre deux échantillons
+    ts_min, ts_max (int) -- bornes de Ts (unités du noeud)
+    ts_initial (int) -- Ts courant du noeud
+    echelle (float) -- secondes entre deux échantillons par unité de Ts
+    tau (float) -- constante de temps (s) de l'estimation
+    hysteresis (float) -- écart relatif min. pour changer Ts
+    delai (float) -- temps min. (s) entre deux changements de Ts
+    '''
+    self.resolutions = resolutions
+    self.ts_min, self.ts_max = ts_min, ts_max
+    self.ts = ts_initial
+    self.echelle = echelle
+    self.tau = tau
+    self.hysteresis = hysteresis
+    self.delai_ns = int(delai * NS_PAR_SEC)
+    self._taux = {}                 # champ -> taux de variation (u^2/s)
+    self._precedents = {}           # champ -> (t_ns, v)
+    self._dernier_changement = None
+
+  def initialiser(self, historique, noeud, duree_sec = 6 * 3600):
+    '''Estimer le taux de variation à partir des dernières 'duree_sec'
+    secondes de l'historique.'''
+    for champ in self.resolutions:
+      temps, valeurs = historique.lire(noeud, champ)
+      if len(temps) < 2:
+        continue
+      debut = np.searchsorted(temps, temps[-1] - int(duree_sec * NS_PAR_SEC))
+      t = np.asarray(temps[debut:], dtype = np.int64)
+      v = np.asarray(valeurs[debut:], dtype = np.float64)
+      dt = np.diff(t) / NS_PAR_SEC
+      garder = dt > 0
+      if np.any(garder):
+        self._taux[champ] = float(np.sum(np.diff(v)[garder] ** 2) / np.sum(dt[garder]))
+        self._precedents[champ] = (int(t[-1]), float(v[-1]))
+
+  def taux(self, champ):
+    '''Taux de variation quadratique estimé du champ (ou None).'''
+    return self._taux.get(champ)
+
+  def ts_voulu(self):
+    '''Ts qui donne la résolution voulue pour tous les champs (borné).'''
+    periode = math.inf
+    for champ, resolution in self.resolutions.items():
+      taux = self._taux.get(champ)
+      if taux is not None and taux > 0.0:
+        periode = min(periode, resolution ** 2 / taux)
+    if math.isinf(periode):
+      return self.ts_max
+    return int(min(self.ts_max, max(self.ts_min, round(periode / self.echelle))))
+
+  def imposer(self, ts, t_ns):
+    '''Prendre ts, envoyé au noeud au temps t_ns (règle ou contrôleur), comme
+    Ts courant. Le contrôleur ne le change pas avant 'delai' secondes.'''
+    self.ts = ts
+    self._dernier_changement = t_ns
+
+  def echantillon(self, champ, t_ns, valeur):
+    '''Ajouter un échantillon d'un champ.
+
+    Retour (int): nouveau Ts à envoyer au noeud ou None
+    '''
+    if champ not in self.resolutions:
+      return None
+    precedent = self._precedents.get(champ)
+    self._precedents[champ] = (t_ns, valeur)
+    if precedent is None or t_ns <= precedent[0]:
+      return None
+    dt = (t_ns - precedent[0]) / NS_PAR_SEC
+    r = (valeur - precedent[1]) ** 2 / dt
+    # Moyenne exponentielle pondérée par la durée de l'intervalle
+    alpha = 1.0 - math.exp(-dt / self.tau)
+    self._taux[champ] = r if champ not in self._taux else self._taux[champ] + alpha * (r - self._taux[champ])
+
+    ts = self.ts_voulu()
+    if abs(ts - self.ts) <= self.hysteresis * self.ts:
+      return None
+    if self._dernier_changement is not None and t_ns - self._dernier_changement < self.delai_ns:
+      return None
+    self.ts = ts
+    self._dernier_changement = t_ns
+    return ts
+
+
+# ------------------------------------------------------
+# Démonstration: un signal calme puis agité
+# ------------------------------------------------------
+if __name__ == '__main__':
+  rng = np.random.default_rng(788)
+  controleur = ControleurTs({'Temperature' : 0.5}, 5, 600, 6)
+  t, v = 0, 22.0
+  for k in range(2000):
+    agite = 600 <= k < 900
+    dt = controleur.ts
+    t += dt * NS_PAR_SEC
+    v += rng.normal(0.0, (0.3 if agite else 0.01) * math.sqrt(dt))
+    ts = controleur.echantillon('Temperature', t, v)
+    if ts is not None:
+      print(F"t = {t / NS_PAR_SEC / 3600:6.2f} h  {'agité' if agite else 'calme'}: Ts -> {ts} s")
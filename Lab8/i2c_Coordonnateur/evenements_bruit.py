@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+evenements_bruit.py
+Détecter en continu les événements bruyants (dépassements de seuil) dans les
+niveaux Li/Leq reçus par le coordonnateur.
+
+Un événement commence quand un niveau atteint 'seuil' et se termine au
+premier niveau sous 'seuil - hysteresis' (l'hystérésis évite de couper un
+événement en plusieurs quand le niveau oscille autour du seuil). Il n'est
+gardé que s'il dure au moins 'duree_min' secondes. Un trou de plus de
+'ecart_max' secondes entre deux niveaux (noeud arrêté) termine aussi
+l'événement en cours.
+
+Chaque niveau L reçu couvre une durée d (p. ex. tp du noeud Leq). Pendant
+l'événement on n'accumule que l'énergie, la durée et le maximum, soit O(1)
+par niveau:
+
+  E = somme de d x 10^((L - L_REF) / 10)
+  SEL  = L_REF + 10 log10(E)                (niveau d'exposition, ref. 1 s)
+  Leq  = SEL - 10 log10(durée)
+  Lmax = plus grand niveau reçu
+
+Les événements terminés sont des enregistrements compacts (dict) envoyés à
+l'historique (evenements.tsv, voir texte()) et à ThingSpeak (voir
+pipeline.py): un envoi par événement au lieu d'un par échantillon.
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+import math
+
+L_REF = 100.0                # Niveau de référence des énergies (dB)
+NS_PAR_SEC = 1_000_000_000
+
+
+class DetecteurEvenements:
+  '''Événements de dépassement de seuil, par noeud.'''
+  def __init__(self, seuil, hysteresis = 3.0, duree_min = 0.0, ecart_max = None):
+    '''Arguments:
+    seuil (float) -- niveau (dB) de début d'un événement
+    hysteresis (float) -- l'événement finit sous seuil - hysteresis (dB)
+    duree_min (float) -- durée min. (s) d'un événement gardé
+    ecart_max (float) -- trou max. (s) entre deux niveaux d'un événement
+                         (None: 3 fois la durée d'un niveau)
+    '''
+    self.seuil = seuil
+    self.seuil_fin = seuil - hysteresis
+    self.duree_min = duree_min
+    self.ecart_max = ecart_max
+    self._en_cours = {}       # noeud -> état de l'événement en cours
+    self._derniers = {}       # noeud -> temps (ns) du dernier niveau reçu
+
+  def en_cours(self, noeud):
+    '''Vrai si un événement du noeud est en cours.'''
+    return noeud in self._en_cours
+
+  def ajouter(self, noeud, t_ns, niveau, duree):
+    '''Ajouter un niveau reçu d'un noeud.
+
+    Arguments:
+    noeud (int ou str) -- adresse I2C ou nom de la source
+    t_ns (int) -- fin de l'intervalle couvert par le niveau (ns)
+    niveau (float) -- Li ou Leq (dB)
+    duree (float) -- durée (s) couverte par le niveau
+
+    Retour (dict): événement terminé par ce niveau ou None
+    '''
+    termine = None
+    dernier = self._derniers.get(noeud)
+    self._derniers[noeud] = t_ns
+    etat = self._en_cours.get(noeud)
+    ecart_max = 3.0 * duree if self.ecart_max is None else self.ecart_max
+    if etat is not None and dernier is not None and t_ns - dernier > ecart_max * NS_PAR_SEC:
+      termine = self.terminer(noeud)
+      etat = None
+
+    if etat is None:
+      if niveau >= self.seuil:
+        self._en_cours[noeud] = {'debut_ns' : t_ns - int(duree * NS_PAR_SEC), 'fin_ns' : t_ns,
+                                 'energie' : duree * 10.0 ** ((niveau - L_REF) / 10.0),
+                                 'duree' : duree, 'lmax' : niveau, 'lmax_ns' : t_ns}
+      return termine
+    if niveau < self.seuil_fin:
+      return self.terminer(noeud)
+    etat['fin_ns'] = t_ns
+    etat['energie'] += duree * 10.0 ** ((niveau - L_REF) / 10.0)
+    etat['duree'] += duree
+    if niveau > etat['lmax']:
+      etat['lmax'], etat['lmax_ns'] = niveau, t_ns
+    return termine
+
+  def terminer(self, noeud):
+    '''Terminer l'événement en cours du noeud (p. ex. à l'arrêt).
+
+    Retour (dict): l'événement (noeud, debut_ns, fin_ns, duree, lmax,
+                   lmax_ns, sel, leq) ou None s'il n'y en a pas ou s'il est
+                   trop court
+    '''
+    etat = self._en_cours.pop(noeud, None)
+    if etat is None or etat['duree'] < self.duree_min:
+      return None
+    sel = L_REF + 10.0 * math.log10(etat['energie'])
+    return {'noeud' : noeud, 'debut_ns' : etat['debut_ns'], 'fin_ns' : etat['fin_ns'],
+            'duree' : etat['duree'], 'lmax' : etat['lmax'], 'lmax_ns' : etat['lmax_ns'],
+            'sel' : sel, 'leq' : sel - 10.0 * math.log10(etat['duree'])}
+
+
+def texte(evenement):
+  '''Texte compact d'un événement (colonne texte de evenements.tsv).'''
+  return (F"Bruit: {evenement['duree']:.0f} s, Lmax {evenement['lmax']:.1f} dB, "
+          F"SEL {evenement['sel']:.1f} dB, Leq {evenement['leq']:.1f} dB")
+
+
+# ------------------------------------------------------
+# Démonstration: événements du journal measurementELECTRET.txt
+# ------------------------------------------------------
+if __name__ == '__main__':
+  import os
+  import tempfile
+  from datetime import datetime
+  from historique import Historique
+  from ingestion_journaux import ingerer
+  chemin = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'measurementELECTRET.txt')
+  historique = Historique(tempfile.mkdtemp())
+  ingerer(historique, chemin, noeud = 'electret')
+  temps, niveaux = historique.lire('electret', 'Leq')
+
+  def heure(t_ns):
+    return datetime.fromtimestamp(t_ns / NS_PAR_SEC).strftime('%H:%M')
+
+  for t, _, annotation in historique.evenements():
+    print(F"{heure(t)}  annotation: {annotation}")
+  detecteur = DetecteurEvenements(seuil = 60.0, hysteresis = 3.0, duree_min = 300.0)
+  for t, v in zip(temps.tolist(), niveaux.tolist()):
+    evenement = detecteur.ajouter('electret', t, v, 4.96 * 60)
+    if evenement is not None:
+      print(F"{heure(evenement['debut_ns'])}-{heure(evenement['fin_ns'])}  {texte(evenement)}")
+  evenement = detecteur.terminer('electret')
+  if evenement is not None:
+    print(F"{heure(evenement['debut_ns'])}-{heure(evenement['fin_ns'])}  {texte(evenement)} (en cours)")
+  print(F"{len(niveaux)} niveaux")
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+gpio_evenements.py
+Attendre les lignes "données prêtes" des noeuds.
+
+Chaque noeud envoie une impulsion sur sa broche PIN_PRET dès qu'il publie un
+nouvel échantillon (voir i2c_DHT11.ino et i2c_Leq.ino). La broche est reliée
+à un GPIO du Pi. Le coordonnateur bloque sur ces fronts au lieu de dormir
+SAMPLING_TIME secondes, puis ne lit que les noeuds qui ont signalé.
+
+Deux implémentations ont la même interface:
+  EvenementsRPi      -- fronts montants détectés par RPi.GPIO (sur le Pi)
+  EvenementsSimules  -- noeuds simulés (périodes) ou fronts injectés par
+                        signaler(); sert aux essais sans matériel
+
+  attendre(delai)  -> ensemble des adresses des noeuds qui ont signalé
+                      (vide si rien n'est arrivé avant le délai)
+  signaler(adr)    -> ajouter un front (appelé par le détecteur)
+  fermer()         -> libérer les GPIO / arrêter la simulation
+
+creer(genre, ...) choisit l'implémentation ('rpi' ou 'simule').
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+import threading
+import time
+
+
+class _Evenements:
+  '''Fronts reçus (adresses des noeuds) en attente d'être traités.'''
+  def __init__(self):
+    self._prets = set()
+    self._condition = threading.Condition()
+
+  def signaler(self, adr):
+    '''Indiquer que le noeud adr a publié un nouvel échantillon.'''
+    with self._condition:
+      self._prets.add(adr)
+      self._condition.notify()
+
+  def attendre(self, delai = None):
+    '''Bloquer jusqu'au premier front ou pendant 'delai' secondes.
+
+    Arguments:
+    delai (float) -- attente maximale (sec), None pour attendre sans fin
+
+    Retour (set): adresses des noeuds qui ont signalé depuis le dernier appel
+    '''
+    with self._condition:
+      self._condition.wait_for(lambda: self._prets, delai)
+      prets, self._prets = self._prets, set()
+    return prets
+
+  def fermer(self):
+    pass
+
+
+class EvenementsRPi(_Evenements):
+  '''Fronts montants des lignes "données prêtes" sur les GPIO du Pi.'''
+  def __init__(self, broches):
+    '''Arguments:
+    broches (dict) -- adresse I2C du noeud -> numéro BCM du GPIO
+
+    Exceptions possibles: ImportError (RPi.GPIO absent)
+    '''
+    super().__init__()
+    import RPi.GPIO as GPIO     # seulement sur le Pi
+    self._gpio = GPIO
+    GPIO.setmode(GPIO.BCM)
+    for adr, broche in broches.items():
+      GPIO.setup(broche, GPIO.IN, pull_up_down = GPIO.PUD_DOWN)
+      # Le rappel est exécuté dans le fil de RPi.GPIO
+      GPIO.add_event_detect(broche, GPIO.RISING,
+                            callback = lambda _, adr = adr: self.signaler(adr))
+    self._broches = tuple(broches.values())
+
+  def fermer(self):
+    for broche in self._broches:
+      self._gpio.remove_event_detect(broche)
+    self._gpio.cleanup(self._broches)
+
+
+class EvenementsSimules(_Evenements):
+  '''Noeuds simulés qui signalent un échantillon à période fixe.'''
+  def __init__(self, periodes = None):
+    '''Arguments:
+    periodes (dict) -- adresse du noeud -> période (sec) de ses fronts;
+                       sans périodes, les fronts viennent de signaler()
+    '''
+    super().__init__()
+    self._arret = threading.Event()
+    self._fils = []
+    for adr, periode in (periodes or {}).items():
+      fil = threading.Thread(target = self._noeud, args = (adr, periode), daemon = True)
+      fil.start()
+      self._fils.append(fil)
+
+  def _noeud(self, adr, periode):
+    prochain = time.monotonic() + periode
+    while not self._arret.wait(max(0.0, prochain - time.monotonic())):
+      self.signaler(adr)
+      prochain += periode
+
+  def fermer(self):
+    self._arret.set()
+    for fil in self._fils:
+      fil.join()
+
+
+def creer(genre, broches = None, periodes = None):
+  '''Créer la source des fronts.
+
+  Arguments:
+  genre (str) -- 'rpi' (GPIO du Pi) ou 'simule'
+  broches (dict) -- adresse -> GPIO BCM ('rpi')
+  periodes (dict) -- adresse -> période (sec) des noeuds simulés ('simule')
+
+  Exceptions possibles: ValueError (genre inconnu), ImportError
+  '''
+  if genre == 'rpi':
+    return EvenementsRPi(broches)
+  if genre == 'simule':
+    return EvenementsSimules(periodes)
+  raise ValueError(F"<gpio_evenements> Source des fronts inconnue: {genre}.")
+
+
+# ------------------------------------------------------
+# Démonstration avec deux noeuds simulés
+# ------------------------------------------------------
+if __name__ == '__main__':
+  evenements = creer('simule', periodes = {0x44 : 0.6, 0x45 : 1.0})
+  debut = time.monotonic()
+  try:
+    for _ in range(8):
+      prets = evenements.attendre(2.0)
+      print(F"{time.monotonic() - debut:5.2f} s: {[hex(adr) for adr in sorted(prets)]}")
+  finally:
+    evenements.fermer()
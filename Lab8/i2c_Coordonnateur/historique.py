@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+historique.py
+Entrepôt en colonnes de l'historique des capteurs, indexé par le temps.
+
+Chaque série (noeud, champ) est un répertoire contenant deux fichiers binaires
+ajoutés en fin de fichier seulement:
+
+  temps.i64    horodatages en ns (int64, croissants)
+  valeurs.f32  valeurs (float32)
+
+Les deux fichiers peuvent être ouverts par np.memmap sans rien charger en
+mémoire. Les événements (annotations, commandes) sont gardés dans
+evenements.tsv (temps ns, noeud, texte) à la racine de l'entrepôt.
+
+Blocs compressés
+-=-=-=-=-=-=-=-=
+Dès que temps.i64 contient 'taille_bloc' échantillons, ils sont compressés
+(voir compression.py: temps arrondis à 'pas_ns' (1 ms par défaut) en
+différences de différences, valeurs en XOR) et ajoutés à
+
+  blocs.bin    blocs compressés, les uns après les autres
+  blocs.idx    en-tête de chaque bloc (DTYPE_BLOC: premier et dernier
+               temps, min, max, position et taille dans blocs.bin)
+
+temps.i64 et valeurs.f32 ne gardent alors que les échantillons les plus
+récents. lire() et requete() ne décompressent que les blocs qui touchent
+l'intervalle de temps demandé; chercher() saute aussi les blocs dont les
+valeurs sont hors de l'intervalle de valeurs demandé.
+
+Agrégats multi-résolutions
+-=-=-=-=-=-=-=-=-=-=-=-=-=-
+À chaque ajout, les agrégats (min, max, somme, nb, dernière valeur) de
+chaque série sont mis à jour pour les résolutions RESOLUTIONS_AGREGATS
+(1 min, 1 h, 1 jour). Pour la résolution R (en secondes):
+
+  agregats_R.i64    début de chaque intervalle (ns, croissants)
+  agregats_R.stats  statistiques de l'intervalle (DTYPE_STATS)
+
+Seul le dernier intervalle (encore ouvert) est réécrit; les autres sont
+ajoutés à la fin. requete() cherche l'intervalle de temps demandé par
+recherche binaire (np.searchsorted sur un np.memmap) dans le plus grossier
+des niveaux compatibles avec la résolution demandée et regroupe ensuite les
+intervalles trouvés (reduceat) à cette résolution. Une requête sur un mois
+de données à 6 s ne lit donc que quelques milliers d'agrégats.
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+import os
+import numpy as np
+from compression import DTYPE_BLOC, compresser, decompresser
+
+FICHIER_TEMPS = 'temps.i64'
+FICHIER_VALEURS = 'valeurs.f32'
+FICHIER_BLOCS = 'blocs.bin'
+FICHIER_INDEX_BLOCS = 'blocs.idx'
+FICHIER_EVENEMENTS = 'evenements.tsv'
+NS_PAR_SEC = 1_000_000_000
+TAILLE_BLOC = 1024      # Nb. d'échantillons par bloc compressé
+PAS_TEMPS_NS = 1_000_000    # Résolution des temps compressés (1 ms)
+
+# Résolutions des agrégats maintenus à l'ajout (secondes)
+RESOLUTIONS_AGREGATS = (60, 3600, 86400)
+DTYPE_STATS = np.dtype([('min', '<f4'), ('max', '<f4'), ('somme', '<f8'),
+                        ('nb', '<i8'), ('dernier', '<f4')])
+
+
+def _regrouper(groupes, minimum, maximum, somme, nb, dernier):
+  '''Regrouper des lignes consécutives de même groupe (tableau croissant).
+
+  Retour (tuple): (indices de début des groupes, statistiques DTYPE_STATS)
+  '''
+  idx = np.flatnonzero(np.r_[True, groupes[1:] != groupes[:-1]])
+  stats = np.empty(len(idx), dtype = DTYPE_STATS)
+  stats['min'] = np.fmin.reduceat(minimum, idx)
+  stats['max'] = np.fmax.reduceat(maximum, idx)
+  stats['somme'] = np.add.reduceat(somme, idx)
+  stats['nb'] = np.add.reduceat(nb, idx)
+  stats['dernier'] = dernier[np.r_[idx[1:], len(groupes)] - 1]
+  return idx, stats
+
+
+class Historique:
+  '''Séries temporelles (noeud, champ) en colonnes binaires.'''
+  def __init__(self, racine, taille_bloc = TAILLE_BLOC, pas_ns = PAS_TEMPS_NS):
+    '''Arguments:
+    racine (str) -- répertoire de l'entrepôt
+    taille_bloc (int) -- échantillons par bloc compressé (None: pas de
+                         compression des nouveaux échantillons)
+    pas_ns (int) -- résolution des temps des blocs compressés (1: ns)
+    '''
+    self.racine = racine
+    self.taille_bloc = taille_bloc
+    self.pas_ns = pas_ns
+    os.makedirs(racine, exist_ok = True)
+    self._derniers = {}         # nom de la série -> dernier horodatage écrit
+
+  @staticmethod
+  def _nom(noeud, champ):
+    noeud = hex(noeud) if isinstance(noeud, int) else str(noeud)
+    return F"{noeud}_{champ}"
+
+  def _repertoire(self, noeud, champ):
+    return os.path.join(self.racine, self._nom(noeud, champ))
+
+  def _dernier_temps(self, noeud, champ):
+    cle = self._nom(noeud, champ)
+    if cle not in self._derniers:
+      temps = self._queue(noeud, champ)[0]
+      if len(temps):
+        self._derniers[cle] = int(temps[-1])
+      else:
+        index = self._index(noeud, champ)
+        # Temps arrondi au pas du bloc: le temps écrit peut être plus petit
+        self._derniers[cle] = (int(index['fin'][-1] - index['pas_ns'][-1] // 2)
+                               if len(index) else None)
+    return self._derniers[cle]
+
+  def ajouter_lot(self, noeud, champ, temps_ns, valeurs):
+    '''Ajouter des échantillons à la fin d'une série.
+
+    Arguments:
+    noeud (int ou str) -- adresse I2C ou nom de la source
+    champ (str) -- 'Temperature', 'Humidity', 'Leq', ...
+    temps_ns (array) -- horodatages en ns, croissants
+    valeurs (array) -- valeurs correspondantes
+
+    Retour: n/a
+    Exceptions possibles: ValueError (horodatages non croissants)
+    '''
+    temps_ns = np.asarray(temps_ns, dtype = np.int64)
+    valeurs = np.asarray(valeurs, dtype = np.float32)
+    if temps_ns.shape != valeurs.shape:
+      raise ValueError("<ajouter_lot> Temps et valeurs de tailles différentes.")
+    if len(temps_ns) == 0:
+      return
+    dernier = self._dernier_temps(noeud, champ)
+    if np.any(np.diff(temps_ns) < 0) or (dernier is not None and temps_ns[0] < dernier):
+      raise ValueError(F"<ajouter_lot> Horodatages non croissants pour {self._nom(noeud, champ)}.")
+    repertoire = self._repertoire(noeud, champ)
+    os.makedirs(repertoire, exist_ok = True)
+    with open(os.path.join(repertoire, FICHIER_TEMPS), 'ab') as f:
+      temps_ns.tofile(f)
+    with open(os.path.join(repertoire, FICHIER_VALEURS), 'ab') as f:
+      valeurs.tofile(f)
+    self._derniers[self._nom(noeud, champ)] = int(temps_ns[-1])
+    self._mettre_a_jour_agregats(repertoire, temps_ns, valeurs)
+    if self.taille_bloc:
+      self._compresser_queue(repertoire)
+
+  def _compresser_queue(self, repertoire):
+    '''Compresser les blocs pleins de temps.i64 et valeurs.f32.'''
+    chemin_temps = os.path.join(repertoire, FICHIER_TEMPS)
+    chemin_valeurs = os.path.join(repertoire, FICHIER_VALEURS)
+    taille = self.taille_bloc
+    if os.path.getsize(chemin_temps) // 8 < taille:
+      return
+    temps = np.fromfile(chemin_temps, dtype = np.int64)
+    valeurs = np.fromfile(chemin_valeurs, dtype = np.float32)
+    fin = len(temps) // taille * taille
+    entetes = np.empty(fin // taille, dtype = DTYPE_BLOC)
+    # Ordre des écritures: blocs, index puis queue. Un arrêt entre les deux
+    # dernières duplique des échantillons au lieu de les perdre.
+    with open(os.path.join(repertoire, FICHIER_BLOCS), 'ab') as f:
+      position = f.tell()
+      for k, i in enumerate(range(0, fin, taille)):
+        entete, octets = compresser(temps[i : i + taille], valeurs[i : i + taille], self.pas_ns)
+        entete['position'], entete['taille'] = position, len(octets)
+        f.write(octets)
+        position += len(octets)
+        entetes[k] = entete
+    with open(os.path.join(repertoire, FICHIER_INDEX_BLOCS), 'ab') as f:
+      entetes.tofile(f)
+    for chemin, reste in ((chemin_temps, temps[fin:]), (chemin_valeurs, valeurs[fin:])):
+      reste.tofile(chemin + '.tmp')
+      os.replace(chemin + '.tmp', chemin)
+
+  @staticmethod
+  def _mettre_a_jour_agregats(repertoire, temps_ns, valeurs):
+    '''Ajouter un lot (trié) aux agrégats de chaque résolution.'''
+    valeurs64 = valeurs.astype(np.float64)
+    for resolution in RESOLUTIONS_AGREGATS:
+      pas = resolution * NS_PAR_SEC
+      debuts = temps_ns - temps_ns % pas
+      idx, stats = _regrouper(debuts, valeurs, valeurs, valeurs64,
+                              np.ones(len(valeurs), dtype = np.int64), valeurs)
+      debuts = debuts[idx]
+      chemin_debuts = os.path.join(repertoire, F'agregats_{resolution}.i64')
+      chemin_stats = os.path.join(repertoire, F'agregats_{resolution}.stats')
+      if os.path.exists(chemin_debuts) and os.path.getsize(chemin_debuts):
+        with open(chemin_debuts, 'rb') as f:
+          f.seek(-8, os.SEEK_END)
+          dernier_debut = int(np.frombuffer(f.read(8), dtype = np.int64)[0])
+        if dernier_debut == debuts[0]:
+          # Fusionner le premier intervalle du lot avec l'intervalle ouvert
+          with open(chemin_stats, 'r+b') as f:
+            f.seek(-DTYPE_STATS.itemsize, os.SEEK_END)
+            ouvert = np.frombuffer(f.read(DTYPE_STATS.itemsize), dtype = DTYPE_STATS)[0]
+            stats['min'][0] = np.fmin(ouvert['min'], stats['min'][0])
+            stats['max'][0] = np.fmax(ouvert['max'], stats['max'][0])
+            stats['somme'][0] += ouvert['somme']
+            stats['nb'][0] += ouvert['nb']
+            f.seek(-DTYPE_STATS.itemsize, os.SEEK_END)
+            stats[:1].tofile(f)
+          debuts, stats = debuts[1:], stats[1:]
+      with open(chemin_debuts, 'ab') as f:
+        debuts.tofile(f)
+      with open(chemin_stats, 'ab') as f:
+        stats.tofile(f)
+
+  def ajouter(self, noeud, champ, temps_ns, valeur):
+    '''Ajouter un seul échantillon (voir ajouter_lot).'''
+    self.ajouter_lot(noeud, champ, [temps_ns], [valeur])
+
+  def ajouter_evenement(self, temps_ns, noeud, texte):
+    '''Ajouter un événement (annotation, commande reçue, ...).'''
+    with open(os.path.join(self.racine, FICHIER_EVENEMENTS), 'a', encoding = 'utf-8') as f:
+      f.write(F"{int(temps_ns)}\t{noeud}\t{texte}\n")
+
+  def _queue(self, noeud, champ):
+    '''Échantillons non compressés d'une série (np.memmap).'''
+    repertoire = self._repertoire(noeud, champ)
+    chemins = (os.path.join(repertoire, FICHIER_TEMPS), os.path.join(repertoire, FICHIER_VALEURS))
+    if not os.path.exists(chemins[0]) or os.path.getsize(chemins[0]) == 0:
+      return np.empty(0, dtype = np.int64), np.empty(0, dtype = np.float32)
+    return (np.memmap(chemins[0], dtype = np.int64, mode = 'r'),
+            np.memmap(chemins[1], dtype = np.float32, mode = 'r'))
+
+  def _index(self, noeud, champ):
+    '''En-têtes des blocs compressés d'une série (np.memmap).'''
+    chemin = os.path.join(self._repertoire(noeud, champ), FICHIER_INDEX_BLOCS)
+    if not os.path.exists(chemin) or os.path.getsize(chemin) == 0:
+      return np.empty(0, dtype = DTYPE_BLOC)
+    return np.memmap(chemin, dtype = DTYPE_BLOC, mode = 'r')
+
+  def lire(self, noeud, champ, debut_ns = None, fin_ns = None, vmin = None, vmax = None):
+    '''Retourner (temps, valeurs) d'une série (tableaux vides si la série
+    n'existe pas). Sans blocs compressés, ce sont des np.memmap.
+
+    Les blocs entièrement hors de [debut_ns, fin_ns] ou dont les valeurs sont
+    hors de [vmin, vmax] ne sont pas lus: le résultat contient au moins les
+    échantillons demandés, mais peut en contenir d'autres.
+    '''
+    index = self._index(noeud, champ)
+    choix = np.ones(len(index), dtype = bool)
+    # Les temps des blocs sont arrondis au pas: élargir d'un demi-pas
+    demi_pas = index['pas_ns'] // 2
+    if debut_ns is not None:
+      choix &= index['fin'] + demi_pas >= debut_ns
+    if fin_ns is not None:
+      choix &= index['debut'] - demi_pas <= fin_ns
+    if vmin is not None:
+      choix &= index['max'] >= vmin
+    if vmax is not None:
+      choix &= index['min'] <= vmax
+    temps, valeurs = self._queue(noeud, champ)
+    if not np.any(choix):
+      return temps, valeurs
+    parties_t, parties_v = [], []
+    with open(os.path.join(self._repertoire(noeud, champ), FICHIER_BLOCS), 'rb') as f:
+      for entete in index[choix]:
+        f.seek(int(entete['position']))
+        t, v = decompresser(entete, f.read(int(entete['taille'])))
+        parties_t.append(t)
+        parties_v.append(v)
+    return (np.concatenate(parties_t + [np.asarray(temps)]),
+            np.concatenate(parties_v + [np.asarray(valeurs)]))
+
+  def chercher(self, noeud, champ, vmin, vmax, debut_ns = None, fin_ns = None):
+    '''Échantillons d'une série dont la valeur est dans [vmin, vmax] (et le
+    temps dans [debut_ns, fin_ns[). Seuls les blocs dont l'intervalle des
+    valeurs touche [vmin, vmax] sont décompressés.
+
+    Retour (tuple): (temps, valeurs)
+    '''
+    temps, valeurs = self.lire(noeud, champ, debut_ns, fin_ns, vmin, vmax)
+    garder = (valeurs >= vmin) & (valeurs <= vmax)
+    if debut_ns is not None:
+      garder &= temps >= debut_ns
+    if fin_ns is not None:
+      garder &= temps < fin_ns
+    return np.asarray(temps)[garder], np.asarray(valeurs)[garder]
+
+  def _agregats(self, noeud, champ, resolution):
+    '''Retourner (débuts, stats) d'un niveau d'agrégats en np.memmap.'''
+    repertoire = self._repertoire(noeud, champ)
+    chemin_debuts = os.path.join(repertoire, F'agregats_{resolution}.i64')
+    if not os.path.exists(chemin_debuts) or os.path.getsize(chemin_debuts) == 0:
+      return np.empty(0, dtype = np.int64), np.empty(0, dtype = DTYPE_STATS)
+    return (np.memmap(chemin_debuts, dtype = np.int64, mode = 'r'),
+            np.memmap(os.path.join(repertoire, F'agregats_{resolution}.stats'),
+                      dtype = DTYPE_STATS, mode = 'r'))
+
+  def requete(self, noeud, champ, debut_ns, fin_ns, resolution_sec = None):
+    '''Statistiques d'une série sur [debut_ns, fin_ns) à la résolution demandée.
+
+    Arguments:
+    noeud, champ -- série à interroger
+    debut_ns, fin_ns (int) -- intervalle de temps en ns
+    resolution_sec (int) -- durée d'un intervalle du résultat en secondes
+                            (None: échantillons bruts, sans regroupement)
+
+    Retour (dict): tableaux 'debut' (ns), 'min', 'max', 'moyenne', 'dernier'
+                   et 'nb', une valeur par intervalle non vide. Avec des
+                   agrégats, les bornes sont arrondies à leur résolution.
+    '''
+    niveaux = [r for r in RESOLUTIONS_AGREGATS
+               if resolution_sec and resolution_sec % r == 0]
+    if niveaux:
+      # Le plus grossier des niveaux dont la résolution divise la demande
+      debuts, stats = self._agregats(noeud, champ, niveaux[-1])
+      pas = niveaux[-1] * NS_PAR_SEC
+      i = np.searchsorted(debuts, debut_ns - debut_ns % pas, side = 'left')
+      j = np.searchsorted(debuts, fin_ns, side = 'left')
+      temps, stats = np.asarray(debuts[i:j]), np.asarray(stats[i:j])
+      minimum, maximum, somme = stats['min'], stats['max'], stats['somme']
+      nb, dernier = stats['nb'], stats['dernier']
+    else:
+      temps, valeurs = self.lire(noeud, champ, debut_ns, fin_ns)
+      i = np.searchsorted(temps, debut_ns, side = 'left')
+      j = np.searchsorted(temps, fin_ns, side = 'left')
+      temps, valeurs = np.asarray(temps[i:j]), np.asarray(valeurs[i:j])
+      minimum = maximum = dernier = valeurs
+      somme, nb = valeurs.astype(np.float64), np.ones(len(valeurs), dtype = np.int64)
+
+    if resolution_sec and len(temps):
+      pas = resolution_sec * NS_PAR_SEC
+      groupes = temps - temps % pas
+      idx, stats = _regrouper(groupes, minimum, maximum, somme, nb, dernier)
+      temps = groupes[idx]
+      minimum, maximum, somme = stats['min'], stats['max'], stats['somme']
+      nb, dernier = stats['nb'], stats['dernier']
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+      moyenne = somme / nb
+    return {'debut': temps, 'min': minimum, 'max': maximum,
+            'moyenne': moyenne, 'dernier': dernier, 'nb': nb}
+
+  def evenements(self):
+    '''Retourner la liste des événements (temps ns, noeud, texte).'''
+    chemin = os.path.join(self.racine, FICHIER_EVENEMENTS)
+    if not os.path.exists(chemin):
+      return []
+    with open(chemin, encoding = 'utf-8') as f:
+      return [(int(t), n, texte) for t, n, texte in
+              (ligne.rstrip('\n').split('\t', 2) for ligne in f)]
+
+  def series(self):
+    '''Retourner la liste des noms de séries de l'entrepôt.'''
+    return sorted(d for d in os.listdir(self.racine)
+                  if os.path.isdir(os.path.join(self.racine, d)))
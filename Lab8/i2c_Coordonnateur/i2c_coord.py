@@ -18,9 +18,9 @@ Dans cet exemple, les noeuds (Arduino) effectuent:
     - la lecture du niveau d'exposition sonore (Leq)
     - l'incrémentation du numéro de l'échantillon.
 selon la période d'échantillonnage NEW_TS programmé par le coordonnateur (Pi).
-À toutes les SAMPLING_TIME, le coordonnateur lit ces deux valeurs des noeuds
-et les affiche à la sortie standard (terminal Python). On a NEW_TS != SAMPLE_TIME
-pour montrer l'asynchronisme entre les noeuds et le coordonnateur.
+Chaque noeud signale un nouvel échantillon par une impulsion sur sa ligne
+"données prêtes" (GPIO). Le coordonnateur attend ces impulsions et lit
+seulement les noeuds qui ont signalé (voir gpio_evenements.py).
 
 Auteurs : Philippe Boivin, Sandrine Bouchard, Alexandre Lins-d'Auteuil,
 Benedikt Franz Witteler
@@ -35,11 +35,16 @@ Juillet 2020
 # -------------------------------------------------------------------
 # Les modules utiles
 # -------------------------------------------------------------------
-import smbus            # pour la communication I2C
 import time             # pour sleep()
 import struct           # pour la conversion octet -> float
-from datetime import datetime    # pour l'horodatage des échantillons
 import constants as cst # constants du programme
+import pipeline                           # anneau partagé et consommateurs
+from historique import Historique         # historique des échantillons
+from regles import MoteurRegles           # commandes décidées par des règles
+from controle_ts import ControleurTs      # Ts selon la variabilité
+from bande_morte import PolitiqueBandeMorte  # lectures sur changement
+from synchro_horloge import HorlogeNoeud  # temps des noeuds -> ns
+import gpio_evenements                    # lignes "données prêtes"
 #import keyboard as kb
 
 # -------------------------------------------------------------------
@@ -133,6 +138,24 @@ def send_Ts(bus = None, adr = -1, ts = -1):
   else:
     raise CoordException(F"<send_Ts> Bus non initié ou adresse I2C invalide.")
 
+def send_Ts_large(bus = None, adr = -1, ts = -1):
+  '''Envoyer la commande pour le changement de période d'échantillonnage
+  avec une valeur sur 2 octets (0 à 65535).
+
+  Arguments:
+  bus -- objet SMBUS déjà initialisé
+  adr (int) -- adresse du noeud destinataire
+  ts (int) -- nouvelle période d'échantillonnage
+
+  Retour: n/a
+  Exceptions possibles: CoordException, IOError
+  '''
+  if bus != None and (adr >= cst.I2C_MIN_ADR and adr <= cst.I2C_MAX_ADR) and 0 <= ts <= 0xFFFF:
+    # Le noeud reçoit 3 octets: commande, LSB et MSB (little Endian)
+    bus.write_i2c_block_data(adr, cst.I2C_CMD_SET_TS, [ts & 0xFF, ts >> 8])
+  else:
+    raise CoordException(F"<send_Ts_large> Bus non initié, adresse I2C ou Ts invalide.")
+
 def send_reset(bus = None, adr = -1):
   '''Envoyer la commande reset sur le bus i2c au noeud à l'adresse adr.
 
@@ -163,6 +186,78 @@ def send_pause(bus = None, adr = -1, p=-1):
   else:
     raise CoordException(F"<send_pause> Bus non initié ou adresse I2C invalide.")
 
+def send_flux(bus = None, adr = -1, actif = True):
+  '''Démarrer ou arrêter le flux des échantillons bruts de l'ADC du noeud Leq
+  sur son port série (voir capture_adc.py).
+
+  Pendant le flux, le noeud accepte un Ts de 1 ms (send_Ts_large(), après
+  send_flux()) pour la pondération A/C et les bandes d'octave (voir
+  ponderation_acoustique.py). À la fin du flux, un Ts sous 5 ms revient à
+  5 ms.
+
+  Arguments:
+  bus -- objet SMBUS déjà initialisé
+  adr (int) -- adresse du noeud destinataire
+  actif (bool) -- True pour démarrer le flux, False pour l'arrêter
+
+  Retour: n/a
+  Exceptions possibles: CoordException, IOError
+  '''
+  if bus != None and (adr >= cst.I2C_MIN_ADR and adr <= cst.I2C_MAX_ADR):
+    bus.write_i2c_block_data(adr, cst.I2C_CMD_SET_FLUX, [1 if actif else 0])
+  else:
+    raise CoordException(F"<send_flux> Bus non initié ou adresse I2C invalide.")
+
+# Numéro de la dernière commande de groupe envoyée (voir send_groupe)
+_numero_groupe = 0
+
+def _lire_ack(bus, adr):
+  '''Numéro de la dernière commande de groupe exécutée par le noeud adr
+  (None si le noeud ne répond pas).'''
+  try:
+    bus.write_byte(adr, cst.I2C_NODE_ACK[adr])
+    return bus.read_byte(adr)
+  except IOError:
+    return None
+
+def send_groupe(bus = None, cmd = -1, args = (), groupe = 'tous'):
+  '''Envoyer une commande à tous les noeuds d'un groupe en une seule
+  transaction (appel général) puis relire leurs accusés de réception.
+
+  Les noeuds du groupe reçoivent la commande au même moment: une commande
+  go démarre leur échantillonnage de façon synchrone.
+
+  La commande porte le numéro suivant d'un compteur (1 à 255) qui saute
+  l'accusé actuel de chaque noeud du groupe: un noeud qui ne reçoit pas la
+  commande ne peut pas sembler l'avoir reçue (p. ex. accusé laissé par une
+  exécution précédente du coordonnateur).
+
+  Arguments:
+  bus -- objet SMBUS déjà initialisé
+  cmd (int) -- commande (I2C_CMD_SET_*)
+  args (tuple) -- octets de l'argument de la commande (ts, durée de la
+                  pause, LSB et MSB d'un Ts sur 2 octets) ou ()
+  groupe (str) -- nom du groupe dans I2C_GROUPES
+
+  Retour (list): adresses des noeuds du groupe qui n'ont pas accusé réception
+  Exceptions possibles: CoordException, IOError
+  '''
+  global _numero_groupe
+  if bus != None and groupe in cst.I2C_GROUPES and len(args) <= 2:
+    masque = cst.I2C_GROUPES[groupe]
+    membres = [adr for adr in cst.I2C_ADDRESS if cst.I2C_NODE_GROUPES[adr] & masque]
+    acks = {_lire_ack(bus, adr) for adr in membres}
+    numero = _numero_groupe % 255 + 1
+    while numero in acks:
+      numero = numero % 255 + 1
+    _numero_groupe = numero
+    bus.write_i2c_block_data(cst.I2C_GENERAL_CALL, cst.I2C_CMD_GROUP,
+                             [masque, numero, cmd, *args])
+    time.sleep(cst.I2C_ACK_DELAY)
+    return [adr for adr in membres if _lire_ack(bus, adr) != numero]
+  else:
+    raise CoordException(F"<send_groupe> Bus non initié, groupe ou commande invalide.")
+
 def read_Temp(bus = None, adr = -1):
   '''Lire la température du noeud à l'adresse adr.
 
@@ -290,85 +385,292 @@ def read_SNumber(bus = None, adr = -1):
   else:
     raise CoordException(F"<read_SNumber> Bus non initié ou adresse I2C invalide.")
 
+def read_Tick(bus = None, adr = -1, reg = -1):
+  '''Lire un tick (millis() du noeud, 4 octets) en une seule transaction.
+
+  Arguments:
+  bus -- objet SMBUS déjà initialisé
+  adr (int) -- adresse du noeud destinataire
+  reg (int) -- adresse du registre (I2C_NODE_TICK ou I2C_NODE_TICK_ECHAN)
+
+  Retour (int): tick en ms (entier non signé de 32 bits)
+  Exceptions possibles: CoordException, IOError, struct.error
+  '''
+  if bus != None and (adr >= cst.I2C_MIN_ADR and adr <= cst.I2C_MAX_ADR):
+    # Le noeud envoie les registres à partir de reg: les 4 octets sont
+    # lus dans la même transaction (pas de mélange de deux ticks).
+    tick = struct.unpack('<I', bytes(bus.read_i2c_block_data(adr, reg, 4)))
+    return tick[0]
+  else:
+    raise CoordException(F"<read_Tick> Bus non initié ou adresse I2C invalide.")
+
+def read_Status(bus = None, adr = -1, reg = -1):
+  '''Lire le registre des changements du noeud à l'adresse adr.
+
+  Le noeud remet ce registre à zéro dès qu'il est lu.
+
+  Arguments:
+  bus -- objet SMBUS déjà initialisé
+  adr (int) -- adresse du noeud destinataire
+  reg (int) -- adresse du registre des changements sur ce noeud
+
+  Retour (int): bits des champs modifiés depuis la dernière lecture
+  Exceptions possibles: CoordException, IOError
+  '''
+  if bus != None and (adr >= cst.I2C_MIN_ADR and adr <= cst.I2C_MAX_ADR):
+    bus.write_byte(adr, reg)
+    return bus.read_byte(adr)
+  else:
+    raise CoordException(F"<read_Status> Bus non initié ou adresse I2C invalide.")
+
+def read_Snapshot(bus = None, adr = -1):
+  '''Lire tous les registres du noeud à l'adresse adr en une seule transaction.
+
+  Le noeud sert la lecture à partir de sa copie publiée de la carte des
+  registres: les champs viennent tous du même échantillon (pas de float
+  composé des octets de deux échantillons) et son registre des changements
+  est remis à zéro.
+
+  Arguments:
+  bus -- objet SMBUS déjà initialisé
+  adr (int) -- adresse du noeud destinataire
+
+  Retour (dict): champ -> valeur (voir I2C_NODE_CARTE)
+  Exceptions possibles: CoordException, IOError, struct.error
+  '''
+  if bus != None and adr in cst.I2C_NODE_CARTE:
+    fmt, champs = cst.I2C_NODE_CARTE[adr]
+    octets = bus.read_i2c_block_data(adr, cst.I2C_NODE_SNAPSHOT, struct.calcsize(fmt))
+    return dict(zip(champs, struct.unpack(fmt, bytes(octets))))
+  else:
+    raise CoordException(F"<read_Snapshot> Bus non initié ou adresse I2C invalide.")
+
+def read_Agregats(bus = None, adr = -1):
+  '''Lire les agrégats (min, max, moyenne) des échantillons publiés par le
+  noeud depuis la lecture précédente. Le noeud les remet alors à zéro.
+
+  Arguments:
+  bus -- objet SMBUS déjà initialisé
+  adr (int) -- adresse du noeud destinataire
+
+  Retour (tuple): nombre d'échantillons agrégés et
+                  {champ: (min, max, moyenne)} (vide si aucun échantillon)
+  Exceptions possibles: CoordException, IOError, struct.error
+  '''
+  if bus != None and adr in cst.I2C_NODE_AGREGATS:
+    reg, fmt, champs = cst.I2C_NODE_AGREGATS[adr]
+    nombre, *valeurs = struct.unpack(fmt, bytes(bus.read_i2c_block_data(adr, reg, struct.calcsize(fmt))))
+    if nombre == 0:
+      return 0, {}
+    return nombre, {champ : tuple(valeurs[3 * i : 3 * i + 3]) for i, champ in enumerate(champs)}
+  else:
+    raise CoordException(F"<read_Agregats> Bus non initié ou adresse I2C invalide.")
+
 # ------------------------------------------------------
 # Fonction principale
 # ------------------------------------------------------
-def main():
-
+def main(bus = None, horloge = time, evenements = None,
+         repertoire_historique = cst.REPERTOIRE_HISTORIQUE,
+         noms_consommateurs = cst.PIPELINE_CONSOMMATEURS):
+  '''Coordonner les noeuds jusqu'à ctrl-c.
+
+  Arguments (par défaut: matériel réel; voir rejeu.py pour les essais):
+  bus -- objet SMBUS (None: SMBus(1))
+  horloge -- objet avec time_ns() et sleep() (module time par défaut)
+  evenements -- source des impulsions (None: voir gpio_evenements.creer())
+  repertoire_historique (str) -- répertoire de l'historique
+  noms_consommateurs (tuple) -- consommateurs du pipeline
+  '''
   # Stocker les données reçues dans un dictionnaire:
   #    clés -> adresses I2C des noeuds
   # valeurs -> dictionnaires contenant deux chmaps 'Température' et 'Sample_Num'
+  # Sample_Num est en dernier: il termine les champs d'un échantillon écrits
+  # dans l'anneau (voir pipeline.ConsommateurInference).
   Sensor_Data = {
     cst.I2C_ADDRESS[0] : {'Temperature' : -1.0,'Humidity' : -1.0, 'Sample_Num' : 0},
     cst.I2C_ADDRESS[1] : {'Leq' : -1.0, 'Sample_Num' : 0}
   }
 
-  # Bon. Indiquer que le coordonnateur est prêt...
-  print("Coordonnateur (Pi) en marche avec Ts =", cst.SAMPLING_TIME, "sec.")
-  print("ctrl-c pour terminer le programme.")
-
-  # Instancier un objet de type SMBus et le lié au port i2c-1
-  bus = smbus.SMBus(1)
+  # Un champ n'est lu que s'il a changé ou si son silence max est dépassé
+  politique = PolitiqueBandeMorte(silences_max = cst.SILENCE_MAX)
+  # Bit du registre des changements de chaque champ des noeuds
+  Champs = {
+    cst.I2C_ADDRESS[0] : {'Temperature' : cst.I2C_STATUS_TEMP,
+                          'Humidity' : cst.I2C_STATUS_HUM},
+    cst.I2C_ADDRESS[1] : {'Leq' : cst.I2C_STATUS_LEQ}
+  }
+  # Horloge de chaque noeud: les échantillons sont horodatés au moment où
+  # le noeud les a pris (et non au moment de leur lecture)
+  horloges = {adr : HorlogeNoeud() for adr in cst.I2C_ADDRESS}
+  Derniers = {adr : {'Generation' : None, 'Temps' : 0} for adr in cst.I2C_ADDRESS}
+  # Ts de chaque noeud selon la variabilité de ses signaux, estimée dès le
+  # départ à partir de l'historique
+  historique = Historique(repertoire_historique)
+  controleurs = {}
+  for adr, config in cst.CONTROLE_TS.items():
+    controleurs[adr] = ControleurTs(ts_initial = cst.NEW_TS, **config)
+    controleurs[adr].initialiser(historique, adr)
+
+  def changer_ts(bus, adr, ts):
+    # Seul chemin des changements de Ts (règles et contrôleur): le
+    # contrôleur du noeud prend ce Ts comme Ts courant et ne le change pas
+    # avant son délai (pas de lutte entre une règle et le contrôleur).
+    send_Ts_large(bus, adr, ts)
+    if adr in controleurs:
+      controleurs[adr].imposer(ts, horloge.time_ns())
+
+  # Règles évaluées sur chaque échantillon et fonctions de leurs actions
+  moteur = MoteurRegles(cst.REGLES, cst.I2C_ADDRESS)
+  Actions = {'pause' : send_pause, 'ts' : changer_ts, 'reset' : send_reset,
+             'stop' : send_stop, 'go' : send_go}
+
+  # Créés dans le try: une erreur au démarrage (p. ex. RPi.GPIO ou smbus
+  # absent) passe aussi par le finally qui libère ce qui a été créé.
+  anneau = consommateurs = arret = None
   try:
+    # Les échantillons sont écrits dans un anneau en mémoire partagée.
+    # L'affichage, l'historique, l'envoi et l'inférence sont faits par des
+    # processus consommateurs: ils ne retardent jamais la lecture du bus.
+    anneau = pipeline.AnneauPartage(cst.PIPELINE_CAPACITE, len(noms_consommateurs))
+    consommateurs, arret = pipeline.demarrer(anneau, noms_consommateurs,
+                                             {'console' : {'noms' : noms_consommateurs},
+                                              'stockage' : {'racine' : repertoire_historique}})
+
+    # Le coordonnateur est réveillé par les impulsions des noeuds
+    if evenements is None:
+      evenements = gpio_evenements.creer(cst.GPIO_SOURCE, cst.I2C_NODE_GPIO,
+                                         cst.GPIO_PERIODES_SIMULEES)
+
+    # Bon. Indiquer que le coordonnateur est prêt...
+    print("Coordonnateur (Pi) en marche, en attente des noeuds (max",
+          cst.GPIO_DELAI_MAX, "sec.)")
+    print("ctrl-c pour terminer le programme.")
+
+    # Instancier un objet de type SMBus et le lié au port i2c-1
+    if bus is None:
+      import smbus        # pour la communication I2C (seulement sur le Pi)
+      bus = smbus.SMBus(1)
+
+    # Les commandes sont envoyées à tous les noeuds en une transaction.
+    # Un noeud qui n'a pas accusé réception reçoit la commande directement.
     # 1) C'est une bonne pratique d'arrêter le noeud avant de
     #    lancer des commandes.
     print('Arrêter les noeuds.')
-    for adr in cst.I2C_ADDRESS:
+    for adr in send_groupe(bus, cst.I2C_CMD_SET_STOP):
       send_stop(bus, adr)
 
     # 2) Régler le temps d'échantillonnage du noeud à NEW_TS secondes
     print("Assigner une nouvelle Ts =",  cst.NEW_TS, "aux noeuds.")
-    for adr in cst.I2C_ADDRESS:
+    for adr in send_groupe(bus, cst.I2C_CMD_SET_TS, (cst.NEW_TS,)):
       send_Ts(bus, adr, cst.NEW_TS)
-      time.sleep(0.1)         # attendre avant de continuer l'écriture
+      horloge.sleep(0.1)      # attendre avant de continuer l'écriture
 
     # 3) Ok. Demander au noeud de démarrer/continuer son échantillonnage
+    #    (tous les noeuds démarrent au même moment)
     print("Demander aux noeuds de démarrer l'échantillonnage.")
-    for adr in cst.I2C_ADDRESS:
+    for adr in send_groupe(bus, cst.I2C_CMD_SET_GO):
       send_go(bus, adr)
 
     # 4) Le coordonnateur demande et reçoit des données du noeud
     #    jusqu'à ce que l'utilisateur arrête le programme par ctrl-c.
     while True:         # boucle infinie
-      # 4.1) attendre la fin de la période d'échantillonnage
-      #      du coordonateur
-      time.sleep(cst.SAMPLING_TIME)
+      # 4.1) attendre qu'au moins un noeud signale un nouvel échantillon.
+      #      Sans impulsion pendant GPIO_DELAI_MAX (impulsion manquée, noeud
+      #      arrêté), tous les noeuds sont lus.
+      prets = evenements.attendre(cst.GPIO_DELAI_MAX)
+      noeuds = [adr for adr in cst.I2C_ADDRESS if adr in prets] or cst.I2C_ADDRESS
 
-      # 4.2) Lire la température,l'humidité et le Leq interne du noeud.
-      Sensor_Data[cst.I2C_ADDRESS[0]]['Temperature'] = read_Temp(bus, cst.I2C_ADDRESS[0])
-      Sensor_Data[cst.I2C_ADDRESS[0]]['Humidity'] = read_Hum(bus, cst.I2C_ADDRESS[0])
-      Sensor_Data[cst.I2C_ADDRESS[1]]['Leq'] = read_Leq(bus, cst.I2C_ADDRESS[1])
-
-      # 4.3) Lire le temps local comme l'horodatage (timestamp)
+      # 4.2) Lire le temps local (ns) pour le battement de coeur des lectures
       #      N'oubliez pas de régler le temps du Pi s'il n'est pas relié au réseau.
-      temps = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-      # 4.4) Lire le nombre d'échantillon acquis par le noeud
-      for adr in cst.I2C_ADDRESS:
-        Sensor_Data[adr]['Sample_Num'] = read_SNumber(bus, adr)
-
-
-      # 4.5) Afficher les données reçues à la sortie standard
-      print("\n<Temps: ", temps, ">")
-    
-      print("Noeud: {0}, Échantillon: {1}, Température: {2:.2f},  Humidity: {3:.2f}".format(hex(cst.I2C_ADDRESS[0]),
-      Sensor_Data[cst.I2C_ADDRESS[0]]['Sample_Num'], Sensor_Data[cst.I2C_ADDRESS[0]]['Temperature'],Sensor_Data[cst.I2C_ADDRESS[0]]['Humidity']))
-      print("Noeud: {0}, Échantillon: {1}, Leq: {2:.2f}".format(hex(cst.I2C_ADDRESS[1]),
-      Sensor_Data[cst.I2C_ADDRESS[1]]['Sample_Num'], Sensor_Data[cst.I2C_ADDRESS[1]]['Leq']))
-
-      for adr in cst.I2C_ADDRESS:
-        if 10<=Sensor_Data[adr]['Sample_Num'] and 12>=Sensor_Data[adr]['Sample_Num']:
-          send_pause(bus,adr,10)
-          print('Commande pause envoyé')
-
-        if 15<=Sensor_Data[adr]['Sample_Num']:
-          send_reset(bus,adr)
-          print('Commande reset envoyé')
+      temps_ns = horloge.time_ns()
+
+      # 4.3) Lire tous les registres de chaque noeud en une transaction.
+      #      Le noeud publie chaque échantillon dans une copie de ses
+      #      registres: le numéro d'échantillon, les valeurs, le tick de
+      #      l'échantillon et les changements viennent du même échantillon
+      #      (pas besoin de relire pour détecter une lecture déchirée).
+      instantanes = {adr : read_Snapshot(bus, adr) for adr in noeuds}
+      # Min, max et moyenne des échantillons publiés depuis la lecture
+      # précédente: les extrêmes entre deux lectures ne sont pas perdus.
+      agregats = {adr : read_Agregats(bus, adr) for adr in noeuds}
+
+      # Synchroniser l'horloge de chaque noeud (aller-retour de la lecture
+      # de son tick courant) et horodater son dernier échantillon en ns.
+      # L'horodatage ne recule jamais, même si l'estimation change.
+      temps_echan = {}
+      for adr in noeuds:
+        t_envoi = horloge.time_ns()
+        tick = read_Tick(bus, adr, cst.I2C_NODE_TICK[adr])
+        horloges[adr].ajouter_mesure(tick, t_envoi, horloge.time_ns())
+        t = horloges[adr].vers_ns(instantanes[adr]['Tick_Echan'])
+        temps_echan[adr] = max(t, Derniers[adr]['Temps'])
+
+      # 4.4) Écrire les champs reçus des nouveaux échantillons dans l'anneau
+      #      et les passer au moteur de règles. Le numéro de génération
+      #      (1 octet, de 1 à 255) change à chaque échantillon publié: un
+      #      saut de plus de 1 indique des échantillons publiés entre deux
+      #      cycles.
+      #      La génération 0 (aucun échantillon publié, valeurs -1) et le
+      #      premier instantané de chaque noeud (échantillon pris avant le
+      #      démarrage) servent de référence sans être émis.
+      #      Seuls les champs marqués comme changés par le noeud (ou dont le
+      #      silence max est dépassé) d'un nouvel échantillon sont retenus:
+      #      un champ n'est confirmé que s'il est écrit dans l'anneau.
+      actions = []
+      for adr in noeuds:
+        generation = instantanes[adr]['Generation']
+        if Derniers[adr]['Generation'] is None or generation == 0:
+          Derniers[adr]['Generation'] = generation
+          Derniers[adr]['Temps'] = temps_echan[adr]
+        elif generation != Derniers[adr]['Generation']:
+          sautes = (generation - Derniers[adr]['Generation'] - 1) % 255
+          if sautes:
+            print(F"{sautes} échantillon(s) du noeud {hex(adr)} non lu(s), "
+                  F"gardé(s) dans les agrégats.")
+          Derniers[adr]['Generation'] = generation
+          Derniers[adr]['Temps'] = temps_echan[adr]
+          lus = set()
+          Sensor_Data[adr]['Sample_Num'] = instantanes[adr]['Sample_Num']
+          for champ, bit in Champs[adr].items():
+            if instantanes[adr]['Changements'] & bit or politique.expire(adr, champ, temps_ns):
+              Sensor_Data[adr][champ] = instantanes[adr][champ]
+              politique.confirmer(adr, champ, Sensor_Data[adr][champ], temps_ns)
+              lus.add(champ)
+          # Un Leq couvre tp = Ts x nbSample x nbLi avec le Ts courant du
+          # noeud (il change avec le contrôle de Ts et les règles)
+          tp = instantanes[adr]['Ts_Large'] * cst.LEQ_TP_PAR_TS
+          for champ, valeur in Sensor_Data[adr].items():
+            if champ == 'Sample_Num' or champ in lus:
+              anneau.ecrire(temps_echan[adr], adr, champ, valeur, tp if champ == 'Leq' else 0.0)
+              actions += moteur.echantillon(adr, champ, temps_echan[adr], valeur)
+          # Agrégats de plus d'un échantillon (sinon ce sont les valeurs
+          # ci-dessus)
+          nombre, valeurs_agregees = agregats[adr]
+          if nombre > 1:
+            for champ, valeurs in valeurs_agregees.items():
+              for suffixe, valeur in zip(('_Min', '_Max', '_Moy'), valeurs):
+                anneau.ecrire(temps_echan[adr], adr, champ + suffixe, valeur)
+                actions += moteur.echantillon(adr, champ + suffixe, temps_echan[adr], valeur)
+          # Les champs non lus n'ont pas changé: leur valeur compte aussi
+          if adr in controleurs:
+            for champ, valeur in Sensor_Data[adr].items():
+              ts = controleurs[adr].echantillon(champ, temps_echan[adr], valeur)
+              if ts is not None:
+                actions.append(('controle_ts', adr, ('ts', ts)))
+
+      # 4.5) Envoyer les commandes déclenchées par les règles
+      for nom, adr, (action, *args) in actions:
+        if action == 'alerte':
+          print(F"Alerte '{nom}' du noeud {hex(adr)}: {args[0]}")
+        else:
+          Actions[action](bus, adr, *args)
+          print(F"Commande {action} envoyée au noeud {hex(adr)} (règle '{nom}')")
 
   except KeyboardInterrupt:
-    # 5) Ctrl-c reçu alors arrêter l'échantillonnage
-    for adr in cst.I2C_ADDRESS:
-      send_stop(bus, adr)
+    # 5) Ctrl-c reçu alors arrêter l'échantillonnage (si le bus est ouvert)
+    if bus is not None:
+      for adr in send_groupe(bus, cst.I2C_CMD_SET_STOP):
+        send_stop(bus, adr)
   except IOError as io_e:
     print("Erreur détectée sur le bus i2c.") 
     print("Message d'erreur: ", io_e)
@@ -378,6 +680,14 @@ def main():
   except CoordException as ce:
     print("Problème détecté dans l'utilisation des fonctions.")
     print(F"Message d'erreur: {ce}")
+  finally:
+    # Laisser les consommateurs vider l'anneau puis le libérer
+    if evenements is not None:
+      evenements.fermer()
+    if consommateurs is not None:
+      pipeline.arreter(consommateurs, arret)
+    if anneau is not None:
+      anneau.detruire()
 
 #
 # Il faut aussi gérer les autres exceptions!   
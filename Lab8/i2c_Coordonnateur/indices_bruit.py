@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+indices_bruit.py
+Indices statistiques du bruit (L10, L50, L90) calculés en continu.
+
+Lx est le niveau dépassé x % du temps: L10 est le 90e centile des niveaux
+reçus (bruit des événements), L90 le 10e centile (bruit de fond). Au lieu de
+garder et trier toutes les valeurs, on résume chaque période (une heure par
+défaut) et chaque noeud par un t-digest:
+
+  - les valeurs sont regroupées en centroïdes (moyenne, poids) triés;
+  - la taille d'un centroïde est bornée par la fonction d'échelle
+        k(q) = compression / (2 pi) x asin(2q - 1)
+    (un centroïde couvre au plus une unité de k): les centroïdes sont
+    petits près de q = 0 et q = 1, donc les centiles extrêmes sont précis;
+  - les nouvelles valeurs sont accumulées dans un tampon puis fusionnées
+    avec les centroïdes (tri NumPy + un passage).
+
+La mémoire est d'environ compression / 2 centroïdes par digest, quel que soit
+le nombre de valeurs (compression = 200: erreur de rang ~0,1 % sur L10). Deux digests se fusionnent (mêmes opérations), ce qui donne
+les indices sur plusieurs heures ou jours à partir des digests des périodes.
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+import math
+import numpy as np
+
+NS_PAR_SEC = 1_000_000_000
+CENTILES = (10, 50, 90)      # indices Lx calculés par défaut
+
+
+class TDigest:
+  '''Résumé des valeurs pour estimer leurs centiles (t-digest fusionnable).'''
+  def __init__(self, compression = 200):
+    '''Arguments:
+    compression (float) -- nombre approximatif de centroïdes gardés
+    '''
+    self.compression = compression
+    self._moyennes = np.empty(0)
+    self._poids = np.empty(0)
+    self._tampon = []             # (valeur, poids) pas encore fusionnées
+    self._taille_tampon = int(5 * compression)
+    self.min = math.inf
+    self.max = -math.inf
+
+  def __len__(self):
+    '''Nombre de centroïdes (après fusion du tampon).'''
+    self._fusionner()
+    return len(self._moyennes)
+
+  @property
+  def poids(self):
+    '''Poids total des valeurs ajoutées.'''
+    return float(self._poids.sum()) + sum(p for _, p in self._tampon)
+
+  def ajouter(self, valeur, poids = 1.0):
+    '''Ajouter une valeur (le poids peut être sa durée).'''
+    self._tampon.append((valeur, poids))
+    self.min = min(self.min, valeur)
+    self.max = max(self.max, valeur)
+    if len(self._tampon) >= self._taille_tampon:
+      self._fusionner()
+
+  def fusionner(self, autre):
+    '''Ajouter toutes les valeurs résumées par un autre digest.'''
+    autre._fusionner()
+    self._fusionner(autre._moyennes, autre._poids)
+    self.min = min(self.min, autre.min)
+    self.max = max(self.max, autre.max)
+
+  def _k(self, q):
+    return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+  def _fusionner(self, moyennes = None, poids = None):
+    '''Fusionner le tampon (et des centroïdes) avec les centroïdes.'''
+    parties_m, parties_p = [self._moyennes], [self._poids]
+    if self._tampon:
+      tampon = np.array(self._tampon, dtype = np.float64)
+      parties_m.append(tampon[:, 0])
+      parties_p.append(tampon[:, 1])
+      self._tampon = []
+    if moyennes is not None:
+      parties_m.append(moyennes)
+      parties_p.append(poids)
+    if len(parties_m) == 1:
+      return
+    m = np.concatenate(parties_m)
+    p = np.concatenate(parties_p)
+    ordre = np.argsort(m, kind = 'stable')
+    m, p = m[ordre], p[ordre]
+    total = p.sum()
+
+    nouvelles_m, nouvelles_p = [], []
+    somme_m, somme_p = m[0] * p[0], p[0]
+    cumul = 0.0                          # poids avant le centroïde courant
+    k_limite = self._k(0.0) + 1.0
+    for x, w in zip(m[1:].tolist(), p[1:].tolist()):
+      if self._k(min(1.0, (cumul + somme_p + w) / total)) <= k_limite:
+        somme_m += x * w
+        somme_p += w
+      else:
+        nouvelles_m.append(somme_m / somme_p)
+        nouvelles_p.append(somme_p)
+        cumul += somme_p
+        k_limite = self._k(cumul / total) + 1.0
+        somme_m, somme_p = x * w, w
+    nouvelles_m.append(somme_m / somme_p)
+    nouvelles_p.append(somme_p)
+    self._moyennes = np.array(nouvelles_m)
+    self._poids = np.array(nouvelles_p)
+
+  def quantile(self, q):
+    '''Estimer le quantile q (0 à 1). Retour: None si le digest est vide.'''
+    self._fusionner()
+    if len(self._moyennes) == 0:
+      return None
+    if len(self._moyennes) == 1:
+      return float(self._moyennes[0])
+    # Chaque centroïde est centré sur le milieu de son poids cumulé;
+    # interpolation linéaire entre centres, min et max aux extrémités.
+    centres = np.cumsum(self._poids) - self._poids / 2
+    x = np.concatenate(([0.0], centres, [self._poids.sum()]))
+    y = np.concatenate(([self.min], self._moyennes, [self.max]))
+    return float(np.interp(q * self._poids.sum(), x, y))
+
+  def centroides(self):
+    '''Centroïdes (moyennes, poids) pour sauvegarder le digest.'''
+    self._fusionner()
+    return self._moyennes.copy(), self._poids.copy()
+
+
+class IndicesBruit:
+  '''Digests des niveaux reçus par noeud et par période.'''
+  def __init__(self, periode_sec = 3600, compression = 200, retention = None):
+    '''Arguments:
+    periode_sec (int) -- durée d'une période (un digest par période)
+    compression (float) -- compression des digests
+    retention (int) -- nombre de périodes gardées par noeud (None: toutes)
+    '''
+    self.periode_ns = int(periode_sec * NS_PAR_SEC)
+    self.compression = compression
+    self.retention = retention
+    self._digests = {}            # noeud -> {début de la période (ns): TDigest}
+
+  def ajouter(self, noeud, t_ns, niveau, poids = 1.0):
+    '''Ajouter un niveau (Li, Leq) reçu d'un noeud au temps t_ns.'''
+    periodes = self._digests.setdefault(noeud, {})
+    debut = t_ns - t_ns % self.periode_ns
+    if debut not in periodes:
+      periodes[debut] = TDigest(self.compression)
+      if self.retention is not None and len(periodes) > self.retention:
+        del periodes[min(periodes)]
+    periodes[debut].ajouter(niveau, poids)
+
+  def digest(self, noeud, debut_ns = None, fin_ns = None):
+    '''Digest fusionné des périodes du noeud qui commencent dans
+    [debut_ns, fin_ns[ (toutes par défaut).'''
+    fusion = TDigest(self.compression)
+    for debut, d in self._digests.get(noeud, {}).items():
+      if (debut_ns is None or debut >= debut_ns) and (fin_ns is None or debut < fin_ns):
+        fusion.fusionner(d)
+    return fusion
+
+  def indices(self, noeud, debut_ns = None, fin_ns = None, centiles = CENTILES):
+    '''Indices Lx du noeud sur les périodes choisies.
+
+    Retour (dict): {'L10' : niveau, ...} (niveaux None si aucune valeur)
+    '''
+    d = self.digest(noeud, debut_ns, fin_ns)
+    return {F"L{x}" : d.quantile(1.0 - x / 100.0) for x in centiles}
+
+
+# ------------------------------------------------------
+# Précision et mémoire comparées au tri de toutes les valeurs
+# ------------------------------------------------------
+if __name__ == '__main__':
+  import time
+  rng = np.random.default_rng(788)
+  # Une semaine de Li (2 s): bruit de fond + événements bruyants
+  n = 7 * 86400 // 2
+  niveaux = rng.normal(45, 3, n)
+  evenements = rng.random(n) < 0.08
+  niveaux[evenements] = rng.normal(72, 6, evenements.sum())
+  temps = np.arange(n, dtype = np.int64) * 2 * NS_PAR_SEC
+
+  indices = IndicesBruit()
+  debut = time.perf_counter()
+  for t, v in zip(temps.tolist(), niveaux.tolist()):
+    indices.ajouter(0x45, t, v)
+  duree = time.perf_counter() - debut
+  print(F"{n} niveaux ajoutés en {duree:.2f} s, "
+        F"{len(indices._digests[0x45])} digests horaires")
+
+  for nom, debut, fin in (('1 h', 0, 3600), ('24 h', 0, 86400), ('7 jours', 0, 7 * 86400)):
+    d = indices.digest(0x45, debut * NS_PAR_SEC, fin * NS_PAR_SEC)
+    vrais = niveaux[(temps >= debut * NS_PAR_SEC) & (temps < fin * NS_PAR_SEC)]
+    texte = []
+    for x in CENTILES:
+      estime, vrai = d.quantile(1 - x / 100), np.percentile(vrais, 100 - x)
+      texte.append(F"L{x} {estime:.2f} ({vrai:.2f})")
+    print(F"{nom}: {', '.join(texte)}, {len(d)} centroïdes pour {len(vrais)} valeurs")
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+ingestion_journaux.py
+Convertir les journaux de mesures du laboratoire en séries de l'historique
+(voir historique.py) en une seule passe, ligne par ligne.
+
+Formats reconnus (on peut les mélanger dans un même fichier):
+
+  1) measurementDHT.txt
+       2022/10/18, 11:15 - 11:30h          <- en-tête: date, début et fin
+       Temperature : 22
+       Humidite : 17
+     La période est la durée de la section divisée par le nombre de mesures.
+
+  2) measurementELECTRET.txt
+       2022/10/18, 11:30 - 16:30h
+       Ts = 62ms   ti = 1.98s   tp = 4.96min
+       59.778      4.96                    <- Leq et durée de l'intervalle (min)
+       --->13:20h, Leaving the room.       <- annotation (événement)
+     La deuxième colonne est la durée de chaque intervalle (tp), pas un
+     cumul: chaque Leq est horodaté à la fin de son intervalle en additionnant
+     ces durées depuis le début de la section.
+
+  3) Journaux du moniteur série des noeuds (Lab8/i2c_*/Log.txt)
+       Noeud à l'adresse 0x45 prêt à recevoir des commandes
+       La nouvelle valeur est: 6 secondes  <- Ts
+       #5  71.61                           <- Leq
+       #1  T:21.00 / H:15.00               <- DHT11 (deux lignes)
+     Ces journaux n'ont pas d'heure: on part de 'debut' et on avance de Ts
+     (ou de 'periode') à chaque échantillon et de la durée de chaque pause.
+     Les commandes reçues sont gardées comme événements.
+
+Les lignes qui ne peuvent pas être horodatées (mesures DHT avant tout
+en-tête de date, H: sans T: qui le précède) ou qui ne sont pas reconnues sont
+ignorées et comptées: ingerer() retourne leur nombre avec celui des
+échantillons ajoutés.
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+import os
+import re
+from datetime import datetime, timedelta
+import numpy as np
+from historique import Historique
+
+NS_PAR_SEC = 1_000_000_000
+TAILLE_LOT = 65536      # Nb. d'échantillons gardés en mémoire par série
+
+RE_ENTETE = re.compile(r'^(\d{4})/(\d{1,2})/(\d{1,2}),\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})h?')
+RE_PERIODES = re.compile(r'Ts\s*=\s*([\d.]+)\s*ms\s+ti\s*=\s*([\d.]+)\s*s\s+tp\s*=\s*([\d.]+)\s*min')
+RE_DHT = re.compile(r'^(Temperature|Humidite)\s*:\s*(-?[\d.]+)')
+RE_LEQ_MINUTES = re.compile(r'^(-?[\d.]+)\s+([\d.]+)\s*$')
+RE_ANNOTATION = re.compile(r'^--->\s*(\d{1,2}):(\d{2})h?,?\s*(.*)$')
+RE_NOEUD = re.compile(r"Noeud à l'adresse 0x([0-9A-Fa-f]+)")
+RE_NOUVEAU_TS = re.compile(r'La nouvelle valeur est:\s*(\d+)\s*secondes')
+RE_PAUSE = re.compile(r'pause pendant\s*:\s*(\d+)\s*secondes')
+RE_ECHANTILLON_DHT = re.compile(r'^#(\d+)\s+T:(-?[\d.]+)')
+RE_HUMIDITE_DHT = re.compile(r'^\s+H:(-?[\d.]+)')
+RE_ECHANTILLON_LEQ = re.compile(r'^#(\d+)\s+(-?[\d.]+)\s*$')
+
+CHAMPS = {'Temperature': 'Temperature', 'Humidite': 'Humidity'}
+
+
+def _ns(moment):
+  '''datetime (heure locale) -> horodatage en ns (int).'''
+  return round(moment.timestamp() * 1_000_000) * 1000
+
+
+class _Tampons:
+  '''Échantillons en attente d'écriture, regroupés par série.'''
+  def __init__(self, historique):
+    self.historique = historique
+    self.series = {}
+    self.nb = 0
+
+  def ajouter(self, noeud, champ, t_ns, valeur):
+    temps, valeurs = self.series.setdefault((noeud, champ), ([], []))
+    temps.append(t_ns)
+    valeurs.append(valeur)
+    self.nb += 1
+    if len(temps) >= TAILLE_LOT:
+      self.vider((noeud, champ))
+
+  def vider(self, cle = None):
+    for c in ([cle] if cle else list(self.series)):
+      temps, valeurs = self.series.pop(c)
+      self.historique.ajouter_lot(c[0], c[1], np.array(temps, dtype = np.int64),
+                                  np.array(valeurs, dtype = np.float32))
+
+
+def ingerer(historique, chemin, noeud = None, debut = None, periode = None):
+  '''Lire un journal et ajouter ses mesures et événements à l'historique.
+
+  Arguments:
+  historique (Historique) -- entrepôt de destination
+  chemin (str) -- fichier texte à lire
+  noeud (str) -- nom de la source (défaut: adresse lue dans le journal ou
+                 nom du fichier)
+  debut (datetime) -- début des journaux sans heure (défaut: date de
+                      modification du fichier)
+  periode (float) -- période d'échantillonnage (s) des journaux série
+                     (défaut: Ts lu dans le journal)
+
+  Retour (tuple): (nombre d'échantillons ajoutés, nombre de lignes ignorées)
+  '''
+  tampons = _Tampons(historique)
+  source = noeud or os.path.splitext(os.path.basename(chemin))[0]
+  if debut is None:
+    debut = datetime.fromtimestamp(os.path.getmtime(chemin))
+
+  date = None                 # date de la section courante
+  t = _ns(debut)              # temps courant (ns)
+  fin_section = None
+  dht = {'Temperature': [], 'Humidite': []}   # mesures de la section DHT
+  ts = periode                # période des journaux série (s)
+  t_dht = None                # temps du dernier échantillon #n T: (DHT11)
+  ignorees = 0                # lignes sans horodatage ou non reconnues
+
+  def vider_dht():
+    # Répartir les mesures de la section sur la durée de la section
+    nonlocal ignorees
+    n = max(len(v) for v in dht.values())
+    if n and fin_section is None:
+      # Mesures avant tout en-tête: aucune date pour les placer
+      ignorees += sum(len(v) for v in dht.values())
+    elif n:
+      pas = (fin_section - t_section) // n
+      for nom, valeurs in dht.items():
+        for k, v in enumerate(valeurs):
+          tampons.ajouter(source, CHAMPS[nom], t_section + k * pas, v)
+    for valeurs in dht.values():
+      valeurs.clear()
+
+  t_section = t
+  with open(chemin, encoding = 'utf-8', errors = 'replace') as f:
+    for ligne in f:
+      ligne = ligne.rstrip('\r\n')
+      if not ligne.strip():
+        continue
+
+      m = RE_ENTETE.match(ligne)
+      if m:
+        vider_dht()
+        a, mo, j, h1, m1, h2, m2 = (int(x) for x in m.groups())
+        date = datetime(a, mo, j)
+        t = t_section = _ns(date + timedelta(hours = h1, minutes = m1))
+        fin = date + timedelta(hours = h2, minutes = m2)
+        fin_section = _ns(fin if h2 * 60 + m2 > h1 * 60 + m1 else fin + timedelta(days = 1))
+        continue
+
+      m = RE_DHT.match(ligne)
+      if m:
+        dht[m.group(1)].append(float(m.group(2)))
+        continue
+
+      m = RE_PERIODES.search(ligne)
+      if m:
+        ts = float(m.group(3)) * 60.0     # tp en secondes
+        continue
+
+      m = RE_LEQ_MINUTES.match(ligne)
+      if m:
+        t += round(float(m.group(2)) * 60.0 * NS_PAR_SEC)
+        tampons.ajouter(source, 'Leq', t, float(m.group(1)))
+        continue
+
+      m = RE_ANNOTATION.match(ligne)
+      if m:
+        moment = (date or debut.replace(hour = 0, minute = 0, second = 0, microsecond = 0))
+        moment += timedelta(hours = int(m.group(1)), minutes = int(m.group(2)))
+        historique.ajouter_evenement(_ns(moment), source, m.group(3).strip())
+        continue
+
+      # ---- Journaux du moniteur série ----
+      m = RE_NOEUD.search(ligne)
+      if m:
+        source = noeud or '0x' + m.group(1).lower()
+        continue
+
+      m = RE_NOUVEAU_TS.search(ligne)
+      if m:
+        ts = periode or float(m.group(1))
+        historique.ajouter_evenement(t, source, ligne.strip())
+        continue
+
+      m = RE_ECHANTILLON_DHT.match(ligne)
+      if m:
+        t += round((ts or 0.0) * NS_PAR_SEC)
+        t_dht = t
+        tampons.ajouter(source, 'Temperature', t, float(m.group(2)))
+        continue
+
+      m = RE_HUMIDITE_DHT.match(ligne)
+      if m:
+        if t_dht is None:
+          ignorees += 1
+        else:
+          tampons.ajouter(source, 'Humidity', t_dht, float(m.group(1)))
+        continue
+
+      m = RE_ECHANTILLON_LEQ.match(ligne)
+      if m:
+        t += round((ts or 0.0) * NS_PAR_SEC)
+        tampons.ajouter(source, 'Leq', t, float(m.group(2)))
+        continue
+
+      m = RE_PAUSE.search(ligne)
+      if m:
+        historique.ajouter_evenement(t, source, ligne.strip())
+        t += int(m.group(1)) * NS_PAR_SEC
+        continue
+
+      if 'ommande' in ligne or ligne.startswith('['):
+        # Commandes reçues et ouverture/fermeture du port série
+        historique.ajouter_evenement(t, source, ligne.strip())
+      else:
+        ignorees += 1
+
+  vider_dht()
+  tampons.vider()
+  return tampons.nb, ignorees
+
+
+# ------------------------------------------------------
+# Programme principal
+# ------------------------------------------------------
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description = "Ingestion des journaux de mesures")
+  parser.add_argument('racine', help = "répertoire de l'historique")
+  parser.add_argument('fichiers', nargs = '+', help = "journaux à lire (en ordre chronologique)")
+  parser.add_argument('--noeud', help = "nom de la source")
+  parser.add_argument('--debut', type = datetime.fromisoformat,
+                      help = "début des journaux sans heure (AAAA-MM-JJ HH:MM:SS)")
+  parser.add_argument('--periode', type = float, help = "période des journaux série (s)")
+  args = parser.parse_args()
+
+  historique = Historique(args.racine)
+  for fichier in args.fichiers:
+    n, ignorees = ingerer(historique, fichier, args.noeud, args.debut, args.periode)
+    print(F"{fichier}: {n} échantillons, {ignorees} lignes ignorées")
+  print("Séries:", ", ".join(historique.series()))
+  print("Événements:", len(historique.evenements()))
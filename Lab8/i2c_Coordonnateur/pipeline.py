@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+pipeline.py
+Découpler l'acquisition I2C des traitements lents (affichage, stockage,
+envoi vers le nuage, inférence) avec un anneau en mémoire partagée.
+
+Le processus d'acquisition (i2c_coord.main) est le seul écrivain: il ajoute
+des enregistrements de taille fixe (DTYPE_ENREGISTREMENT) dans l'anneau sans
+jamais attendre. Chaque consommateur tourne dans son propre processus et lit
+l'anneau à son rythme avec son propre curseur:
+
+  - un consommateur lent n'a aucun effet sur l'acquisition ni sur les autres;
+  - s'il est dépassé de plus de 'capacite' enregistrements, les plus vieux
+    sont perdus pour lui et comptés dans ses pertes;
+  - son retard (enregistrements écrits mais pas encore lus) et ses pertes
+    sont gardés dans l'en-tête de l'anneau et visibles de tous.
+
+Cohérence sans verrou (un seul écrivain):
+  L'écrivain invalide le numéro de séquence de la case, écrit l'enregistrement
+  puis son numéro et enfin le compteur d'écriture. Le lecteur copie les cases
+  et relit leurs numéros après la copie: une case réécrite pendant la copie
+  n'a plus le numéro attendu et est comptée comme perdue.
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+import os
+import sys
+import time
+import traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from datetime import datetime
+import numpy as np
+import constants as cst
+from agregation_leq import AgregateurLeq
+from indices_bruit import IndicesBruit
+from evenements_bruit import DetecteurEvenements, texte
+from anomalies import DetecteurAnomalies, drapeaux_texte
+from bande_morte import PolitiqueBandeMorte
+from historique import Historique
+
+# Champs transportés par l'anneau (indice dans ce tuple -> colonne 'champ')
+CHAMPS = ('Sample_Num', 'Temperature', 'Humidity', 'Leq',
+          # Agrégats des noeuds depuis la lecture précédente
+          'Temperature_Min', 'Temperature_Max', 'Temperature_Moy',
+          'Humidity_Min', 'Humidity_Max', 'Humidity_Moy',
+          'Leq_Min', 'Leq_Max', 'Leq_Moy')
+
+DTYPE_ENREGISTREMENT = np.dtype([('seq', '<u8'),       # numéro de séquence
+                                 ('temps_ns', '<i8'),  # horodatage (ns)
+                                 ('noeud', 'u1'),      # adresse I2C
+                                 ('champ', 'u1'),      # indice dans CHAMPS
+                                 ('valeur', '<f4'),
+                                 ('duree', '<f4')])    # durée couverte (s): tp du Leq, 0 sinon
+INVALIDE = np.iinfo(np.uint64).max
+
+# En-tête (int64): écrits, capacité, nb. de consommateurs puis, pour chaque
+# consommateur, son curseur et ses pertes.
+TAILLE_ENTETE = 3
+CURSEUR, PERTES = 0, 1
+PERIODE_LECTURE = 0.05       # attente (sec) d'un consommateur sans données
+
+
+class AnneauPartage:
+  '''Tampon circulaire d'enregistrements en mémoire partagée.'''
+  def __init__(self, capacite = 4096, nb_consommateurs = 4, nom = None):
+    '''Créer l'anneau (nom = None) ou s'y attacher (nom d'un anneau existant).
+
+    Arguments:
+    capacite (int) -- nombre d'enregistrements gardés
+    nb_consommateurs (int) -- nombre maximal de curseurs
+    nom (str) -- nom de la mémoire partagée à ouvrir
+    '''
+    if nom is None:
+      taille = 8 * (TAILLE_ENTETE + 2 * nb_consommateurs) + capacite * DTYPE_ENREGISTREMENT.itemsize
+      self._shm = shared_memory.SharedMemory(create = True, size = taille)
+      entete = np.ndarray(TAILLE_ENTETE, dtype = np.int64, buffer = self._shm.buf)
+      entete[:] = (0, capacite, nb_consommateurs)
+    else:
+      self._shm = shared_memory.SharedMemory(name = nom)
+      entete = np.ndarray(TAILLE_ENTETE, dtype = np.int64, buffer = self._shm.buf)
+      capacite, nb_consommateurs = int(entete[1]), int(entete[2])
+    n = TAILLE_ENTETE + 2 * nb_consommateurs
+    self._entete = np.ndarray(n, dtype = np.int64, buffer = self._shm.buf)
+    self._curseurs = self._entete[TAILLE_ENTETE:].reshape((nb_consommateurs, 2))
+    self._cases = np.ndarray(capacite, dtype = DTYPE_ENREGISTREMENT,
+                             buffer = self._shm.buf, offset = 8 * n)
+    if nom is None:
+      self._entete[TAILLE_ENTETE:] = 0
+      self._cases['seq'] = INVALIDE
+    self.capacite = capacite
+    self.nb_consommateurs = nb_consommateurs
+
+  @property
+  def nom(self):
+    return self._shm.name
+
+  @property
+  def ecrits(self):
+    '''Nombre total d'enregistrements écrits.'''
+    return int(self._entete[0])
+
+  def ecrire(self, temps_ns, noeud, champ, valeur, duree = 0.0):
+    '''Ajouter un enregistrement (réservé au processus d'acquisition).
+
+    Arguments:
+    temps_ns (int) -- horodatage de l'échantillon
+    noeud (int) -- adresse I2C du noeud
+    champ (str) -- nom du champ dans CHAMPS
+    valeur (float) -- valeur du champ
+    duree (float) -- durée (s) couverte par la valeur (tp courant du Leq)
+    '''
+    seq = int(self._entete[0])
+    i = seq % self.capacite
+    self._cases['seq'][i] = INVALIDE
+    self._cases[i] = (INVALIDE, temps_ns, noeud, CHAMPS.index(champ), valeur, duree)
+    self._cases['seq'][i] = seq
+    self._entete[0] = seq + 1
+
+  def curseur(self, indice):
+    '''Retourner le curseur du consommateur numéro indice.'''
+    if not 0 <= indice < self.nb_consommateurs:
+      raise ValueError(F"<curseur> Indice de consommateur invalide: {indice}.")
+    return Curseur(self, indice)
+
+  def etat(self):
+    '''Retourner [(retard, pertes)] de chaque consommateur.'''
+    ecrits = self.ecrits
+    return [(ecrits - int(c), int(p)) for c, p in self._curseurs]
+
+  def fermer(self):
+    self._entete = self._curseurs = self._cases = None
+    self._shm.close()
+
+  def detruire(self):
+    '''Fermer et libérer la mémoire partagée (processus créateur seulement).'''
+    self.fermer()
+    self._shm.unlink()
+
+
+class Curseur:
+  '''Position de lecture d'un consommateur dans l'anneau.'''
+  def __init__(self, anneau, indice):
+    self.anneau = anneau
+    self._etat = anneau._curseurs[indice]   # vue: [curseur, pertes]
+
+  @property
+  def retard(self):
+    return self.anneau.ecrits - int(self._etat[CURSEUR])
+
+  @property
+  def pertes(self):
+    return int(self._etat[PERTES])
+
+  def lire(self, nb_max = 1024):
+    '''Retourner (copie) les enregistrements pas encore lus, au plus nb_max.'''
+    anneau = self.anneau
+    ecrits = anneau.ecrits
+    debut = int(self._etat[CURSEUR])
+    if ecrits - debut > anneau.capacite:
+      # Dépassé par l'écrivain: les plus vieux enregistrements sont perdus
+      self._etat[PERTES] += ecrits - anneau.capacite - debut
+      debut = ecrits - anneau.capacite
+    n = min(ecrits - debut, nb_max)
+    attendus = np.arange(debut, debut + n, dtype = np.uint64)
+    indices = attendus % anneau.capacite
+    copie = anneau._cases[indices]
+    # Relire les numéros: une case réécrite pendant la copie est perdue
+    valides = (copie['seq'] == attendus) & (anneau._cases['seq'][indices] == attendus)
+    self._etat[PERTES] += n - np.count_nonzero(valides)
+    self._etat[CURSEUR] = debut + n
+    return copie[valides]
+
+
+# ------------------------------------------------------
+# Consommateurs
+# ------------------------------------------------------
+class ConsommateurConsole:
+  '''Afficher les échantillons, les Leq glissants et l'état de l'anneau.'''
+  def __init__(self, anneau, noms = (), periode_etat = 60):
+    self.anneau = anneau
+    self.noms = noms
+    self.agregateur = AgregateurLeq()
+    # L10, L50 et L90 des dernières 24 h (un digest par heure, 7 jours gardés)
+    self.indices = IndicesBruit(retention = 7 * 24)
+    self.periode_etat = periode_etat
+    self._dernier_etat = time.monotonic()
+
+  def traiter(self, enregistrements):
+    for e in enregistrements:
+      champ = CHAMPS[e['champ']]
+      temps = datetime.fromtimestamp(int(e['temps_ns']) / 1e9).strftime('%Y-%m-%d %H:%M:%S')
+      print(F"<{temps}> Noeud: {hex(e['noeud'])}, {champ}: {e['valeur']:.2f}")
+      if champ == 'Leq' and e['valeur'] > 0:
+        self.agregateur.ajouter(int(e['temps_ns']), float(e['valeur']), float(e['duree']))
+        print("Leq glissants:", ", ".join(F"{nom}: {v:.2f}" for nom, v
+              in self.agregateur.leq_fenetres().items() if v is not None))
+        lden = self.agregateur.lden()
+        if lden is not None:
+          print(F"Lden (24 h): {lden:.2f}")
+        self.indices.ajouter(int(e['noeud']), int(e['temps_ns']), float(e['valeur']))
+        indices = self.indices.indices(int(e['noeud']), int(e['temps_ns']) - 86400 * 10**9)
+        print("Indices (24 h):", ", ".join(F"{nom}: {v:.2f}" for nom, v in indices.items()))
+    if time.monotonic() - self._dernier_etat >= self.periode_etat:
+      self._dernier_etat = time.monotonic()
+      for k, (retard, pertes) in enumerate(self.anneau.etat()):
+        nom = self.noms[k] if k < len(self.noms) else k
+        print(F"[pipeline] {nom}: retard {retard}, pertes {pertes}")
+    sys.stdout.flush()
+
+
+def _detecteur():
+  '''Détecteur des événements bruyants selon constants.py.'''
+  return DetecteurEvenements(cst.EVENEMENTS_SEUIL, cst.EVENEMENTS_HYSTERESIS,
+                             cst.EVENEMENTS_DUREE_MIN)
+
+
+class ConsommateurStockage:
+  '''Ajouter les enregistrements et les événements bruyants à l'historique
+  (voir historique.py).'''
+  def __init__(self, anneau, racine = None):
+    self.historique = Historique(racine or cst.REPERTOIRE_HISTORIQUE)
+    self.detecteur = _detecteur()
+
+  def traiter(self, enregistrements):
+    for e in enregistrements:
+      champ = CHAMPS[e['champ']]
+      self.historique.ajouter(int(e['noeud']), champ,
+                              int(e['temps_ns']), float(e['valeur']))
+      if champ == 'Leq' and e['valeur'] > 0:
+        evenement = self.detecteur.ajouter(int(e['noeud']), int(e['temps_ns']),
+                                           float(e['valeur']), float(e['duree']))
+        if evenement is not None:
+          self.historique.ajouter_evenement(evenement['debut_ns'], hex(evenement['noeud']),
+                                            texte(evenement))
+
+
+class ConsommateurEnvoi:
+  '''Envoyer les dernières valeurs à ThingSpeak (bande morte, délai min.)
+  ou seulement les événements bruyants (evenements = True).'''
+  def __init__(self, anneau, cle = None, evenements = None):
+    import requests      # seulement requis par ce consommateur
+    self.requests = requests
+    self.cle = cle or cst.THINGSPEAK_CLE
+    self.url = cst.THINGSPEAK_URL
+    self.champs = cst.THINGSPEAK_CHAMPS
+    self.delai = cst.THINGSPEAK_DELAI
+    self.politique = PolitiqueBandeMorte(cst.THINGSPEAK_BANDE_MORTE, cst.SILENCE_MAX)
+    self.valeurs = {}
+    self._dernier_envoi = 0.0
+    if evenements is None:
+      evenements = cst.THINGSPEAK_EVENEMENTS
+    self.detecteur = _detecteur() if evenements else None
+    self.evenements = []      # événements pas encore envoyés
+
+  def traiter(self, enregistrements):
+    for e in enregistrements:
+      champ = CHAMPS[e['champ']]
+      if self.detecteur is not None:
+        if champ == 'Leq' and e['valeur'] > 0:
+          evenement = self.detecteur.ajouter(int(e['noeud']), int(e['temps_ns']),
+                                             float(e['valeur']), float(e['duree']))
+          if evenement is not None:
+            self.evenements.append(evenement)
+      elif champ in self.champs:
+        self.valeurs[champ] = (float(e['valeur']), int(e['temps_ns']))
+    if not self.cle or time.monotonic() - self._dernier_envoi < self.delai:
+      return
+    if self.detecteur is not None:
+      # Un événement par envoi; les suivants attendent le délai
+      if not self.evenements:
+        return
+      evenement = self.evenements.pop(0)
+      params = {c : round(evenement[cle], 2) for cle, c in cst.THINGSPEAK_CHAMPS_EVENEMENTS.items()}
+      params['status'] = F"{hex(evenement['noeud'])} {texte(evenement)}"
+    else:
+      envoyes = {c : (v, t) for c, (v, t) in self.valeurs.items()
+                 if self.politique.a_transmettre('thingspeak', c, v, t)}
+      params = {self.champs[c] : v for c, (v, t) in envoyes.items()}
+    if params:
+      self._dernier_envoi = time.monotonic()
+      try:
+        resp = self.requests.get(self.url, timeout = (10, 10), params = {'api_key' : self.cle, **params})
+        # ThingSpeak répond 200 avec le corps '0' quand il refuse la mise à
+        # jour (p. ex. délai entre deux envois non respecté)
+        recu = resp.status_code == 200 and resp.text.strip() != '0'
+        if not recu:
+          print(F"[envoi] Mise à jour refusée par ThingSpeak: {resp.status_code} {resp.text.strip()!r}")
+      except self.requests.RequestException as e:
+        print(F"[envoi] Erreur de communication: {e}")
+        recu = False
+      # Seul ce que ThingSpeak a reçu compte comme envoyé: les valeurs
+      # deviennent les dernières envoyées, un événement non reçu est repris
+      if self.detecteur is not None:
+        if not recu:
+          self.evenements.insert(0, evenement)
+      elif recu:
+        for c, (v, t) in envoyes.items():
+          self.politique.confirmer('thingspeak', c, v, t)
+
+
+class ConsommateurInference:
+  '''Prédire les prochains échantillons avec le réseau LSTM (Lab12/LSTM).
+
+  Les lignes suivent la cadence des noeuds qui envoient le signal 'cadence'
+  (Leq, le plus lent, comme les lignes à pas fixe de l'apprentissage): une
+  ligne (leur dernière valeur du signal et les dernières valeurs des autres
+  signaux) par échantillon de ces noeuds, dans la fenêtre de chaque noeud.
+  Sample_Num est le dernier champ écrit d'un échantillon (voir i2c_coord.py):
+  il termine la ligne. Les lignes d'un lot sont prédites en un seul appel au
+  réseau.'''
+  def __init__(self, anneau, repertoire = None, cadence = 'Leq'):
+    # Le prédicteur (et TensorFlow) n'est chargé que par ce consommateur
+    repertoire = repertoire or cst.REPERTOIRE_LSTM
+    sys.path.insert(0, repertoire)
+    from predicteur_en_ligne import PredicteurEnLigne, SIGNAUX
+    self.signaux = SIGNAUX
+    self.cadence = cadence
+    self.predicteur = PredicteurEnLigne.charger(
+      os.path.join(repertoire, cst.FICHIER_RESEAU_LSTM),
+      os.path.join(repertoire, cst.FICHIER_NORMALISATION_LSTM))
+    self.valeurs = {}             # signal -> dernière valeur reçue
+    self._cadences = {}           # noeud -> sa dernière valeur du signal 'cadence'
+
+  def traiter(self, enregistrements):
+    lignes = {}
+    for e in enregistrements:
+      champ, noeud = CHAMPS[e['champ']], int(e['noeud'])
+      if champ == self.cadence:
+        self._cadences[noeud] = float(e['valeur'])
+      elif champ in self.signaux:
+        self.valeurs[champ] = float(e['valeur'])
+      elif champ == 'Sample_Num' and noeud in self._cadences:
+        valeurs = {**self.valeurs, self.cadence : self._cadences[noeud]}
+        if len(valeurs) == len(self.signaux):
+          # Deux échantillons du noeud dans le lot: garder leur ordre
+          if noeud in lignes:
+            self._predire({noeud : lignes.pop(noeud)})
+          lignes[noeud] = np.array([valeurs[s] for s in self.signaux])
+    if lignes:
+      self._predire(lignes)
+
+  def _predire(self, lignes):
+    for noeud, prediction in self.predicteur.mettre_a_jour_lot(lignes).items():
+      print(F"[inférence] {hex(noeud)}", ", ".join(F"{s}: {v:.2f}" for s, v
+            in zip(self.signaux, prediction[0])))
+
+
+class ConsommateurAnomalies:
+  '''Signaler les valeurs aberrantes, les capteurs figés et les défauts
+  (voir anomalies.py).'''
+  NON_SURVEILLE = -1
+  INCONNU = -2
+
+  def __init__(self, anneau, parametres = None):
+    self.parametres = parametres or cst.ANOMALIES_CHAMPS
+    self.detecteur = DetecteurAnomalies(cst.ANOMALIES_ALPHA, cst.ANOMALIES_SEUIL)
+    # Indice du signal de chaque (noeud, champ): noeud x 256 + indice du champ
+    self._table = np.full(256 * 256, self.INCONNU, dtype = np.intp)
+
+  def _indices(self, cles):
+    '''Indices des signaux (les nouveaux sont ajoutés au détecteur).'''
+    for cle in np.unique(cles[self._table[cles] == self.INCONNU]).tolist():
+      noeud, champ = divmod(cle, 256)
+      parametres = self.parametres.get(CHAMPS[champ].split('_')[0])
+      self._table[cle] = self.NON_SURVEILLE if parametres is None else \
+        self.detecteur.signal(noeud, CHAMPS[champ], *parametres)
+    return self._table[cles]
+
+  def traiter(self, enregistrements):
+    cles = enregistrements['noeud'].astype(np.intp) * 256 + enregistrements['champ']
+    indices = self._indices(cles)
+    garder = indices != self.NON_SURVEILLE
+    e, indices = enregistrements[garder], indices[garder]
+    # Une valeur par signal et par mise à jour: rang de chaque valeur parmi
+    # celles de son signal dans le lot (presque toujours 0)
+    ordre = np.argsort(indices, kind = 'stable')
+    tries = indices[ordre]
+    debuts = np.flatnonzero(np.r_[True, tries[1:] != tries[:-1]])
+    rangs = np.empty(len(e), dtype = np.intp)
+    rangs[ordre] = np.arange(len(e)) - np.repeat(debuts, np.diff(np.r_[debuts, len(e)]))
+    for rang in range(int(rangs.max()) + 1 if len(e) else 0):
+      choix = np.flatnonzero(rangs == rang)
+      drapeaux = self.detecteur.mettre_a_jour(indices[choix], e['temps_ns'][choix],
+                                              e['valeur'][choix])
+      for k in np.flatnonzero(drapeaux).tolist():
+        r = e[choix[k]]
+        temps = datetime.fromtimestamp(int(r['temps_ns']) / 1e9).strftime('%Y-%m-%d %H:%M:%S')
+        print(F"[anomalies] <{temps}> Noeud: {hex(r['noeud'])}, {CHAMPS[r['champ']]}: "
+              F"{r['valeur']:.2f} ({drapeaux_texte(drapeaux[k])})")
+    sys.stdout.flush()
+
+
+# Consommateurs disponibles
+CONSOMMATEURS = {'console' : ConsommateurConsole,
+                 'stockage' : ConsommateurStockage,
+                 'envoi' : ConsommateurEnvoi,
+                 'inference' : ConsommateurInference,
+                 'anomalies' : ConsommateurAnomalies}
+
+
+def _executer(nom_anneau, indice, classe, arret, parametres):
+  '''Boucle d'un processus consommateur.'''
+  anneau = AnneauPartage(nom = nom_anneau)
+  curseur = anneau.curseur(indice)
+  consommateur = classe(anneau, **parametres)
+  try:
+    # Après la demande d'arrêt, finir de lire ce qui reste dans l'anneau
+    while True:
+      enregistrements = curseur.lire()
+      if len(enregistrements):
+        # Une erreur dans un lot ne doit pas arrêter le consommateur: elle
+        # est affichée et le lot est sauté
+        try:
+          consommateur.traiter(enregistrements)
+        except Exception:
+          print(F"[{mp.current_process().name}] Erreur, lot de "
+                F"{len(enregistrements)} enregistrement(s) sauté:")
+          traceback.print_exc()
+      elif arret.is_set():
+        break
+      else:
+        time.sleep(PERIODE_LECTURE)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    anneau.fermer()
+
+
+def demarrer(anneau, noms, parametres = None, consommateurs = CONSOMMATEURS):
+  '''Démarrer un processus par consommateur. Le consommateur noms[k] lit
+  l'anneau avec le curseur k.
+
+  Arguments:
+  anneau (AnneauPartage) -- anneau créé par le processus d'acquisition
+  noms (list) -- noms des consommateurs (clés de consommateurs)
+  parametres (dict) -- nom -> arguments supplémentaires du consommateur
+  consommateurs (dict) -- nom -> classe du consommateur
+
+  Retour (tuple): (processus, événement d'arrêt)
+  '''
+  if len(noms) > anneau.nb_consommateurs:
+    raise ValueError("<demarrer> Plus de consommateurs que de curseurs.")
+  contexte = mp.get_context('spawn')
+  arret = contexte.Event()
+  processus = []
+  try:
+    for k, nom in enumerate(noms):
+      p = contexte.Process(target = _executer, name = nom, daemon = True,
+                           args = (anneau.nom, k, consommateurs[nom], arret,
+                                   (parametres or {}).get(nom, {})))
+      p.start()
+      processus.append(p)
+  except BaseException:
+    # Nom inconnu ou démarrage impossible: arrêter ceux déjà démarrés
+    arreter(processus, arret)
+    raise
+  return processus, arret
+
+
+def arreter(processus, arret, delai = 5.0):
+  '''Demander l'arrêt des consommateurs et attendre leur fin.'''
+  arret.set()
+  for p in processus:
+    p.join(delai)
+    if p.is_alive():
+      p.terminate()
+
+
+# ------------------------------------------------------
+# Démonstration: un écrivain rapide et un consommateur lent
+# ------------------------------------------------------
+class _ConsommateurLent:
+  def __init__(self, anneau):
+    self.nb = 0
+
+  def traiter(self, enregistrements):
+    self.nb += len(enregistrements)
+    time.sleep(0.2)
+
+
+if __name__ == '__main__':
+  anneau = AnneauPartage(capacite = 256, nb_consommateurs = 1)
+  processus, arret = demarrer(anneau, ['lent'], consommateurs = {'lent' : _ConsommateurLent})
+  debut = time.perf_counter()
+  for k in range(20000):
+    anneau.ecrire(time.time_ns(), 0x45, 'Leq', 50.0 + k % 10, cst.LEQ_TP_SEC)
+    if k % 100 == 0:
+      time.sleep(0.001)
+  duree = time.perf_counter() - debut
+  time.sleep(0.5)
+  print(F"{anneau.ecrits} écritures en {duree:.3f} s; (retard, pertes) = {anneau.etat()[0]}")
+  arreter(processus, arret)
+  anneau.detruire()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+ponderation_acoustique.py
+Niveaux pondérés A ou C (LAeq, LCeq) et niveaux par bande d'octave ou de
+tiers d'octave à partir des échantillons bruts de l'ADC du noeud Leq (voir
+capture_adc.py).
+
+Le noeud calcule un niveau non pondéré (Li = dBV + P - M - G). Ici le signal
+(en volts) passe d'abord dans un filtre:
+  - pondération A ou C (IEC 61672): pôles analogiques à 20,6 Hz, 107,7 Hz,
+    737,9 Hz et 12194 Hz, gain de 0 dB à 1 kHz, numérisés pour la fréquence
+    d'échantillonnage du noeud (voir sos_ponderation());
+  - bande d'octave (1/1) ou de tiers d'octave (1/3), fréquences centrales
+    en base 10 (IEC 61260), filtre de Butterworth passe-bande d'ordre 3.
+Les coefficients sont calculés une seule fois par fréquence
+d'échantillonnage (sections d'ordre 2, SOS).
+
+Les blocs sont ceux de Calculateur_Leq (calculateur_leq.h):
+  fs = 1000 / ts                     (ts en ms, m_ts)
+  Li = 10 log10(moyenne(y^2)) + P - M - G     par bloc de nbSample (m_nbSample)
+  Leq = moyenne énergétique des Li            par bloc de nbLi (m_nbLi)
+
+Seules les bandes sous 0,45 fs sont gardées: au Ts par défaut du noeud
+(62 ms, fs ~ 16 Hz) il n'y en a aucune et la pondération A retire presque
+tout le signal. Ces calculs demandent le flux à Ts = 1 ms: le noeud Leq
+n'accepte un Ts sous 5 ms (MIN_TS_LARGE) que pendant le flux, il faut donc
+envoyer send_flux() puis send_Ts_large(bus, 0x45, 1).
+
+Limites du flux:
+  - Le noeud échantillonne avec millis(), qui avance de 1,024 ms en moyenne:
+    fs ~ 976 Hz. Passer ts = 1.024 pour des fréquences exactes.
+  - À fs ~ 1 kHz, seules les bandes jusqu'à 250 Hz (octaves) sont gardées
+    et la pondération n'est pas évaluée au-delà de ~440 Hz. Ce n'est pas un
+    sonomètre de classe 1 ou 2 (20 Hz - 20 kHz).
+  - Le microphone et l'ADC de l'Arduino ne sont pas étalonnés en fréquence.
+
+Le signal est traité par tranches (état des filtres conservé entre les
+tranches): la mémoire reste bornée pour une journée d'échantillons ou un
+np.memmap.
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+from functools import lru_cache
+import numpy as np
+from scipy import signal
+import calculateur_leq as cl
+
+# Pôles de la pondération fréquentielle (Hz, IEC 61672-1)
+F1, F2, F3, F4 = 20.598997, 107.65265, 737.86223, 12194.217
+F_REF = 1000.0               # fréquence de normalisation (0 dB)
+ORDRE_BANDE = 3              # ordre des passe-bandes de Butterworth
+F_MAX_RELATIVE = 0.45        # bandes gardées: f haute < F_MAX_RELATIVE x fs
+ECHANTILLONS_PAR_TRANCHE = 1 << 20
+
+
+def _ponderation_analogique(genre):
+  '''Zéros, pôles (Hz) et gain de la pondération analogique (0 dB à F_REF).'''
+  if genre not in ('A', 'C'):
+    raise ValueError(F"<sos_ponderation> Pondération inconnue: {genre}.")
+  nb_zeros = 4 if genre == 'A' else 2
+  poles = [F1, F1, F4, F4] + ([F2, F3] if genre == 'A' else [])
+  zeros_s, poles_s = np.zeros(nb_zeros), -2 * np.pi * np.array(poles)
+  _, h = signal.freqs_zpk(zeros_s, poles_s, 1.0, worN = [2 * np.pi * F_REF])
+  return zeros_s, poles_s, 1.0 / abs(h[0])
+
+
+@lru_cache(maxsize = None)
+def sos_ponderation(genre, fs):
+  '''Coefficients (SOS) du filtre de pondération 'A' ou 'C' à fs Hz.
+
+  Deux numérisations sont calculées et la plus fidèle au filtre analogique
+  (écart max. en dB de 20 Hz à F_MAX_RELATIVE x fs) est gardée:
+    - transformation bilinéaire: exacte aux fs audio (44,1 ou 48 kHz);
+    - pôles sous fs/4 par la bilinéaire avec précompensation, les autres
+      par z = exp(-2 pi f / fs), gain ajusté dans la bande: aux fs basses
+      (1 à 8 kHz), la bilinéaire comprime trop l'axe des fréquences (plus
+      de 2 dB d'écart à 250 Hz pour fs = 1 kHz).
+  '''
+  zeros_s, poles_s, k_s = _ponderation_analogique(genre)
+  f = np.geomspace(20.0, F_MAX_RELATIVE * fs, 64)
+  _, h_ref = signal.freqs_zpk(zeros_s, poles_s, k_s, worN = 2 * np.pi * f)
+
+  candidats = [signal.zpk2sos(*signal.bilinear_zpk(zeros_s, poles_s, k_s, fs))]
+  poles_z = []
+  for p in -poles_s / (2 * np.pi):
+    if p < fs / 4:
+      a = 2 * fs * np.tan(np.pi * p / fs)
+      poles_z.append((2 * fs - a) / (2 * fs + a))
+    else:
+      poles_z.append(np.exp(-2 * np.pi * p / fs))
+  sos = signal.zpk2sos(np.ones(len(zeros_s)), poles_z, 1.0)
+  f_gain = min(F_REF, fs / 10)
+  _, h = signal.sosfreqz(sos, worN = [f_gain], fs = fs)
+  _, h_gain = signal.freqs_zpk(zeros_s, poles_s, k_s, worN = [2 * np.pi * f_gain])
+  sos[0, :3] *= abs(h_gain[0]) / abs(h[0])
+  candidats.append(sos)
+
+  def ecart(sos):
+    _, h = signal.sosfreqz(sos, worN = f, fs = fs)
+    return np.max(np.abs(20 * np.log10(np.abs(h) / np.abs(h_ref))))
+  return min(candidats, key = ecart)
+
+
+def bandes(fs, fraction = 1):
+  '''Bandes d'octave (fraction = 1) ou de tiers d'octave (3) sous
+  F_MAX_RELATIVE x fs.
+
+  Retour (list): [(fréquence centrale, fréquence basse, fréquence haute)]
+  '''
+  g = 10.0 ** (3.0 / 10.0)                   # rapport d'octave en base 10
+  resultat = []
+  # Bandes centrées sur 1 kHz x g^(k / fraction), de ~16 Hz à ~20 kHz
+  for k in range(-6 * fraction, 4 * fraction + 1):
+    fm = F_REF * g ** (k / fraction)
+    f_basse, f_haute = fm * g ** (-0.5 / fraction), fm * g ** (0.5 / fraction)
+    if f_haute < F_MAX_RELATIVE * fs:
+      resultat.append((fm, f_basse, f_haute))
+  return resultat
+
+
+@lru_cache(maxsize = None)
+def sos_bandes(fs, fraction = 1):
+  '''Coefficients (SOS) des passe-bandes de bandes(fs, fraction).'''
+  return tuple(signal.butter(ORDRE_BANDE, (f_basse, f_haute), btype = 'bandpass',
+                             fs = fs, output = 'sos')
+               for _, f_basse, f_haute in bandes(fs, fraction))
+
+
+def _niveaux_filtres(adc, filtres, nb_sample, p = cl.P_SPL, m = cl.M_DBV, g = cl.G_DBV,
+                     v_max = cl.V_MAX, adc_max = cl.ADC_MAX):
+  '''Niveaux (dB SPL) de chaque bloc de nb_sample échantillons après chaque
+  filtre.
+
+  Retour (array): niveaux, forme (nb de blocs, nb de filtres)
+  '''
+  adc = np.asarray(adc)
+  nb_blocs = adc.shape[0] // nb_sample
+  n = nb_blocs * nb_sample
+  carre_moyen = np.empty((nb_blocs, len(filtres)), dtype = np.float64)
+  etats = [np.zeros((sos.shape[0], 2)) for sos in filtres]
+  # Tranches d'un nombre entier de blocs
+  tranche = max(1, ECHANTILLONS_PAR_TRANCHE // nb_sample) * nb_sample
+  for debut in range(0, n, tranche):
+    v = adc[debut : min(n, debut + tranche)].astype(np.float64)
+    v *= v_max / adc_max
+    v -= v_max / 2.0
+    b0, b1 = debut // nb_sample, (debut + v.shape[0]) // nb_sample
+    for j, sos in enumerate(filtres):
+      y, etats[j] = signal.sosfilt(sos, v, zi = etats[j])
+      y = y.reshape((-1, nb_sample))
+      carre_moyen[b0:b1, j] = np.einsum('ij,ij->i', y, y) / nb_sample
+  with np.errstate(divide = 'ignore'):
+    return 10.0 * np.log10(carre_moyen) + (p - m - g)
+
+
+def niveaux_ponderes(adc, ts = 1, nb_sample = cl.NB_SAMPLE, genre = 'A', **kwargs):
+  '''Niveaux pondérés (LAi ou LCi) de chaque bloc de nb_sample échantillons.
+
+  Arguments:
+  adc (array) -- échantillons bruts de l'ADC
+  ts (float) -- période d'échantillonnage du noeud (ms)
+  nb_sample (int) -- échantillons par bloc (m_nbSample)
+  genre (str) -- 'A' ou 'C'
+
+  Retour (array): un niveau par bloc
+  '''
+  return _niveaux_filtres(adc, [sos_ponderation(genre, 1000.0 / ts)], nb_sample, **kwargs)[:, 0]
+
+
+def niveaux_bandes(adc, ts = 1, nb_sample = cl.NB_SAMPLE, fraction = 1, **kwargs):
+  '''Niveaux par bande de chaque bloc de nb_sample échantillons.
+
+  Retour (tuple): (fréquences centrales, niveaux (nb de blocs, nb de bandes))
+  '''
+  fs = 1000.0 / ts
+  centres = np.array([fm for fm, _, _ in bandes(fs, fraction)])
+  return centres, _niveaux_filtres(adc, sos_bandes(fs, fraction), nb_sample, **kwargs)
+
+
+def calculer_laeq(adc, ts = 1, nb_sample = cl.NB_SAMPLE, nb_li = cl.NB_LI, genre = 'A', **kwargs):
+  '''Chaîne ADC -> LAi -> LAeq (ou LC avec genre = 'C').
+
+  Retour (tuple): (li, leq)
+  '''
+  li = niveaux_ponderes(adc, ts, nb_sample, genre, **kwargs)
+  return li, cl.niveaux_leq(li, nb_li)
+
+
+def calculer_leq_bandes(adc, ts = 1, nb_sample = cl.NB_SAMPLE, nb_li = cl.NB_LI, fraction = 1, **kwargs):
+  '''Leq de chaque bande par bloc de nb_li blocs.
+
+  Retour (tuple): (fréquences centrales, leq (nb de Leq, nb de bandes))
+  '''
+  centres, li = niveaux_bandes(adc, ts, nb_sample, fraction, **kwargs)
+  nb_leq = li.shape[0] // nb_li
+  leq = cl.moyenne_energetique(li[:nb_leq * nb_li].reshape((nb_leq, nb_li, -1)), axis = 1)
+  return centres, leq
+
+
+# ------------------------------------------------------
+# Vérification et mesure du temps de calcul
+# ------------------------------------------------------
+if __name__ == '__main__':
+  import time
+  fs = 1000.0
+  # Gain de la pondération (IEC 61672) aux fs du flux et audio
+  for genre, f, attendu in (('A', 31.5, -39.4), ('A', 100.0, -19.1), ('A', 250.0, -8.6),
+                            ('C', 31.5, -3.0)):
+    gains = []
+    for fe in (fs, 48000.0):
+      _, h = signal.sosfreqz(sos_ponderation(genre, fe), worN = [f], fs = fe)
+      gains.append(F"{20 * np.log10(abs(h[0])):.1f}")
+    print(F"Pondération {genre} à {f} Hz: {' / '.join(gains)} dB à 1 / 48 kHz (IEC: {attendu})")
+
+  # Sinus de 250 Hz: LAeq ~ Leq - 8,6 dB, l'énergie est dans la bande de 250 Hz
+  rng = np.random.default_rng(788)
+  t = np.arange(cl.NB_SAMPLE * cl.NB_LI * 4) / fs
+  adc = np.round(512 + 100 * np.sin(2 * np.pi * 250 * t) + rng.normal(0, 2, t.shape)).astype(np.uint16)
+  _, leq = cl.calculer_leq(adc)
+  _, laeq = calculer_laeq(adc, ts = 1)
+  centres, leq_bandes = calculer_leq_bandes(adc, ts = 1)
+  print(F"Leq: {leq[0]:.1f} dB, LAeq: {laeq[0]:.1f} dB")
+  print("Leq par octave:", {round(fm): round(float(l), 1) for fm, l in zip(centres, leq_bandes[0])})
+
+  # Une journée à fs = 1 kHz (flux du noeud à Ts = 1 ms)
+  adc = np.resize(adc, 86400 * int(fs))
+  for nom, calcul in (('LAeq', lambda: calculer_laeq(adc, ts = 1)),
+                      ('octaves', lambda: calculer_leq_bandes(adc, ts = 1))):
+    debut = time.perf_counter()
+    calcul()
+    print(F"{nom}: {adc.shape[0]} échantillons traités en {time.perf_counter() - debut:.2f} s")
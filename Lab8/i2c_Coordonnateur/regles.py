@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+regles.py
+Moteur de règles pour les commandes envoyées aux noeuds.
+
+Une règle est un dictionnaire (voir REGLES dans constants.py):
+
+  {'nom' : 'reset',                 # nom affiché
+   'noeud' : 0x44,                  # adresse I2C ou 'tous'
+   'si' : ('Sample_Num', '>=', 15), # condition
+   'action' : ('reset',),           # action et ses arguments
+   'front' : False,                 # True: seulement quand la condition
+                                    #       devient vraie
+   'delai' : 0}                     # délai min. (sec) entre deux actions
+
+Conditions (champ: 'Sample_Num', 'Temperature', 'Humidity', 'Leq', ...):
+
+  (champ, op, seuil)                      valeur op seuil
+  (champ, 'entre', bas, haut)             bas <= valeur <= haut
+  (champ, 'pente', op, seuil)             variation par seconde depuis
+                                          l'échantillon précédent
+  (champ, 'moyenne'|'min'|'max', fenetre, op, seuil)
+                                          agrégat sur les 'fenetre' dernières
+                                          secondes
+  ('et', cond, cond, ...), ('ou', cond, ...), ('non', cond)
+
+  op: '<', '<=', '>', '>=', '==', '!='
+
+Actions: ('pause', sec), ('ts', ts), ('reset',), ('stop',), ('go',) et
+('alerte', texte). Le programme principal associe les actions aux fonctions
+send_*() (voir i2c_coord.py).
+
+Les règles sont compilées une seule fois en fermetures (closures). Le moteur
+ne garde que l'état nécessaire aux règles (dernière valeur, précédente,
+fenêtres) et, à chaque échantillon, n'évalue que les règles qui dépendent de
+ce champ. Les fenêtres tiennent leur somme et leurs min/max (files
+monotones) à jour en O(1) amorti.
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+import operator
+from collections import deque
+
+NS_PAR_SEC = 1_000_000_000
+
+OPERATEURS = {'<' : operator.lt, '<=' : operator.le, '>' : operator.gt,
+              '>=' : operator.ge, '==' : operator.eq, '!=' : operator.ne}
+AGREGATS = ('moyenne', 'min', 'max')
+ACTIONS = ('pause', 'ts', 'reset', 'stop', 'go', 'alerte')
+
+
+class _Fenetre:
+  '''Moyenne, min et max des valeurs des 'duree' dernières secondes.'''
+  def __init__(self, duree_sec):
+    self.duree_ns = int(duree_sec * NS_PAR_SEC)
+    self.valeurs = deque()          # (t, v)
+    self.somme = 0.0
+    self.minimums = deque()         # (t, v), v croissants
+    self.maximums = deque()         # (t, v), v décroissants
+
+  def ajouter(self, t_ns, v):
+    self.valeurs.append((t_ns, v))
+    self.somme += v
+    while self.minimums and self.minimums[-1][1] >= v:
+      self.minimums.pop()
+    self.minimums.append((t_ns, v))
+    while self.maximums and self.maximums[-1][1] <= v:
+      self.maximums.pop()
+    self.maximums.append((t_ns, v))
+    limite = t_ns - self.duree_ns
+    while self.valeurs[0][0] < limite:
+      self.somme -= self.valeurs.popleft()[1]
+    while self.minimums[0][0] < limite:
+      self.minimums.popleft()
+    while self.maximums[0][0] < limite:
+      self.maximums.popleft()
+
+  def moyenne(self):
+    return self.somme / len(self.valeurs)
+
+  def min(self):
+    return self.minimums[0][1]
+
+  def max(self):
+    return self.maximums[0][1]
+
+
+class _Serie:
+  '''État d'un champ d'un noeud: valeurs courante et précédente, fenêtres.'''
+  def __init__(self):
+    self.t = self.v = None
+    self.t_prec = self.v_prec = None
+    self.fenetres = {}              # durée (sec) -> _Fenetre
+
+  def ajouter(self, t_ns, v):
+    self.t_prec, self.v_prec = self.t, self.v
+    self.t, self.v = t_ns, v
+    for fenetre in self.fenetres.values():
+      fenetre.ajouter(t_ns, v)
+
+  def pente(self):
+    '''Variation par seconde depuis l'échantillon précédent (ou None).'''
+    if self.t_prec is None or self.t == self.t_prec:
+      return None
+    return (self.v - self.v_prec) * NS_PAR_SEC / (self.t - self.t_prec)
+
+
+class MoteurRegles:
+  '''Évaluer des règles compilées sur le flux des échantillons.'''
+  def __init__(self, regles, noeuds):
+    '''Arguments:
+    regles (iterable) -- règles (dictionnaires, voir l'en-tête du module)
+    noeuds (iterable) -- adresses des noeuds ('tous' désigne ces noeuds)
+
+    Exceptions possibles: ValueError (règle invalide)
+    '''
+    self._series = {}               # (noeud, champ) -> _Serie
+    self._regles = {}               # (noeud, champ) -> [règles compilées]
+    for regle in regles:
+      cibles = noeuds if regle.get('noeud', 'tous') == 'tous' else (regle['noeud'],)
+      for noeud in cibles:
+        self._compiler(regle, noeud)
+
+  def _serie(self, noeud, champ):
+    return self._series.setdefault((noeud, champ), _Serie())
+
+  def _condition(self, cond, noeud, champs):
+    '''Compiler une condition en fonction sans argument -> bool.
+    Les champs utilisés sont ajoutés à l'ensemble champs.'''
+    tete = cond[0]
+    if tete in ('et', 'ou'):
+      parties = [self._condition(c, noeud, champs) for c in cond[1:]]
+      if tete == 'et':
+        return lambda: all(p() for p in parties)
+      return lambda: any(p() for p in parties)
+    if tete == 'non':
+      partie = self._condition(cond[1], noeud, champs)
+      return lambda: not partie()
+
+    champs.add(tete)
+    serie = self._serie(noeud, tete)
+    genre = cond[1]
+    if genre == 'entre':
+      bas, haut = cond[2], cond[3]
+      return lambda: serie.v is not None and bas <= serie.v <= haut
+    if genre in OPERATEURS:
+      op, seuil = OPERATEURS[genre], cond[2]
+      return lambda: serie.v is not None and op(serie.v, seuil)
+    if genre == 'pente':
+      op, seuil = OPERATEURS[cond[2]], cond[3]
+      def pente():
+        p = serie.pente()
+        return p is not None and op(p, seuil)
+      return pente
+    if genre in AGREGATS:
+      duree, op, seuil = cond[2], OPERATEURS[cond[3]], cond[4]
+      fenetre = serie.fenetres.setdefault(duree, _Fenetre(duree))
+      mesure = getattr(fenetre, genre)
+      return lambda: len(fenetre.valeurs) > 0 and op(mesure(), seuil)
+    raise ValueError(F"<MoteurRegles> Condition invalide: {cond}.")
+
+  def _compiler(self, regle, noeud):
+    if regle['action'][0] not in ACTIONS:
+      raise ValueError(F"<MoteurRegles> Action invalide: {regle['action']}.")
+    champs = set()
+    try:
+      condition = self._condition(regle['si'], noeud, champs)
+    except (IndexError, KeyError, TypeError):
+      raise ValueError(F"<MoteurRegles> Condition invalide: {regle['si']}.")
+    compilee = {'nom' : regle.get('nom', regle['action'][0]), 'noeud' : noeud,
+                'condition' : condition, 'action' : tuple(regle['action']),
+                'front' : regle.get('front', False),
+                'delai_ns' : int(regle.get('delai', 0) * NS_PAR_SEC),
+                'vraie' : False, 'derniere' : None}
+    for champ in champs:
+      self._regles.setdefault((noeud, champ), []).append(compilee)
+
+  def echantillon(self, noeud, champ, t_ns, valeur):
+    '''Ajouter un échantillon et évaluer les règles qui en dépendent.
+
+    Arguments:
+    noeud (int) -- adresse I2C du noeud
+    champ (str) -- nom du champ
+    t_ns (int) -- horodatage de l'échantillon
+    valeur (float) -- valeur du champ
+
+    Retour (list): actions déclenchées [(nom de la règle, noeud, action)]
+    '''
+    regles = self._regles.get((noeud, champ))
+    if regles is None:
+      return []      # aucune règle n'utilise ce champ
+    self._series[(noeud, champ)].ajouter(t_ns, valeur)
+    actions = []
+    for r in regles:
+      vraie = r['condition']()
+      declencher = vraie and not (r['front'] and r['vraie'])
+      if declencher and r['derniere'] is not None and t_ns - r['derniere'] < r['delai_ns']:
+        declencher = False
+      r['vraie'] = vraie
+      if declencher:
+        r['derniere'] = t_ns
+        actions.append((r['nom'], r['noeud'], r['action']))
+    return actions
+
+
+# ------------------------------------------------------
+# Démonstration
+# ------------------------------------------------------
+if __name__ == '__main__':
+  regles = (
+    {'nom' : 'pause', 'si' : ('Sample_Num', 'entre', 10, 12), 'action' : ('pause', 10)},
+    {'nom' : 'reset', 'si' : ('Sample_Num', '>=', 15), 'action' : ('reset',)},
+    {'nom' : 'bruit', 'noeud' : 0x45, 'front' : True,
+     'si' : ('ou', ('Leq', 'pente', '>', 0.5), ('Leq', 'max', 900, '>', 75)),
+     'action' : ('ts', 5)},
+  )
+  moteur = MoteurRegles(regles, (0x44, 0x45))
+  leq = (55, 56, 55, 80, 82, 60, 58, 57, 56, 55, 55, 55, 55, 55, 55, 55)
+  for n in range(16):
+    t = n * 15 * NS_PAR_SEC
+    for action in (moteur.echantillon(0x45, 'Sample_Num', t, n)
+                   + moteur.echantillon(0x45, 'Leq', t, leq[n])):
+      print(F"#{n}: {action}")
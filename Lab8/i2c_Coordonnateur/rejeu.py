@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+rejeu.py
+Rejouer des échantillons enregistrés dans le coordonnateur (i2c_coord.main)
+comme s'ils venaient des noeuds, sans matériel.
+
+Trois pièces remplacent le matériel (main() les reçoit en arguments):
+
+  HorlogeVirtuelle  -- time_ns() et sleep() d'une horloge qui part du premier
+                       échantillon et avance 'vitesse' fois plus vite que le
+                       temps réel (math.inf: sans attente, le temps saute
+                       d'un échantillon au suivant)
+  BusRejeu          -- faux SMBus: chaque NoeudRejeu sert sa carte des
+                       registres (instantané, agrégats, tick, accusé) comme
+                       le noeud et exécute les commandes reçues (stop, go,
+                       reset, pause, Ts, commandes de groupe)
+  EvenementsRejeu   -- impulsions "données prêtes": attendre() avance
+                       l'horloge jusqu'au prochain échantillon enregistré,
+                       le publie sur son noeud et retourne le noeud. À la fin
+                       des données, FinRejeu (un KeyboardInterrupt) termine
+                       main() comme un ctrl-c.
+
+Les échantillons viennent de l'historique (voir historique.py): séries
+enregistrées par le coordonnateur ou journaux du laboratoire convertis par
+ingestion_journaux.py. Un noeud arrêté ou en pause ne publie pas les
+échantillons de cette période (ils sont comptés comme perdus), comme le vrai
+noeud. Les commandes reçues sont gardées (BusRejeu.commandes) pour comparer
+deux versions du coordonnateur.
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+import math
+import struct
+import time
+import numpy as np
+import constants as cst
+from gpio_evenements import _Evenements
+
+NS_PAR_SEC = 1_000_000_000
+NS_PAR_MS = 1_000_000
+
+# Bit du registre des changements et registre des changements de chaque noeud
+BITS_CHANGEMENTS = {0x44 : {'Temperature' : cst.I2C_STATUS_TEMP, 'Humidity' : cst.I2C_STATUS_HUM},
+                    0x45 : {'Leq' : cst.I2C_STATUS_LEQ}}
+REGISTRE_CHANGEMENTS = {0x44 : cst.I2C_NODE_DHT_STATUS, 0x45 : cst.I2C_NODE_LEQ_STATUS}
+
+
+class FinRejeu(KeyboardInterrupt):
+  '''Tous les échantillons ont été rejoués (traité comme un ctrl-c).'''
+
+
+class HorlogeVirtuelle:
+  '''Horloge du rejeu (remplace le module time dans main()).'''
+  def __init__(self, debut_ns, vitesse = 1.0):
+    '''Arguments:
+    debut_ns (int) -- temps virtuel au départ
+    vitesse (float) -- secondes virtuelles par seconde réelle (math.inf:
+                       aussi vite que possible)
+    '''
+    self.vitesse = vitesse
+    self._virtuel = int(debut_ns)
+    self._reel = time.perf_counter_ns()
+
+  def time_ns(self):
+    if math.isinf(self.vitesse):
+      return self._virtuel
+    return self._virtuel + int((time.perf_counter_ns() - self._reel) * self.vitesse)
+
+  def attendre_jusqu_a(self, t_ns):
+    '''Attendre que le temps virtuel atteigne t_ns.'''
+    if math.isinf(self.vitesse):
+      self._virtuel = max(self._virtuel, int(t_ns))
+    else:
+      attente = (t_ns - self.time_ns()) / NS_PAR_SEC / self.vitesse
+      if attente > 0:
+        time.sleep(attente)
+
+  def sleep(self, duree):
+    self.attendre_jusqu_a(self.time_ns() + int(duree * NS_PAR_SEC))
+
+
+class NoeudRejeu:
+  '''Noeud simulé qui publie des échantillons enregistrés.'''
+  def __init__(self, adr, temps_ns, valeurs, debut_ns):
+    '''Arguments:
+    adr (int) -- adresse I2C du noeud
+    temps_ns (array d'int64) -- temps des échantillons (croissants)
+    valeurs (dict) -- champ -> valeurs des échantillons
+    debut_ns (int) -- temps virtuel du tick 0 du noeud
+    '''
+    self.adr = adr
+    self.temps_ns = np.asarray(temps_ns, dtype = np.int64)
+    self.valeurs = {champ : np.asarray(v, dtype = np.float64) for champ, v in valeurs.items()}
+    self.debut_ns = debut_ns
+    self.fmt, self.champs = cst.I2C_NODE_CARTE[adr]
+    self.registres = dict.fromkeys(self.champs, 0)
+    self.registres['Ts'] = self.registres['Ts_Large'] = cst.NEW_TS
+    for champ in BITS_CHANGEMENTS[adr]:
+      self.registres[champ] = -1.0
+    self.reg_agregats, self.fmt_agregats, self.champs_agregats = cst.I2C_NODE_AGREGATS[adr]
+    self._agregats = {}               # champ -> [min, max, somme, nb]
+    self.suivant = 0                  # indice du prochain échantillon
+    self.actif = True
+    self.pause_ns = None              # fin de la pause en cours
+    self.publies = 0
+    self.perdus = 0                   # non publiés (noeud arrêté ou en pause)
+
+  def tick(self, t_ns):
+    '''millis() du noeud au temps virtuel t_ns.'''
+    return ((t_ns - self.debut_ns) // NS_PAR_MS) & 0xFFFFFFFF
+
+  def prochain_ns(self):
+    return int(self.temps_ns[self.suivant]) if self.suivant < len(self.temps_ns) else None
+
+  def publier(self, t_ns):
+    '''Publier les échantillons dont le temps est passé.
+
+    Retour (bool): vrai si au moins un échantillon a été publié
+    '''
+    publie = False
+    while self.suivant < len(self.temps_ns) and self.temps_ns[self.suivant] <= t_ns:
+      k = self.suivant
+      self.suivant += 1
+      t = int(self.temps_ns[k])
+      if self.pause_ns is not None and t >= self.pause_ns:
+        self.pause_ns = None
+      if not self.actif or self.pause_ns is not None:
+        self.perdus += 1
+        continue
+      r = self.registres
+      for champ, bit in BITS_CHANGEMENTS[self.adr].items():
+        if champ not in self.valeurs:
+          continue
+        v = float(self.valeurs[champ][k])
+        if v != r[champ]:
+          r['Changements'] |= bit
+        r[champ] = v
+        a = self._agregats.setdefault(champ, [math.inf, -math.inf, 0.0, 0])
+        a[0], a[1] = min(a[0], v), max(a[1], v)
+        # Moyenne énergétique pour le Leq (comme le noeud)
+        a[2] += 10.0 ** (v / 10.0) if champ == 'Leq' else v
+        a[3] += 1
+      r['Sample_Num'] = (r['Sample_Num'] + 1) & 0xFFFF
+      r['Generation'] = r['Generation'] % 255 + 1      # 1 à 255 (0: rien publié)
+      r['Tick_Echan'] = self.tick(t)
+      self.publies += 1
+      publie = True
+    return publie
+
+  def carte(self):
+    '''Octets de la carte des registres publiée.'''
+    return struct.pack(self.fmt, *(self.registres[c] for c in self.champs))
+
+  def lire(self, reg, n, t_ns):
+    '''Lecture de n octets à partir du registre reg (bloc ou octet).'''
+    if reg == self.reg_agregats:
+      valeurs = []
+      nombre = min((a[3] for a in self._agregats.values()), default = 0)
+      for champ in self.champs_agregats:
+        a = self._agregats.get(champ)
+        if not nombre or a is None:
+          valeurs += [0.0, 0.0, 0.0]
+        else:
+          moyenne = 10.0 * math.log10(a[2] / a[3]) if champ == 'Leq' else a[2] / a[3]
+          valeurs += [a[0], a[1], moyenne]
+      self._agregats = {}
+      return list(struct.pack(self.fmt_agregats, nombre, *valeurs)[:n])
+    if reg == cst.I2C_NODE_TICK[self.adr]:
+      self.registres['Tick'] = self.tick(t_ns)
+    octets = list(self.carte()[reg : reg + n])
+    if reg in (cst.I2C_NODE_SNAPSHOT, REGISTRE_CHANGEMENTS[self.adr]):
+      self.registres['Changements'] = 0
+    return octets + [0] * (n - len(octets))
+
+  def executer(self, cmd, args, t_ns):
+    '''Exécuter une commande reçue (seule ou dans une commande de groupe).'''
+    r = self.registres
+    if cmd == cst.I2C_CMD_SET_STOP:
+      self.actif = False
+    elif cmd == cst.I2C_CMD_SET_GO:
+      self.actif = True
+      r['Sample_Num'] = 0
+    elif cmd == cst.I2C_CMD_SET_RESET:
+      # Comme les noeuds: Ts et Ts_Large ne changent pas
+      r['Sample_Num'] = 0
+      self._agregats = {}
+    elif cmd == cst.I2C_CMD_SET_TS and args:
+      ts = args[0] | (args[1] << 8 if len(args) > 1 else 0)
+      r['Ts'], r['Ts_Large'] = min(ts, 255), ts
+    elif cmd == cst.I2C_CMD_SET_PAUSE and args:
+      self.pause_ns = t_ns + args[0] * NS_PAR_SEC
+
+
+class BusRejeu:
+  '''Faux SMBus relié aux noeuds du rejeu.'''
+  def __init__(self, noeuds, horloge):
+    '''Arguments:
+    noeuds (dict) -- adresse -> NoeudRejeu
+    horloge (HorlogeVirtuelle) -- temps des commandes et des ticks
+    '''
+    self.noeuds = noeuds
+    self.horloge = horloge
+    self.commandes = []               # (temps virtuel ns, adresse, commande, arguments)
+    self._registres = {}              # adresse -> registre choisi par write_byte
+    self.transactions = 0
+
+  def _noeud(self, adr):
+    self.transactions += 1
+    if adr not in self.noeuds:
+      raise OSError(121, F"Remote I/O error (pas de noeud à l'adresse {hex(adr)})")
+    return self.noeuds[adr]
+
+  def _executer(self, noeud, cmd, args):
+    t = self.horloge.time_ns()
+    self.commandes.append((t, noeud.adr, cmd, tuple(args)))
+    noeud.executer(cmd, args, t)
+
+  def write_byte(self, adr, valeur):
+    noeud = self._noeud(adr)
+    if valeur in (cst.I2C_CMD_SET_STOP, cst.I2C_CMD_SET_GO, cst.I2C_CMD_SET_RESET):
+      self._executer(noeud, valeur, ())
+    else:
+      self._registres[adr] = valeur
+
+  def read_byte(self, adr):
+    return self._noeud(adr).lire(self._registres.get(adr, 0), 1, self.horloge.time_ns())[0]
+
+  def read_i2c_block_data(self, adr, reg, n):
+    return self._noeud(adr).lire(reg, n, self.horloge.time_ns())
+
+  def write_i2c_block_data(self, adr, cmd, donnees):
+    if adr == cst.I2C_GENERAL_CALL and cmd == cst.I2C_CMD_GROUP:
+      self.transactions += 1
+      masque, numero, commande, *args = donnees
+      for a, noeud in self.noeuds.items():
+        if cst.I2C_NODE_GROUPES.get(a, 0) & masque:
+          self._executer(noeud, commande, args)
+          noeud.registres['Ack'] = numero
+    else:
+      self._executer(self._noeud(adr), cmd, list(donnees))
+
+  def prochain_ns(self):
+    '''Temps du prochain échantillon à publier (None: fin des données).'''
+    prochains = [t for t in (n.prochain_ns() for n in self.noeuds.values()) if t is not None]
+    return min(prochains) if prochains else None
+
+
+class EvenementsRejeu(_Evenements):
+  '''Impulsions des noeuds du rejeu (remplace gpio_evenements).'''
+  def __init__(self, bus):
+    super().__init__()
+    self.bus = bus
+
+  def attendre(self, delai = None):
+    '''Avancer jusqu'au prochain échantillon (ou pendant delai sec) et
+    retourner les noeuds qui ont publié.
+
+    Exceptions possibles: FinRejeu (plus d'échantillons)
+    '''
+    horloge = self.bus.horloge
+    prochain = self.bus.prochain_ns()
+    if prochain is None:
+      raise FinRejeu()
+    if delai is not None:
+      prochain = min(prochain, horloge.time_ns() + int(delai * NS_PAR_SEC))
+    horloge.attendre_jusqu_a(prochain)
+    maintenant = horloge.time_ns()
+    for adr, noeud in self.bus.noeuds.items():
+      if noeud.publier(maintenant):
+        self.signaler(adr)
+    return super().attendre(0)
+
+
+def series_noeud(historique, source, champs):
+  '''Échantillons d'un noeud à partir des séries (source, champ) de
+  l'historique. Les champs sont réunis sur l'union de leurs temps (dernière
+  valeur connue de chaque champ).
+
+  Retour (tuple): (temps int64, {champ: valeurs})
+  Exceptions possibles: ValueError (aucune série)
+  '''
+  series = {}
+  for champ in champs:
+    t, v = historique.lire(source, champ)
+    if len(t):
+      series[champ] = (np.asarray(t), np.asarray(v, dtype = np.float64))
+  if not series:
+    raise ValueError(F"<series_noeud> Aucune série pour la source {source}.")
+  temps = np.unique(np.concatenate([t for t, _ in series.values()]))
+  valeurs = {}
+  for champ, (t, v) in series.items():
+    i = np.maximum(np.searchsorted(t, temps, side = 'right') - 1, 0)
+    valeurs[champ] = v[i]
+  return temps, valeurs
+
+
+def preparer(donnees, vitesse = 1.0, repetitions = 1):
+  '''Créer l'horloge, le bus et les impulsions du rejeu.
+
+  Arguments:
+  donnees (dict) -- adresse -> (temps int64, {champ: valeurs})
+  vitesse (float) -- facteur de vitesse (math.inf: maximale)
+  repetitions (int) -- nombre de fois que les données sont rejouées (à la
+                       suite, décalées de leur durée)
+
+  Retour (tuple): (horloge, bus, evenements) à passer à i2c_coord.main()
+  '''
+  debut = min(int(t[0]) for t, _ in donnees.values())
+  fin = max(int(t[-1]) for t, _ in donnees.values())
+  pas = int(min(np.median(np.diff(t)) if len(t) > 1 else NS_PAR_SEC for t, _ in donnees.values()))
+  duree = fin - debut + pas
+  horloge = HorlogeVirtuelle(debut - pas, vitesse)
+  noeuds = {}
+  for adr, (temps, valeurs) in donnees.items():
+    decalages = np.repeat(np.arange(repetitions, dtype = np.int64) * duree, len(temps))
+    noeuds[adr] = NoeudRejeu(adr, np.tile(temps, repetitions) + decalages,
+                             {c : np.tile(v, repetitions) for c, v in valeurs.items()},
+                             debut - pas)
+  bus = BusRejeu(noeuds, horloge)
+  return horloge, bus, EvenementsRejeu(bus)
+
+
+# ------------------------------------------------------
+# Rejeu des journaux du laboratoire dans le coordonnateur
+# ------------------------------------------------------
+if __name__ == '__main__':
+  import argparse
+  import os
+  import tempfile
+  from collections import Counter
+  from historique import Historique
+  from ingestion_journaux import ingerer
+  import i2c_coord
+  racine = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+  parser = argparse.ArgumentParser(description = "Rejeu d'échantillons enregistrés dans le coordonnateur")
+  parser.add_argument('--vitesse', default = 'max', help = "facteur de vitesse (1, 60, ...) ou 'max'")
+  parser.add_argument('--repetitions', type = int, default = 1)
+  parser.add_argument('--historique', help = "historique enregistré par le coordonnateur "
+                      "(séries 0x44 et 0x45); par défaut les journaux measurement*.txt")
+  parser.add_argument('--consommateurs', default = 'stockage,anomalies',
+                      help = "consommateurs du pipeline, séparés par des virgules")
+  args = parser.parse_args()
+
+  if args.historique:
+    source = Historique(args.historique)
+    sources = {0x44 : '0x44', 0x45 : '0x45'}
+  else:
+    source = Historique(tempfile.mkdtemp(), taille_bloc = None)
+    ingerer(source, os.path.join(racine, 'measurementDHT.txt'), noeud = 'dht')
+    ingerer(source, os.path.join(racine, 'measurementELECTRET.txt'), noeud = 'electret')
+    sources = {0x44 : 'dht', 0x45 : 'electret'}
+  donnees = {adr : series_noeud(source, nom, BITS_CHANGEMENTS[adr]) for adr, nom in sources.items()}
+  vitesse = math.inf if args.vitesse == 'max' else float(args.vitesse)
+  horloge, bus, evenements = preparer(donnees, vitesse, args.repetitions)
+
+  sortie = tempfile.mkdtemp()
+  debut_virtuel, debut = horloge.time_ns(), time.perf_counter()
+  i2c_coord.main(bus, horloge, evenements, repertoire_historique = sortie,
+                 noms_consommateurs = tuple(args.consommateurs.split(',')))
+  duree = time.perf_counter() - debut
+  duree_virtuelle = (horloge.time_ns() - debut_virtuel) / NS_PAR_SEC
+
+  print()
+  print(F"Rejeu: {duree_virtuelle / 3600:.2f} h de données en {duree:.2f} s "
+        F"({duree_virtuelle / duree:.0f} x), {bus.transactions} transactions I2C")
+  for adr, noeud in bus.noeuds.items():
+    print(F"Noeud {hex(adr)}: {noeud.publies} échantillons publiés, {noeud.perdus} perdus "
+          F"(arrêt ou pause)")
+  noms = {cst.I2C_CMD_SET_STOP : 'stop', cst.I2C_CMD_SET_GO : 'go', cst.I2C_CMD_SET_RESET : 'reset',
+          cst.I2C_CMD_SET_TS : 'ts', cst.I2C_CMD_SET_PAUSE : 'pause'}
+  print("Commandes reçues:", dict(Counter(noms.get(c, hex(c)) for _, _, c, _ in bus.commandes)))
+  stockees = Historique(sortie)
+  for serie in stockees.series():
+    noeud, champ = serie.split('_', 1)
+    print(F"Historique {serie}: {len(stockees.lire(noeud, champ)[0])} échantillons")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+synchro_horloge.py
+Convertir le temps des noeuds (ticks millis() de l'Arduino) en horodatages
+du coordonnateur (ns depuis l'époque, entiers).
+
+Synchronisation:
+  Le coordonnateur lit le registre REG_TICK_COURANT du noeud. Le noeud
+  mémorise millis() au moment où il reçoit l'adresse de ce registre, donc
+  entre l'envoi (t_envoi) et la fin de la lecture (t_recu). On associe ce
+  tick au milieu (t_envoi + t_recu) / 2; l'erreur est au plus la moitié du
+  temps aller-retour (RTT).
+
+  À partir des dernières mesures, on estime par moindres carrés la droite
+      t_ns = t_ref + pente x (tick - tick_ref)
+  La pente donne la dérive de l'horloge du noeud (1e6 ns/ms pour une horloge
+  parfaite; le résonateur d'un Arduino s'en écarte de quelques centaines de
+  ppm). Seules les mesures dont le RTT est proche du RTT minimal sont
+  utilisées (les autres ont été retardées par le bus ou l'ordonnanceur).
+
+Ticks:
+  millis() est un entier de 32 bits qui revient à zéro après ~49,7 jours.
+  Les ticks sont "dépliés" par rapport au dernier tick de synchronisation
+  (différence signée sur 32 bits). Un tick de synchronisation qui recule
+  indique un redémarrage du noeud: les mesures sont alors oubliées.
+
+Ce module fait partie du programme i2c_coord.py.
+
+Dans le cadre du cours :
+GPA788 Conception et intégration des objets connectés
+'''
+
+from collections import deque
+import numpy as np
+
+NS_PAR_MS = 1_000_000
+MODULO_TICK = 1 << 32        # millis() sur 32 bits
+TOLERANCE_RTT = 1.5          # RTT gardés: <= TOLERANCE_RTT x RTT minimal ...
+MARGE_RTT_NS = 200_000       # ... + MARGE_RTT_NS
+RECUL_MAX_MS = 1000          # recul du tick qui indique un redémarrage
+
+
+class HorlogeNoeud:
+  '''Modèle linéaire tick du noeud -> temps du coordonnateur (ns).'''
+  def __init__(self, nb_mesures = 32):
+    '''Arguments:
+    nb_mesures (int) -- nombre de mesures de synchronisation gardées
+    '''
+    self._ticks = deque(maxlen = nb_mesures)   # ticks dépliés (ms)
+    self._temps = deque(maxlen = nb_mesures)   # milieux (ns)
+    self._rtt = deque(maxlen = nb_mesures)     # temps aller-retour (ns)
+    self._brut = None           # dernier tick de synchronisation (32 bits)
+    self._deplie = 0            # ... et sa valeur dépliée
+    self.tick_ref = 0           # point de référence de la droite
+    self.t_ref = 0
+    self.pente = float(NS_PAR_MS)
+
+  def __len__(self):
+    return len(self._ticks)
+
+  def _deplier(self, tick):
+    '''Tick de 32 bits -> tick déplié près du dernier tick de synchronisation.'''
+    ecart = (tick - self._brut + MODULO_TICK // 2) % MODULO_TICK - MODULO_TICK // 2
+    return self._deplie + ecart
+
+  def ajouter_mesure(self, tick, t_envoi_ns, t_recu_ns):
+    '''Ajouter une mesure de synchronisation et réestimer la droite.
+
+    Arguments:
+    tick (int) -- valeur du registre REG_TICK_COURANT (ms, 32 bits)
+    t_envoi_ns (int) -- time.time_ns() avant la lecture du registre
+    t_recu_ns (int) -- time.time_ns() après la lecture du registre
+
+    Retour: n/a
+    '''
+    if self._brut is not None:
+      deplie = self._deplier(tick)
+      if deplie < self._deplie - RECUL_MAX_MS:
+        # Le noeud a redémarré: son horloge repart de zéro
+        self._ticks.clear()
+        self._temps.clear()
+        self._rtt.clear()
+        deplie = tick
+    else:
+      deplie = tick
+    self._brut, self._deplie = tick, deplie
+    self._ticks.append(deplie)
+    self._temps.append((t_envoi_ns + t_recu_ns) // 2)
+    self._rtt.append(t_recu_ns - t_envoi_ns)
+    self._estimer()
+
+  def _estimer(self):
+    '''Droite des moindres carrés sur les mesures de faible RTT.'''
+    rtt = np.array(self._rtt)
+    garder = rtt <= TOLERANCE_RTT * rtt.min() + MARGE_RTT_NS
+    ticks = np.array(self._ticks)[garder]
+    temps = np.array(self._temps)[garder]
+    # Travailler relativement à la dernière mesure gardée: les écarts sont
+    # petits et restent exacts en float64 (les temps absolus ~1.7e18 ns
+    # ne le sont pas).
+    self.tick_ref, self.t_ref = int(ticks[-1]), int(temps[-1])
+    if len(ticks) < 2 or ticks[0] == ticks[-1]:
+      # Une seule mesure: dériver de la pente nominale (ou précédente)
+      return
+    x = (ticks - self.tick_ref).astype(np.float64)
+    y = (temps - self.t_ref).astype(np.float64)
+    xm, ym = x.mean(), y.mean()
+    self.pente = float(np.dot(x - xm, y - ym) / np.dot(x - xm, x - xm))
+    # Faire passer la droite par le centre des mesures
+    self.t_ref += round(ym - self.pente * xm)
+
+  def vers_ns(self, tick):
+    '''Convertir un tick du noeud (ms, 32 bits) en horodatage (ns, int).
+
+    Exceptions possibles: ValueError (aucune mesure de synchronisation)
+    '''
+    if self._brut is None:
+      raise ValueError("<vers_ns> Horloge du noeud non synchronisée.")
+    return self.t_ref + round(self.pente * (self._deplier(tick) - self.tick_ref))
+
+  @property
+  def derive_ppm(self):
+    '''Dérive de l'horloge du noeud par rapport au coordonnateur (ppm,
+    positive si le noeud avance).'''
+    return (NS_PAR_MS / self.pente - 1.0) * 1e6
+
+  @property
+  def incertitude_ns(self):
+    '''Demi RTT minimal des mesures gardées (borne de l'erreur du milieu).'''
+    return min(self._rtt) // 2 if self._rtt else None
+
+
+# ------------------------------------------------------
+# Test avec une horloge simulée
+# ------------------------------------------------------
+if __name__ == '__main__':
+  rng = np.random.default_rng(788)
+  derive, decalage = 120e-6, 1_700_000_000_000_000_000     # 120 ppm
+  depart = MODULO_TICK - 60_000          # millis() déborde après 1 minute
+  horloge = HorlogeNoeud()
+  erreurs = []
+  for k in range(200):
+    t_envoi = decalage + k * 15 * 10**9 + int(rng.integers(0, 10**6))
+    rtt = int(200_000 + rng.exponential(2_000_000))
+    latence = int(rng.uniform(0, rtt))               # moment du tick
+    vrai = t_envoi + latence
+    tick = int(depart + (vrai - decalage) * (1 + derive) / NS_PAR_MS) % MODULO_TICK
+    horloge.ajouter_mesure(tick, t_envoi, t_envoi + rtt)
+    # Échantillon pris 3 s avant la synchronisation
+    vrai_ech = vrai - 3 * 10**9
+    tick_ech = int(depart + (vrai_ech - decalage) * (1 + derive) / NS_PAR_MS) % MODULO_TICK
+    if k >= 8:
+      erreurs.append(horloge.vers_ns(tick_ech) - vrai_ech)
+  erreurs = np.abs(np.array(erreurs)) / 1e6
+  print(F"Dérive estimée: {horloge.derive_ppm:.1f} ppm (vraie: {derive * 1e6:.1f})")
+  print(F"Erreur des horodatages: moyenne {erreurs.mean():.3f} ms, max {erreurs.max():.3f} ms")
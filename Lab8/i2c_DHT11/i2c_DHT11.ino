@@ -6,15 +6,25 @@
  *
  *    - la valeur de la température mesuré par le DHT11;
  *    - la valeur de la humidité mesuré par le DHT11;
- *    - le numéro de l'échantillon.
+ *    - le numéro de l'échantillon;
+ *    - le temps du noeud (millis) de l'échantillon et de la requête;
+ *    - tous ses registres en une seule lecture (copie cohérente);
+ *    - le min, le max et la moyenne des échantillons depuis la
+ *      dernière lecture de ces agrégats.
  *
  *  De plus, le noeud est capable de recevoir les commandes suivantes
  *  du coordonnateur:
- *    - ChangeTs: changer le taux d'échantillonnage
+ *    - ChangeTs: changer le taux d'échantillonnage (valeur sur 1 ou 2 octets)
  *    - Stop: arrêter l'échantillonnage;
  *    - Go: démarrer l'échantillonnage.
  *    - Reset: réinitialiser le neud
  *    - Pause: mettre neud en pause pendant nombre de seconds spécifié
+ *    - Groupe: une des commandes précédentes envoyée à plusieurs noeuds
+ *      par l'appel général (adresse 0x00), avec accusé de réception.
+ *
+ *  Le noeud envoie une impulsion sur la broche PIN_PRET dès qu'un nouvel
+ *  échantillon est publié: le coordonnateur attend ce front au lieu de
+ *  lire les noeuds à intervalle fixe.
  *
  *  Dans cet exemple, l'arrêt de l'échantillonnage remet à zéro le numéro
  *  de l'échantillon.
@@ -48,7 +58,30 @@ dhtlib_gpa788 dht(DHT11_PIN);
    Globales pour la communication I2C
    ------------------------------------------------------------------ */
 const uint8_t ADR_NOEUD{0x44};  // Adresse I2C de ce noeud
-const uint8_t NB_REGISTRES{11}; // Nombre de registres de ce noeud
+const uint8_t NB_REGISTRES{50}; // Nombre de registres de ce noeud
+const uint8_t REG_CHANGEMENTS{11}; // Adresse du registre des changements
+const uint8_t REG_ACK{12};         // Adresse du registre d'accusé de réception
+const uint8_t REG_TICK_COURANT{17}; // Tick (ms) mémorisé au choix de ce registre
+const uint8_t REG_TS_LARGE{21};     // Ts sur 2 octets
+const uint8_t REG_GENERATION{23};   // Numéro de la copie publiée
+const uint8_t REG_INSTANTANE{0};     // Début d'une lecture de tous les registres
+const uint8_t REG_AGREGATS{24};     // Agrégats (remis à zéro à la lecture)
+
+// Ligne "données prêtes": impulsion à chaque échantillon publié. Relier la
+// broche à un GPIO du Pi (une ligne par noeud) avec un diviseur de tension
+// (5 V -> 3,3 V).
+const uint8_t PIN_PRET{8};
+const uint8_t DUREE_IMPULSION_US{50};
+
+// Groupes de ce noeud pour les commandes de groupe (appel général, adresse
+// 0x00). Une commande de groupe est exécutée si son masque contient au moins
+// un de ces bits (0x01: climat, voir I2C_GROUPES dans constants.py).
+const uint8_t GROUPES{0x01};
+
+// Bits du registre des changements: la valeur a changé depuis la dernière
+// lecture de ce registre par le coordonnateur (remis à zéro à la lecture).
+const uint8_t CHG_TEMPERATURE{0x01};
+const uint8_t CHG_HUMIDITE{0x02};
 
 /* La carte des registres ------------------------------------------- */
 union CarteRegistres
@@ -66,6 +99,31 @@ union CarteRegistres
     volatile float temperature;
     // Humidité mesuréee par le DHT11 (4 octets)
     volatile float humidite;
+    // Champs modifiés depuis la dernière lecture de ce registre (1 octet)
+    volatile uint8_t changements;
+    // Numéro de la dernière commande de groupe exécutée (1 octet)
+    volatile uint8_t ack;
+    // millis() au moment du dernier échantillon (4 octets)
+    volatile uint32_t tick_echantillon;
+    // millis() au moment où le coordonnateur a choisi le registre
+    // REG_TICK_COURANT (4 octets). Sert à synchroniser les horloges.
+    volatile uint32_t tick_courant;
+    // Période d'échantillonnage sur 2 octets, changée par la commande
+    // ChangeTs à 3 octets (Ts ci-dessus est limité à 255)
+    volatile uint16_t ts_large;
+    // Incrémenté à chaque publication d'un échantillon (1 octet)
+    volatile uint8_t generation;
+    // Agrégats des échantillons publiés depuis la dernière lecture de
+    // REG_AGREGATS par le coordonnateur (remis à zéro à la lecture):
+    // nombre (2 octets) puis min, max et moyenne de la température et de
+    // l'humidité (6 x 4 octets)
+    volatile uint16_t nb_agreges;
+    volatile float temp_min;
+    volatile float temp_max;
+    volatile float temp_moy;
+    volatile float hum_min;
+    volatile float hum_max;
+    volatile float hum_moy;
   } champs;
   // Ce tableau: Utilisé par le coordonnateur pour lire et écrire
   //             des données.
@@ -78,10 +136,16 @@ enum class CMD
   Stop = 0xA1,
   Go = 0xA2,
   Reset = 0xA3,
-  Pause = 0xA4
+  Pause = 0xA4,
+  Groupe = 0xA6
 }; // Commandes venant du coordonnateur
 
-union CarteRegistres cr; // Une carte des registres
+// Deux copies de la carte des registres. Le coordonnateur lit toujours la
+// copie publiée (*cr). Un nouvel échantillon est écrit dans l'autre copie,
+// puis publiée en changeant le pointeur: une lecture en bloc des registres
+// (servie en une seule interruption) ne mélange jamais deux échantillons.
+union CarteRegistres tampons[2];
+union CarteRegistres * volatile cr = &tampons[0];
 float temperature;       // Variable intermédiaire pour mémoriser la température
 float humidite;          // Variable intermédiaire pour mémoriser la humidite
 uint8_t adrReg;          // Adresse du registre reçue du coordonnateur
@@ -92,6 +156,8 @@ uint32_t wakeUpTime = -1; // Temps à reveiller l'Arduino après commande pause
 
 const uint8_t MIN_TS_SEC{5};   // Période de pause min (sec)
 const uint8_t MAX_TS_SEC{200}; // Période de pause max (sec)
+const uint16_t MIN_TS_LARGE{5};    // Ts min. de la commande à 3 octets (sec)
+const uint16_t MAX_TS_LARGE{3600}; // Ts max. de la commande à 3 octets (sec)
 
 const uint8_t MIN_PAUSE_SEC{5};      // Période d'échantillonnage min (sec)
 const uint8_t MAX_PAUSE_SEC{100000}; // Période d'échantillonnage max (sec)
@@ -113,10 +179,17 @@ void setup()
   waitUntil(2000);
 
   // Initialiser les champs de la carte des registres
-  cr.champs.Ts = MIN_TS_SEC;
-  cr.champs.nb_echantillons = 0;
-  cr.champs.temperature = -1;
-  cr.champs.humidite = -1;
+  cr->champs.Ts = MIN_TS_SEC;
+  cr->champs.ts_large = MIN_TS_SEC;
+  cr->champs.nb_echantillons = 0;
+  cr->champs.temperature = -1;
+  cr->champs.humidite = -1;
+  cr->champs.changements = 0;
+  cr->champs.ack = 0;
+  cr->champs.tick_echantillon = 0;
+  cr->champs.tick_courant = 0;
+  cr->champs.generation = 0;
+  cr->champs.nb_agreges = 0;
   temperature = -1;
   humidite = -1;
 
@@ -126,10 +199,15 @@ void setup()
   adrReg = -1;
   // Réglage de la bibliothèque Wire pour le I2C
   Wire.begin(ADR_NOEUD);
+  // Accepter aussi l'appel général (adresse 0x00) pour les commandes de groupe
+  TWAR |= _BV(TWGCE);
   // Fonction pour traiter la réception de données venant du coordonnateur
   Wire.onReceive(i2c_receiveEvent);
   // Fonction pour traiter une requête de données venant du coordonnateur
   Wire.onRequest(i2c_requestEvent);
+  // Ligne "données prêtes" au repos
+  pinMode(PIN_PRET, OUTPUT);
+  digitalWrite(PIN_PRET, LOW);
 
   // Indiquer que le noeud est prêt
   Serial.print(F("Noeud à l'adresse 0x"));
@@ -158,6 +236,7 @@ void loop()
 
     temperature = dht.getTemperature();
     humidite = dht.getHumidity();
+    uint32_t tick = millis();
 
     // Section critique: empêcher les interruptions lors de l'assignation
     // de la valeur de la température à la variable dans la carte des registres.
@@ -165,22 +244,47 @@ void loop()
     //                 la section critique.
     ATOMIC_BLOCK(ATOMIC_RESTORESTATE)
     {
-      // Assigner la température lue dans cr.champs.temperature
-      cr.champs.temperature = temperature;
-      // Assigner la humidite lue dans cr.champs.temperature
-      cr.champs.humidite = humidite;
+      // Préparer la copie suivante à partir de la copie publiée (elle
+      // contient les changements faits par les commandes)
+      union CarteRegistres *suivant = (cr == &tampons[0]) ? &tampons[1] : &tampons[0];
+      memcpy(suivant->regs, cr->regs, NB_REGISTRES);
+      // Signaler au coordonnateur les valeurs qui ont changé
+      if (temperature != suivant->champs.temperature)
+        suivant->champs.changements |= CHG_TEMPERATURE;
+      if (humidite != suivant->champs.humidite)
+        suivant->champs.changements |= CHG_HUMIDITE;
+      // Assigner la température lue dans suivant->champs.temperature
+      suivant->champs.temperature = temperature;
+      // Assigner la humidite lue dans suivant->champs.temperature
+      suivant->champs.humidite = humidite;
+      // Temps du noeud au moment de l'échantillon
+      suivant->champs.tick_echantillon = tick;
       // Augmenter le compte du nombre d'échantillons
-      cr.champs.nb_echantillons++;
+      suivant->champs.nb_echantillons++;
+      // Ajouter l'échantillon aux agrégats
+      if (suivant->champs.nb_agreges < 0xFFFF)
+        suivant->champs.nb_agreges++;
+      agreger(suivant->champs.nb_agreges, temperature, suivant->champs.temp_min,
+              suivant->champs.temp_max, suivant->champs.temp_moy);
+      agreger(suivant->champs.nb_agreges, humidite, suivant->champs.hum_min,
+              suivant->champs.hum_max, suivant->champs.hum_moy);
+      // Publier la nouvelle copie (la génération 0 veut dire: aucun
+      // échantillon publié, elle est sautée au retour à zéro)
+      if (++suivant->champs.generation == 0)
+        suivant->champs.generation = 1;
+      cr = suivant;
     }
+    // Signaler le nouvel échantillon au coordonnateur
+    signalerPret();
     Serial.print(F("#"));
-    Serial.print(cr.champs.nb_echantillons);
+    Serial.print(cr->champs.nb_echantillons);
     Serial.print(F("  T:"));
-    Serial.println(cr.champs.temperature);
+    Serial.println(cr->champs.temperature);
     Serial.print(F("    H:"));
-    Serial.println(cr.champs.humidite);
+    Serial.println(cr->champs.humidite);
 
     // Attendre la prochaine période d'échantillonnage
-    waitUntil(cr.champs.Ts * 1000);
+    waitUntil(cr->champs.ts_large * 1000UL);
   }
   else if (cmd == CMD::Pause && millis() >= wakeUpTime)
   {
@@ -189,6 +293,131 @@ void loop()
   }
 }
 
+/* ------------------------------------------------------------------
+   signalerPret()
+   Envoyer une impulsion sur la ligne "données prêtes". Le coordonnateur
+   détecte le front montant et lit le noeud.
+   ------------------------------------------------------------------ */
+void signalerPret()
+{
+  digitalWrite(PIN_PRET, HIGH);
+  delayMicroseconds(DUREE_IMPULSION_US);
+  digitalWrite(PIN_PRET, LOW);
+}
+
+/* ------------------------------------------------------------------
+   agreger(n, v, vmin, vmax, vmoy)
+   Ajouter la valeur v (n-ième valeur depuis la remise à zéro) au
+   minimum, au maximum et à la moyenne.
+   ------------------------------------------------------------------ */
+void agreger(uint16_t n, float v, volatile float &vmin, volatile float &vmax,
+             volatile float &vmoy)
+{
+  if (n <= 1)
+  {
+    vmin = vmax = vmoy = v;
+    return;
+  }
+  if (v < vmin)
+    vmin = v;
+  if (v > vmax)
+    vmax = v;
+  vmoy += (v - vmoy) / n;
+}
+
+/* ------------------------------------------------------------------
+   executerCommande(uint8_t data)
+   Exécuter une commande à un octet (Stop, Go ou Reset) reçue seule
+   ou dans une commande de groupe. Retourne false si data n'est pas
+   une commande à un octet.
+   ------------------------------------------------------------------ */
+bool executerCommande(uint8_t data)
+{
+  switch (data)
+  {
+  case static_cast<uint8_t>(CMD::Stop):
+    cmd = CMD::Stop;
+    Serial.println(F("Commande 'Arrêter' reçue"));
+    break;
+  case static_cast<uint8_t>(CMD::Go):
+    cmd = CMD::Go;
+    cr->champs.nb_echantillons = 0;
+    Serial.println(F("Commande 'Démarrer' reçue"));
+    break;
+  case static_cast<uint8_t>(CMD::Reset):
+    // cmd n'est pas mise à CMD::Reset parce que l'execution
+    // doit continuer comme avant après Reset
+    Serial.println(F("Commande 'Reset' reçue"));
+    // Reset tout sauf Ts: le Ts est choisi par le coordonnateur (contrôle
+    // de Ts) et doit rester celui utilisé pour l'échantillonnage
+    cr->champs.nb_echantillons = 0;
+    cr->champs.nb_agreges = 0;
+    cr->champs.temperature = -1;
+    cr->champs.humidite = -1;
+    cr->champs.changements = CHG_TEMPERATURE | CHG_HUMIDITE;
+    temperature = -1;
+    humidite = -1;
+    break;
+  default:
+    return false;
+  }
+  return true;
+}
+
+/* ------------------------------------------------------------------
+   changerTs(uint16_t ts)
+   Assigner une nouvelle période d'échantillonnage (commande ChangeTs
+   à 2 ou à 3 octets).
+   ------------------------------------------------------------------ */
+void changerTs(uint16_t ts)
+{
+  Serial.println(F("Commande 'Changer Ts' reçue"));
+  cr->champs.Ts = (ts > 255) ? 255 : ts;
+  cr->champs.ts_large = ts;
+  Serial.print(F("La nouvelle valeur est: "));
+  Serial.print(cr->champs.ts_large);
+  Serial.println(F(" secondes"));
+}
+
+/* ------------------------------------------------------------------
+   executerCommande2(uint8_t data1, uint8_t data2)
+   Exécuter une commande à deux octets (ChangeTs ou Pause) reçue seule
+   ou dans une commande de groupe.
+   ------------------------------------------------------------------ */
+void executerCommande2(uint8_t data1, uint8_t data2)
+{
+  if ((data1 == static_cast<uint8_t>(CMD::ChangeTs)) && (data2 >= MIN_TS_SEC) && (data2 <= MAX_TS_SEC))
+  {
+    changerTs(data2);
+  }
+  else if ((data1 == static_cast<uint8_t>(CMD::Pause)) && (data2 >= MIN_PAUSE_SEC) && (data2 <= MAX_PAUSE_SEC))
+  {
+    cmd = CMD::Pause;
+    Serial.println(F("Commande 'Pause' reçue"));
+    uint8_t pauseTimeSec = data2;
+    Serial.print(F("Mettre Arduino en pause pendant : "));
+    Serial.print(pauseTimeSec);
+    Serial.println(F(" secondes"));
+
+    wakeUpTime = millis() + pauseTimeSec * 1000;
+  }
+}
+
+/* ------------------------------------------------------------------
+   executerCommande3(uint8_t data1, uint8_t lsb, uint8_t msb)
+   Exécuter une commande à trois octets (ChangeTs avec une période sur
+   2 octets, de MIN_TS_LARGE à MAX_TS_LARGE) reçue seule ou dans une
+   commande de groupe.
+   ------------------------------------------------------------------ */
+void executerCommande3(uint8_t data1, uint8_t lsb, uint8_t msb)
+{
+  uint16_t ts = lsb | (static_cast<uint16_t>(msb) << 8);
+  if ((data1 == static_cast<uint8_t>(CMD::ChangeTs)) && (ts >= MIN_TS_LARGE) && (ts <= MAX_TS_LARGE))
+  {
+    changerTs(ts);
+  }
+}
+
 /* ------------------------------------------------------------------
    i2c_receiveFunc(int n)
    Cette fonction est exécutée à la réception des données venant
@@ -208,34 +437,15 @@ void i2c_receiveEvent(int n)
     // numéro d'un registre demandé par le coordonnateur.
     uint8_t data = Wire.read();
 
-    switch (data)
+    if (!executerCommande(data))
     {
-    case static_cast<uint8_t>(CMD::Stop):
-      cmd = CMD::Stop;
-      Serial.println(F("Commande 'Arrêter' reçue"));
-      break;
-    case static_cast<uint8_t>(CMD::Go):
-      cmd = CMD::Go;
-      cr.champs.nb_echantillons = 0;
-      Serial.println(F("Commande 'Démarrer' reçue"));
-      break;
-    case static_cast<uint8_t>(CMD::Reset):
-      // cmd n'est pas mise à CMD::Reset parce que l'execution
-      // doit continuer comme avant après Reset
-      Serial.println(F("Commande 'Reset' reçue"));
-      // Reset tout
-      cr.champs.Ts = MIN_TS_SEC;
-      cr.champs.nb_echantillons = 0;
-      cr.champs.temperature = -1;
-      cr.champs.humidite = -1;
-      temperature = -1;
-      humidite = -1;
-      break;
-    default:
       // Sinon, c'est probablement un numéro de registre
       if ((data >= 0) && (data < NB_REGISTRES))
       {
         adrReg = data;
+        // Mémoriser le temps du noeud au moment de la requête
+        if (adrReg == REG_TICK_COURANT)
+          cr->champs.tick_courant = millis();
       }
       else
       {
@@ -249,32 +459,43 @@ void i2c_receiveEvent(int n)
     // taux d'échantillonnage.
     uint8_t data1 = Wire.read();
     uint8_t data2 = Wire.read();
-
-    if ((data1 == static_cast<uint8_t>(CMD::ChangeTs)) && (data2 >= MIN_TS_SEC) && (data2 <= MAX_TS_SEC))
-    {
-      Serial.println(F("Commande 'Changer Ts' reçue"));
-      cr.champs.Ts = data2;
-      Serial.print(F("La nouvelle valeur est: "));
-      Serial.print(cr.champs.Ts);
-      Serial.println(F(" secondes"));
-    }
-    else if ((data1 == static_cast<uint8_t>(CMD::Pause)) && (data2 >= MIN_PAUSE_SEC) && (data2 <= MAX_PAUSE_SEC))
+    executerCommande2(data1, data2);
+  }
+  else if (n == 3)
+  {
+    // Trois octets reçus: changer Ts avec une valeur sur 2 octets
+    // (ordre little Endian).
+    uint8_t data1 = Wire.read();
+    uint8_t lsb = Wire.read();
+    uint8_t msb = Wire.read();
+    executerCommande3(data1, lsb, msb);
+  }
+  else if ((n >= 4 && n <= 6) && Wire.read() == static_cast<uint8_t>(CMD::Groupe))
+  {
+    // Commande de groupe reçue par l'appel général:
+    //   Groupe, masque des groupes, numéro, commande [, 1 ou 2 octets]
+    uint8_t masque = Wire.read();
+    uint8_t numero = Wire.read();
+    uint8_t data = Wire.read();
+    if (masque & GROUPES)
     {
-      cmd = CMD::Pause;
-      Serial.println(F("Commande 'Pause' reçue"));
-      uint8_t pauseTimeSec = data2;
-      Serial.print(F("Mettre Arduino en pause pendant : "));
-      Serial.print(pauseTimeSec);
-      Serial.println(F(" secondes"));
-
-      wakeUpTime = millis() + pauseTimeSec * 1000;
+      uint8_t arg1 = (n >= 5) ? Wire.read() : 0;
+      uint8_t arg2 = (n == 6) ? Wire.read() : 0;
+      if (n == 4)
+        executerCommande(data);
+      else if (n == 5)
+        executerCommande2(data, arg1);
+      else
+        executerCommande3(data, arg1, arg2);
+      // Accusé de réception relu par le coordonnateur
+      cr->champs.ack = numero;
     }
   }
   else
   {
-    // Ignorer la réception n > 2 octets.
+    // Ignorer les autres réceptions.
     Serial.println(F("Erreur: ce noeud n'accepte\
-    pas de communication/commande à trois octets"));
+    pas cette communication/commande"));
   }
 }
 
@@ -295,7 +516,18 @@ void i2c_requestEvent()
   if ((adrReg >= 0) && (adrReg < NB_REGISTRES))
   {
     Serial.print("");
-    // Envoyer le contenu du registre au coordonnateur
-    Wire.write(cr.regs[adrReg]);
+    // Envoyer le contenu des registres à partir de adrReg. Le coordonnateur
+    // arrête la lecture après le nombre d'octets voulus (un seul pour
+    // read_byte, 4 pour un float ou un tick). Wire refuse un envoi plus
+    // grand que son tampon (BUFFER_LENGTH, 32 octets).
+    uint8_t n = NB_REGISTRES - adrReg;
+    Wire.write(&cr->regs[adrReg], n < BUFFER_LENGTH ? n : BUFFER_LENGTH);
+    // Le registre des changements est remis à zéro dès qu'il est lu (seul
+    // ou dans une lecture de tous les registres)
+    if ((adrReg == REG_CHANGEMENTS) || (adrReg == REG_INSTANTANE))
+      cr->champs.changements = 0;
+    // Les agrégats repartent à zéro dès qu'ils sont lus
+    if (adrReg == REG_AGREGATS)
+      cr->champs.nb_agreges = 0;
   }
 }
\ No newline at end of file
@@ -52,6 +52,8 @@ public:
     inline uint32_t GetTs() const { return m_ts; }
     inline uint16_t GetVrmSamples() const { return m_nbSample; }
     inline uint16_t GetLiSamples() const { return m_nbLi; }
+    // Dernier échantillon brut de l'ADC (10 bits)
+    inline int16_t GetAmplitude() const { return d.GetAmplitude(); }
 
     inline uint32_t SetTs(uint32_t ts) { m_ts = ts; }
 
@@ -63,15 +65,18 @@ public:
      * @brief Utiliser Accumulate() de l'objet de classe Calculateur_VRMS
      * pour accumuler les valeurs du capteur sonore.
      * Note: La temporisation est reglé dans la fonction (p. 25 - 26).
+     * @return true si un échantillon de l'ADC a été lu (GetAmplitude())
      */
-    void Accumulate()
+    bool Accumulate()
     {
         static unsigned long start = millis();
         if (millis() - start >= m_ts)
         {
             d.Accumulate();
             start = millis();
+            return true;
         }
+        return false;
     }
 
     /**
@@ -58,6 +58,7 @@ public:
   
   inline uint16_t GetNbSamples() const { return c.GetnbSamples(); }
   inline uint16_t GetTotalSamples() const { return c.GetTotalSamples(); }
+  inline int16_t GetAmplitude() const { return c.GetAmplitude(); }
   inline double GetVrms() const { return c.GetVrms(); }
   inline double GetdBV() const { return c.GetdBV(); }
   inline uint8_t GetAPin() const { return c.GetAPin(); }
@@ -5,15 +5,27 @@
  *  Ce noeud est capable de transférer vers le coordonnateur:
  *
  *    - la valeur du niveau d'exposition sonore (Leq);
- *    - le numéro de l'échantillon.
+ *    - le numéro de l'échantillon;
+ *    - le temps du noeud (millis) de l'échantillon et de la requête;
+ *    - tous ses registres en une seule lecture (copie cohérente);
+ *    - le min, le max et la moyenne des échantillons depuis la
+ *      dernière lecture de ces agrégats.
  *
  *  De plus, le noeud est capable de recevoir les commandes suivantes
  *  du coordonnateur:
- *    - ChangeTs: changer le taux d'échantillonnage
+ *    - ChangeTs: changer le taux d'échantillonnage (valeur sur 1 ou 2 octets)
  *    - Stop: arrêter l'échantillonnage;
  *    - Go: démarrer l'échantillonnage.
  *    - Reset: réinitialiser le neud
  *    - Pause: mettre neud en pause pendant nombre de seconds spécifié
+ *    - Groupe: une des commandes précédentes envoyée à plusieurs noeuds
+ *      par l'appel général (adresse 0x00), avec accusé de réception.
+ *    - Flux: envoyer (1) ou non (0) les échantillons bruts de l'ADC sur
+ *      le port série, en trames binaires (voir capture_adc.py).
+ *
+ *  Le noeud envoie une impulsion sur la broche PIN_PRET dès qu'un nouvel
+ *  échantillon est publié: le coordonnateur attend ce front au lieu de
+ *  lire les noeuds à intervalle fixe.
  *
  *  Dans cet exemple, l'arrêt de l'échantillonnage remet à zéro le numéro
  *  de l'échantillon.
@@ -49,7 +61,29 @@ Calculateur_Leq leq(TS_INIT, NB_SAMPLE, NB_LI);
    Globales pour la communication I2C
    ------------------------------------------------------------------ */
 const uint8_t ADR_NOEUD{0x45}; // Adresse I2C de ce noeud
-const uint8_t NB_REGISTRES{7}; // Nombre de registres de ce noeud
+const uint8_t NB_REGISTRES{34}; // Nombre de registres de ce noeud
+const uint8_t REG_CHANGEMENTS{7}; // Adresse du registre des changements
+const uint8_t REG_ACK{8};         // Adresse du registre d'accusé de réception
+const uint8_t REG_TICK_COURANT{13}; // Tick (ms) mémorisé au choix de ce registre
+const uint8_t REG_TS_LARGE{17};     // Ts sur 2 octets
+const uint8_t REG_GENERATION{19};   // Numéro de la copie publiée
+const uint8_t REG_INSTANTANE{0};     // Début d'une lecture de tous les registres
+const uint8_t REG_AGREGATS{20};     // Agrégats (remis à zéro à la lecture)
+
+// Ligne "données prêtes": impulsion à chaque échantillon publié. Relier la
+// broche à un GPIO du Pi (une ligne par noeud) avec un diviseur de tension
+// (5 V -> 3,3 V).
+const uint8_t PIN_PRET{8};
+const uint8_t DUREE_IMPULSION_US{50};
+
+// Groupes de ce noeud pour les commandes de groupe (appel général, adresse
+// 0x00). Une commande de groupe est exécutée si son masque contient au moins
+// un de ces bits (0x02: acoustique, voir I2C_GROUPES dans constants.py).
+const uint8_t GROUPES{0x02};
+
+// Bit du registre des changements: Leq a changé depuis la dernière lecture
+// de ce registre par le coordonnateur (remis à zéro à la lecture).
+const uint8_t CHG_LEQ{0x01};
 
 /* La carte des registres ------------------------------------------- */
 union CarteRegistres
@@ -65,6 +99,27 @@ union CarteRegistres
     // Leq mesuréee par sur l'Arduino
     // (4 octets)
     volatile float Leq;
+    // Champs modifiés depuis la dernière lecture de ce registre (1 octet)
+    volatile uint8_t changements;
+    // Numéro de la dernière commande de groupe exécutée (1 octet)
+    volatile uint8_t ack;
+    // millis() au moment du dernier échantillon (4 octets)
+    volatile uint32_t tick_echantillon;
+    // millis() au moment où le coordonnateur a choisi le registre
+    // REG_TICK_COURANT (4 octets). Sert à synchroniser les horloges.
+    volatile uint32_t tick_courant;
+    // Période d'échantillonnage sur 2 octets, changée par la commande
+    // ChangeTs à 3 octets (Ts ci-dessus est limité à 255)
+    volatile uint16_t ts_large;
+    // Incrémenté à chaque publication d'un échantillon (1 octet)
+    volatile uint8_t generation;
+    // Agrégats des Leq publiés depuis la dernière lecture de REG_AGREGATS
+    // par le coordonnateur (remis à zéro à la lecture): nombre (2 octets)
+    // puis min, max et moyenne énergétique (3 x 4 octets)
+    volatile uint16_t nb_agreges;
+    volatile float leq_min;
+    volatile float leq_max;
+    volatile float leq_moy;
   } champs;
   // Ce tableau: Utilisé par le coordonnateur pour lire et écrire
   //             des données.
@@ -77,10 +132,38 @@ enum class CMD
   Stop = 0xA1,
   Go = 0xA2,
   Reset = 0xA3,
-  Pause = 0xA4
+  Pause = 0xA4,
+  Groupe = 0xA6,
+  Flux = 0xA7
 }; // Commandes venant du coordonnateur
 
-union CarteRegistres cr; // Une carte des registres
+/* Flux des échantillons bruts de l'ADC ------------------------------
+   Trame binaire (little Endian) envoyée sur le port série:
+     0xA5 0x5A              synchronisation
+     seq (1 octet)          numéro de la trame (détecte les pertes)
+     n (1 octet)            nombre d'échantillons (NB_ECH_TRAME)
+     tick (4 octets)        millis() du dernier échantillon de la trame
+     n x adc (2 octets)     échantillons de l'ADC (0 à 1023)
+     somme (2 octets)       Fletcher-16 de seq à la fin des échantillons
+   Les messages texte sont suspendus pendant le flux. */
+const uint8_t SYNC_TRAME[2]{0xA5, 0x5A};
+const uint8_t NB_ECH_TRAME{32};
+volatile bool flux = false;      // Flux activé par la commande Flux
+struct __attribute__((packed))
+{
+  uint8_t seq;
+  uint8_t n;
+  uint32_t tick;
+  uint16_t adc[NB_ECH_TRAME];
+} trame;
+uint8_t nbTrame = 0;             // Échantillons dans la trame courante
+
+// Deux copies de la carte des registres. Le coordonnateur lit toujours la
+// copie publiée (*cr). Un nouvel échantillon est écrit dans l'autre copie,
+// puis publiée en changeant le pointeur: une lecture en bloc des registres
+// (servie en une seule interruption) ne mélange jamais deux échantillons.
+union CarteRegistres tampons[2];
+union CarteRegistres * volatile cr = &tampons[0];
 float Leq;               // Variable intermédiaire pour mémoriser la Leq
 uint8_t adrReg;          // Adresse du registre reçue du coordonnateur
 
@@ -90,6 +173,13 @@ uint32_t wakeUpTime = -1; // Temps à reveiller l'Arduino après commande pause
 
 const uint8_t MIN_TS_SEC{5};   // Période de pause min (sec)
 const uint8_t MAX_TS_SEC{200}; // Période de pause max (sec)
+const uint16_t MIN_TS_LARGE{5};    // Ts min. de la commande à 3 octets (ms)
+const uint16_t MAX_TS_LARGE{1000}; // Ts max. de la commande à 3 octets (ms)
+// Ts min. pendant le flux (ms): fs ~ 1 kHz pour la pondération A/C et les
+// bandes d'octave (ponderation_acoustique.py). millis() avance par pas de
+// 1,024 ms en moyenne (timer 0), d'où fs ~ 976 Hz. Le Ts revient à
+// MIN_TS_LARGE à la fin du flux.
+const uint16_t MIN_TS_FLUX{1};
 
 const uint8_t MIN_PAUSE_SEC{5};      // Période d'échantillonnage min (sec)
 const uint8_t MAX_PAUSE_SEC{100000}; // Période d'échantillonnage max (sec)
@@ -108,9 +198,16 @@ void setup()
   waitUntil(2000);
 
   // Initialiser les champs de la carte des registres
-  cr.champs.Ts = TS_INIT;
-  cr.champs.nb_echantillons = 0;
-  cr.champs.Leq = -1;
+  cr->champs.Ts = TS_INIT;
+  cr->champs.ts_large = TS_INIT;
+  cr->champs.nb_echantillons = 0;
+  cr->champs.Leq = -1;
+  cr->champs.changements = 0;
+  cr->champs.ack = 0;
+  cr->champs.tick_echantillon = 0;
+  cr->champs.tick_courant = 0;
+  cr->champs.generation = 0;
+  cr->champs.nb_agreges = 0;
   Leq = -1;
 
   // Initialiser les variables de contrôle de la
@@ -119,10 +216,15 @@ void setup()
   adrReg = -1;
   // Réglage de la bibliothèque Wire pour le I2C
   Wire.begin(ADR_NOEUD);
+  // Accepter aussi l'appel général (adresse 0x00) pour les commandes de groupe
+  TWAR |= _BV(TWGCE);
   // Fonction pour traiter la réception de données venant du coordonnateur
   Wire.onReceive(i2c_receiveEvent);
   // Fonction pour traiter une requête de données venant du coordonnateur
   Wire.onRequest(i2c_requestEvent);
+  // Ligne "données prêtes" au repos
+  pinMode(PIN_PRET, OUTPUT);
+  digitalWrite(PIN_PRET, LOW);
 
   // Indiquer que le noeud est prêt
   Serial.print(F("Noeud à l'adresse 0x"));
@@ -135,7 +237,7 @@ void setup()
    ------------------------------------------------------------------ */
 void loop()
 {
-  // Lire Leq interne si la commande est Go et le temps cr.champs.Ts
+  // Lire Leq interne si la commande est Go et le temps cr->champs.Ts
   // est écoulé depuis la dernière lecutre (indiqué par la valeur de
   // retour de leq.Compute())
 
@@ -143,12 +245,19 @@ void loop()
   {
     // L'objet leq "sait" à quel moment il doit accumuler les valeurs
     // du signal sonore. Accumulate est applé toujours alors.
-    leq.Accumulate();
+    if (leq.Accumulate())
+    {
+      if (flux)
+        ajouterTrame(leq.GetAmplitude());
+      else
+        nbTrame = 0;    // une trame commence avec le flux
+    }
 
     if (leq.Compute())
     // ... L'objet leq sait à quels moments il faut calculer Vrms, Li et Leq
     {
       Leq = leq.GetLeq();
+      uint32_t tick = millis();
 
       // Section critique: empêcher les interruptions lors de l'assignation
       // de la valeur de Leq à la variable dans la carte des registres.
@@ -156,21 +265,230 @@ void loop()
       //                 la section critique.
       ATOMIC_BLOCK(ATOMIC_RESTORESTATE)
       {
-        // Assigner Leq lue dans cr.champs.Leq
-        cr.champs.Leq = Leq;
+        // Préparer la copie suivante à partir de la copie publiée (elle
+        // contient les changements faits par les commandes)
+        union CarteRegistres *suivant = (cr == &tampons[0]) ? &tampons[1] : &tampons[0];
+        memcpy(suivant->regs, cr->regs, NB_REGISTRES);
+        // Signaler au coordonnateur que Leq a changé
+        if (Leq != suivant->champs.Leq)
+          suivant->champs.changements |= CHG_LEQ;
+        // Assigner Leq lue dans suivant->champs.Leq
+        suivant->champs.Leq = Leq;
+        // Temps du noeud à la fin de l'intervalle du Leq
+        suivant->champs.tick_echantillon = tick;
         // Augmenter le compte du nombre d'échantillons
-        cr.champs.nb_echantillons++;
+        suivant->champs.nb_echantillons++;
+        // Ajouter le Leq aux agrégats
+        if (suivant->champs.nb_agreges < 0xFFFF)
+          suivant->champs.nb_agreges++;
+        agreger(suivant->champs.nb_agreges, Leq, suivant->champs.leq_min,
+                suivant->champs.leq_max, suivant->champs.leq_moy);
+        // Publier la nouvelle copie (la génération 0 veut dire: aucun
+        // échantillon publié, elle est sautée au retour à zéro)
+        if (++suivant->champs.generation == 0)
+          suivant->champs.generation = 1;
+        cr = suivant;
+      }
+      // Signaler le nouvel échantillon au coordonnateur
+      signalerPret();
+      if (!flux)
+      {
+        Serial.print(F("#"));
+        Serial.print(cr->champs.nb_echantillons);
+        Serial.print(F("  "));
+        Serial.println(cr->champs.Leq);
       }
-      Serial.print(F("#"));
-      Serial.print(cr.champs.nb_echantillons);
-      Serial.print(F("  "));
-      Serial.println(cr.champs.Leq);
     }
   }
   else if (cmd == CMD::Pause && millis() >= wakeUpTime)
   {
     cmd = CMD::Go;
-    Serial.println(F("Redémarrer Arduino après pause"));
+    if (!flux)
+      Serial.println(F("Redémarrer Arduino après pause"));
+  }
+}
+
+/* ------------------------------------------------------------------
+   signalerPret()
+   Envoyer une impulsion sur la ligne "données prêtes". Le coordonnateur
+   détecte le front montant et lit le noeud.
+   ------------------------------------------------------------------ */
+void signalerPret()
+{
+  digitalWrite(PIN_PRET, HIGH);
+  delayMicroseconds(DUREE_IMPULSION_US);
+  digitalWrite(PIN_PRET, LOW);
+}
+
+/* ------------------------------------------------------------------
+   ajouterTrame(int16_t adc)
+   Ajouter un échantillon de l'ADC à la trame courante et envoyer la
+   trame sur le port série quand elle est pleine.
+   ------------------------------------------------------------------ */
+void ajouterTrame(int16_t adc)
+{
+  trame.adc[nbTrame++] = adc;
+  if (nbTrame < NB_ECH_TRAME)
+    return;
+  trame.n = NB_ECH_TRAME;
+  trame.tick = millis();
+  // Somme de contrôle Fletcher-16 de seq à la fin des échantillons
+  const uint8_t *octets = reinterpret_cast<const uint8_t *>(&trame);
+  uint16_t s1 = 0, s2 = 0;
+  for (uint8_t i = 0; i < sizeof(trame); ++i)
+  {
+    s1 = (s1 + octets[i]) % 255;
+    s2 = (s2 + s1) % 255;
+  }
+  uint16_t somme = (s2 << 8) | s1;
+  Serial.write(SYNC_TRAME, sizeof(SYNC_TRAME));
+  Serial.write(octets, sizeof(trame));
+  Serial.write(reinterpret_cast<const uint8_t *>(&somme), sizeof(somme));
+  trame.seq++;
+  nbTrame = 0;
+}
+
+/* ------------------------------------------------------------------
+   agreger(n, v, vmin, vmax, vmoy)
+   Ajouter le niveau v (dB, n-ième valeur depuis la remise à zéro) au
+   minimum, au maximum et à la moyenne. Les niveaux sont moyennés en
+   énergie: vmoy = 10 log10(moyenne de 10^(v/10)).
+   ------------------------------------------------------------------ */
+void agreger(uint16_t n, float v, volatile float &vmin, volatile float &vmax,
+             volatile float &vmoy)
+{
+  if (n <= 1)
+  {
+    vmin = vmax = vmoy = v;
+    return;
+  }
+  if (v < vmin)
+    vmin = v;
+  if (v > vmax)
+    vmax = v;
+  float e = pow(10.0, vmoy / 10.0);
+  e += (pow(10.0, v / 10.0) - e) / n;
+  vmoy = 10.0 * log10(e);
+}
+
+/* ------------------------------------------------------------------
+   executerCommande(uint8_t data)
+   Exécuter une commande à un octet (Stop, Go ou Reset) reçue seule
+   ou dans une commande de groupe. Retourne false si data n'est pas
+   une commande à un octet.
+   ------------------------------------------------------------------ */
+bool executerCommande(uint8_t data)
+{
+  switch (data)
+  {
+  case static_cast<uint8_t>(CMD::Stop):
+    cmd = CMD::Stop;
+    if (!flux)
+      Serial.println(F("Commande 'Arrêter' reçue"));
+    break;
+  case static_cast<uint8_t>(CMD::Go):
+    cmd = CMD::Go;
+    cr->champs.nb_echantillons = 0;
+    if (!flux)
+      Serial.println(F("Commande 'Démarrer' reçue"));
+    break;
+  case static_cast<uint8_t>(CMD::Reset):
+    // cmd n'est pas mise à CMD::Reset parce que l'execution
+    // doit continuer comme avant après Reset
+    if (!flux)
+      Serial.println(F("Commande 'Reset' reçue"));
+    // Reset tout sauf Ts: le Ts est choisi par le coordonnateur (contrôle
+    // de Ts) et doit rester celui utilisé pour l'échantillonnage
+    cr->champs.nb_echantillons = 0;
+    cr->champs.nb_agreges = 0;
+    cr->champs.Leq = -1;
+    cr->champs.changements = CHG_LEQ;
+    Leq = -1;
+    break;
+  default:
+    return false;
+  }
+  return true;
+}
+
+/* ------------------------------------------------------------------
+   changerTs(uint16_t ts)
+   Assigner une nouvelle période d'échantillonnage (commande ChangeTs
+   à 2 ou à 3 octets).
+   ------------------------------------------------------------------ */
+void changerTs(uint16_t ts)
+{
+  cr->champs.Ts = (ts > 255) ? 255 : ts;
+  cr->champs.ts_large = ts;
+  leq.SetTs((uint32_t)ts);
+  // Pas de message texte pendant le flux (trames binaires)
+  if (flux)
+    return;
+  Serial.println(F("Commande 'Changer Ts' reçue"));
+  Serial.print(F("La nouvelle valeur est: "));
+  Serial.print(cr->champs.ts_large);
+  Serial.println(F(" secondes"));
+
+  Serial.print(F("Nouveau tp = ts * nbVrmsSamples * nbLiSamples = "));
+  Serial.print(leq.GetTs());
+  Serial.print(F(" * "));
+  Serial.print(leq.GetVrmSamples() / 1000.0);
+  Serial.print(F(" * "));
+  Serial.print(leq.GetLiSamples());
+  Serial.print(F(" s = "));
+  Serial.print((leq.GetTs() * leq.GetVrmSamples() / 1000.0) * leq.GetLiSamples() / 60.0);
+  Serial.println(F(" min"));
+}
+
+/* ------------------------------------------------------------------
+   executerCommande2(uint8_t data1, uint8_t data2)
+   Exécuter une commande à deux octets (ChangeTs, Pause ou Flux) reçue seule
+   ou dans une commande de groupe.
+   ------------------------------------------------------------------ */
+void executerCommande2(uint8_t data1, uint8_t data2)
+{
+  if ((data1 == static_cast<uint8_t>(CMD::ChangeTs)) && (data2 >= MIN_TS_SEC) && (data2 <= MAX_TS_SEC))
+  {
+    changerTs(data2);
+  }
+  else if ((data1 == static_cast<uint8_t>(CMD::Pause)) && (data2 >= MIN_PAUSE_SEC) && (data2 <= MAX_PAUSE_SEC))
+  {
+    cmd = CMD::Pause;
+    uint8_t pauseTimeSec = data2;
+    if (!flux)
+    {
+      Serial.println(F("Commande 'Pause' reçue"));
+      Serial.print(F("Mettre Arduino en pause pendant : "));
+      Serial.print(pauseTimeSec);
+      Serial.println(F(" secondes"));
+    }
+
+    wakeUpTime = millis() + pauseTimeSec * 1000;
+  }
+  else if (data1 == static_cast<uint8_t>(CMD::Flux))
+  {
+    if (data2 && !flux)
+      Serial.println(F("Commande 'Flux' reçue"));
+    flux = (data2 != 0);
+    // Ts sous MIN_TS_LARGE permis seulement pendant le flux
+    if (!flux && cr->champs.ts_large < MIN_TS_LARGE)
+      changerTs(MIN_TS_LARGE);
+  }
+}
+
+/* ------------------------------------------------------------------
+   executerCommande3(uint8_t data1, uint8_t lsb, uint8_t msb)
+   Exécuter une commande à trois octets (ChangeTs avec une période sur
+   2 octets, de MIN_TS_LARGE, ou de MIN_TS_FLUX pendant le flux, à
+   MAX_TS_LARGE) reçue seule ou dans une commande de groupe.
+   ------------------------------------------------------------------ */
+void executerCommande3(uint8_t data1, uint8_t lsb, uint8_t msb)
+{
+  uint16_t ts = lsb | (static_cast<uint16_t>(msb) << 8);
+  uint16_t tsMin = flux ? MIN_TS_FLUX : MIN_TS_LARGE;
+  if ((data1 == static_cast<uint8_t>(CMD::ChangeTs)) && (ts >= tsMin) && (ts <= MAX_TS_LARGE))
+  {
+    changerTs(ts);
   }
 }
 
@@ -193,32 +511,15 @@ void i2c_receiveEvent(int n)
     // numéro d'un registre demandé par le coordonnateur.
     uint8_t data = Wire.read();
 
-    switch (data)
+    if (!executerCommande(data))
     {
-    case static_cast<uint8_t>(CMD::Stop):
-      cmd = CMD::Stop;
-      Serial.println(F("Commande 'Arrêter' reçue"));
-      break;
-    case static_cast<uint8_t>(CMD::Go):
-      cmd = CMD::Go;
-      cr.champs.nb_echantillons = 0;
-      Serial.println(F("Commande 'Démarrer' reçue"));
-      break;
-    case static_cast<uint8_t>(CMD::Reset):
-      // cmd n'est pas mise à CMD::Reset parce que l'execution
-      // doit continuer comme avant après Reset
-      Serial.println(F("Commande 'Reset' reçue"));
-      // Reset tout
-      cr.champs.Ts = MIN_TS_SEC;
-      cr.champs.nb_echantillons = 0;
-      cr.champs.Leq = -1;
-      Leq = -1;
-      break;
-    default:
       // Sinon, c'est probablement un numéro de registre
       if ((data >= 0) && (data < NB_REGISTRES))
       {
         adrReg = data;
+        // Mémoriser le temps du noeud au moment de la requête
+        if (adrReg == REG_TICK_COURANT)
+          cr->champs.tick_courant = millis();
       }
       else
       {
@@ -232,43 +533,44 @@ void i2c_receiveEvent(int n)
     // taux d'échantillonnage.
     uint8_t data1 = Wire.read();
     uint8_t data2 = Wire.read();
-
-    if ((data1 == static_cast<uint8_t>(CMD::ChangeTs)) && (data2 >= MIN_TS_SEC) && (data2 <= MAX_TS_SEC))
-    {
-      Serial.println(F("Commande 'Changer Ts' reçue"));
-      cr.champs.Ts = data2;
-      leq.SetTs((uint32_t)data2);
-      Serial.print(F("La nouvelle valeur est: "));
-      Serial.print(cr.champs.Ts);
-      Serial.println(F(" secondes"));
-
-      Serial.print(F("Nouveau tp = ts * nbVrmsSamples * nbLiSamples = "));
-      Serial.print(leq.GetTs());
-      Serial.print(F(" * "));
-      Serial.print(leq.GetVrmSamples() / 1000.0);
-      Serial.print(F(" * "));
-      Serial.print(leq.GetLiSamples());
-      Serial.print(F(" s = "));
-      Serial.print((leq.GetTs() * leq.GetVrmSamples() / 1000.0) * leq.GetLiSamples() / 60.0);
-      Serial.println(F(" min"));
-    }
-    else if ((data1 == static_cast<uint8_t>(CMD::Pause)) && (data2 >= MIN_PAUSE_SEC) && (data2 <= MAX_PAUSE_SEC))
+    executerCommande2(data1, data2);
+  }
+  else if (n == 3)
+  {
+    // Trois octets reçus: changer Ts avec une valeur sur 2 octets
+    // (ordre little Endian).
+    uint8_t data1 = Wire.read();
+    uint8_t lsb = Wire.read();
+    uint8_t msb = Wire.read();
+    executerCommande3(data1, lsb, msb);
+  }
+  else if ((n >= 4 && n <= 6) && Wire.read() == static_cast<uint8_t>(CMD::Groupe))
+  {
+    // Commande de groupe reçue par l'appel général:
+    //   Groupe, masque des groupes, numéro, commande [, 1 ou 2 octets]
+    uint8_t masque = Wire.read();
+    uint8_t numero = Wire.read();
+    uint8_t data = Wire.read();
+    if (masque & GROUPES)
     {
-      cmd = CMD::Pause;
-      Serial.println(F("Commande 'Pause' reçue"));
-      uint8_t pauseTimeSec = data2;
-      Serial.print(F("Mettre Arduino en pause pendant : "));
-      Serial.print(pauseTimeSec);
-      Serial.println(F(" secondes"));
-
-      wakeUpTime = millis() + pauseTimeSec * 1000;
+      uint8_t arg1 = (n >= 5) ? Wire.read() : 0;
+      uint8_t arg2 = (n == 6) ? Wire.read() : 0;
+      if (n == 4)
+        executerCommande(data);
+      else if (n == 5)
+        executerCommande2(data, arg1);
+      else
+        executerCommande3(data, arg1, arg2);
+      // Accusé de réception relu par le coordonnateur
+      cr->champs.ack = numero;
     }
   }
   else
   {
-    // Ignorer la réception n > 2 octets.
-    Serial.println(F("Erreur: ce noeud n'accepte\
-    pas de communication/commande à trois octets"));
+    // Ignorer les autres réceptions.
+    if (!flux)
+      Serial.println(F("Erreur: ce noeud n'accepte\
+    pas cette communication/commande"));
   }
 }
 
@@ -289,7 +591,18 @@ void i2c_requestEvent()
   if ((adrReg >= 0) && (adrReg < NB_REGISTRES))
   {
     Serial.print("");
-    // Envoyer le contenu du registre au coordonnateur
-    Wire.write(cr.regs[adrReg]);
+    // Envoyer le contenu des registres à partir de adrReg. Le coordonnateur
+    // arrête la lecture après le nombre d'octets voulus (un seul pour
+    // read_byte, 4 pour un float ou un tick). Wire refuse un envoi plus
+    // grand que son tampon (BUFFER_LENGTH, 32 octets).
+    uint8_t n = NB_REGISTRES - adrReg;
+    Wire.write(&cr->regs[adrReg], n < BUFFER_LENGTH ? n : BUFFER_LENGTH);
+    // Le registre des changements est remis à zéro dès qu'il est lu (seul
+    // ou dans une lecture de tous les registres)
+    if ((adrReg == REG_CHANGEMENTS) || (adrReg == REG_INSTANTANE))
+      cr->champs.changements = 0;
+    // Les agrégats repartent à zéro dès qu'ils sont lus
+    if (adrReg == REG_AGREGATS)
+      cr->champs.nb_agreges = 0;
   }
 }
\ No newline at end of file